@@ -1,10 +1,37 @@
 import os # основные операции над файлами моей ОС
 import tkinter as tk # для создания графического интерфейса (окна и элементы GUI)
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, filedialog
 from datetime import datetime # для работы с датами (отображение даты изменения, запись времени, изменение времени)
 import platform # определение операционной системы (Windows)
 import subprocess # запуск внешних программ для открытия файлов
 import webbrowser
+import threading # фоновое сканирование папок, чтобы не замораживать окно
+import queue # передача результатов из фоновых потоков в главный цикл Tk
+import time
+import re
+import tempfile
+import shutil
+import atexit
+from core import ( # вся работа с файловой системой - в модуле без tkinter
+    ArchiveCache, ArchiveNode, COMPLETION_MAX_ITEMS, CompletionIndex, ContentSearcher, DiskListingCache,
+    DriveNode, DuplicateFinder, FileNode, FileOpJob, FileOperationEngine, FilenameIndex, FolderNode,
+    FolderSizeEngine, GREP_MAX_FILE_SIZE, ListingCache, NavigationHistory, PREFETCH_DEPTH,
+    PREFETCH_MAX_FOLDERS, PREFETCH_MAX_TOTAL, PREVIEW_THUMB_SIZE, Prefetcher, PreviewEngine,
+    SCAN_CHUNK_SIZE, SEARCH_MAX_RESULTS, SORT_CACHE_MIN_ENTRIES, ScanTask, StatFetcher, ThumbnailCache,
+    ViewSnapshot, WATCH_MAX_DIRS, archive_root, create_watcher, descend_path, entry_bytes, format_size,
+    is_archive_name, is_lazy_filesystem, load_drives, make_child_node, pattern_names, probe_drives,
+    profiled, profiler, resolve_path, scan_directory, sorted_position, view_sort_key,
+)
+
+
+UI_POLL_MS = 30 # как часто главный цикл забирает результаты фоновых потоков
+UI_BUDGET = 0.015 # сколько секунд максимум тратим на очередь за один тик
+PROFILE_REFRESH_MS = 500 # как часто обновлять строку профилирования
+PREVIEW_DELAY_MS = 120 # фокус должен задержаться на строке, прежде чем файл читается для просмотра
+PREVIEW_WIDTH = 320
+ROW_HEIGHT = 30 # высота строки дерева, по ней считаем сколько строк видно
+VIRTUAL_OVERSCAN = 20 # сколько строк держим в дереве сверх видимых сверху и снизу
+PARENT_ROW = ".." # строка перехода в родительскую папку в списке отображения
 
 
 class AdvancedFileManager:
@@ -15,8 +42,68 @@ class AdvancedFileManager:
         self.root.geometry("1200x800") # ширина и высота окна начальная
 
         # Система навигации
-        self.nav_history = []  # создаем список для хранения истории посещенных папок, паттерн снимок
-        self.history_index = -1 # индекс текущей позиции в истории - начальное значение, паттерн снимок
+        self.history = NavigationHistory() # снимки вида посещенных папок, паттерн снимок
+        self.restore_snapshot = None # снимок, который применить, когда папка будет прочитана
+
+        # Фоновые задачи
+        self.ui_queue = queue.Queue() # сюда потоки кладут функции, которые надо выполнить в главном цикле
+        self.scan_task = None # текущее фоновое сканирование
+        self.listing_cache = ListingCache() # прочитанные папки с вытеснением давно не используемых
+        self.disk_cache = DiskListingCache.open() # те же списки на диске, переживают перезапуск
+        self.watcher = create_watcher(lambda events: self.post(self.on_fs_events, events))
+        self.watched_nodes = {} # путь -> папка, за которой следит наблюдатель
+        self.filename_index = FilenameIndex() # имена из всех прочитанных папок для поиска
+        self.size_engine = FolderSizeEngine(on_listing=self.filename_index.replace_dir) # рекурсивные размеры папок
+        self.size_job = None
+        self.size_roots = {} # путь -> папка на экране, размер которой считается
+        self.folder_sizes = {} # папка -> (байт, подсчет закончен)
+        self.reveal_name = None # имя, на которое поставить фокус после загрузки папки
+        self.placeholders = {} # путь -> узел папки, созданный по пути до чтения родителя
+        self.prefetcher = Prefetcher(lambda *args: self.post(self.on_prefetched, *args),
+                                     busy=lambda: self.scan_task is not None)
+        self.prefetched = {} # папка, прочитанная заранее и еще не открытая -> число записей
+        self.prefetch_hits = 0
+        self.stat_fetcher = StatFetcher(lambda *args: self.post(self.on_stats, *args))
+        self.stat_requested = set() # узлы открытой папки, для которых уже запрошен stat
+        self.stat_outstanding = 0 # сколько из них еще без ответа
+        self.completion_index = CompletionIndex(lambda path: self.post(self.on_completion_ready, path))
+        self.search_window = None
+        self.content_searcher = ContentSearcher() # поиск по содержимому файлов
+        self.grep_job = None
+        self.grep_window = None
+        self.duplicate_finder = DuplicateFinder() # поиск одинаковых файлов
+        self.dup_job = None
+        self.dup_window = None
+        self.file_ops = FileOperationEngine() # копирование, перенос и удаление в фоне
+        self.file_jobs = [] # поставленные и еще не законченные операции
+        self.file_clipboard = None # ("copy" или "move", пути) или ("extract", (архив, пути внутри)) для "Вставить"
+        self.archive_cache = ArchiveCache() # оглавления открытых архивов
+        self.archives = {} # путь файла архива -> узел, открытый как папка
+        self.archive_temp = None # папка для файлов, распакованных, чтобы открыть их программой
+        self.preview_engine = PreviewEngine(lambda *result: self.post(self.on_preview, *result),
+                                            ThumbnailCache.open())
+        self.preview_stamp = None # (узел, mtime, размер) записи, просмотр которой показан или готовится
+        self.preview_generation = None # номер запроса, результат которого ждем
+        self.preview_after = None
+        self.preview_photo = None # картинка должна жить, пока показана
+
+        # Виртуальный список: в Treeview живут только видимые строки
+        self.view_items = [] # полный отсортированный список строк текущей папки
+        self.view_node = None # папка, для которой собран view_items
+        self.window_start = 0 # индекс первой строки, созданной в Treeview
+        self.window_end = 0 # индекс после последней созданной строки
+        self.view_top = 0 # индекс первой видимой строки
+        self.focus_index = None # индекс строки с фокусом в view_items
+        self.selected = set() # выбранные узлы, строк многих из них в Treeview нет
+        self.select_anchor = None # узел, от которого Shift выделяет диапазон
+        self.view_batching = False # идет пачка изменений - перерисовка откладывается
+        self.sort_column = "name" # колонка сортировки: name, type, size или modified
+        self.sort_reverse = False
+        self.view_mode = None # (колонка, по убыванию), в которых собран view_items
+        self.view_dirty = None # наименьший индекс, измененный за пачку
+        self.row_nodes = {} # iid строки Treeview -> узел, который она показывает
+        self.row_stamps = {} # iid -> (имя, размер, дата), с которыми строка нарисована
+        self.rewindow_pending = False
 
         # визуал и стиль приложения
         self.setup_styles() # метод для настройки внешнего вида виджетов
@@ -26,10 +113,17 @@ class AdvancedFileManager:
 
         # загрузка данных файловой системы о дисках ОС
         self.load_real_drives() # загрузка информации о файлах
+        self.history.push(ViewSnapshot(self.root_node.path, self.sort_column, self.sort_reverse))
 
         # отображение данных первое
         self.update_display() # Обновление интерфейса с загруженными данными
 
+        # запуск обработки результатов фоновых потоков
+        self.root.after(UI_POLL_MS, self.process_ui_queue)
+
+        # наблюдение за изменениями в прочитанных папках
+        self.watcher.start()
+
     def setup_styles(self):
         """Настраивает стили для виджетов"""
         # объект для работы со стилями
@@ -42,7 +136,7 @@ class AdvancedFileManager:
         style.configure("Treeview",
                         background="#808080", #фон
                         foreground="#F8F8FF", #текст
-                        rowheight=30,
+                        rowheight=ROW_HEIGHT,
                         fieldbackground="#F8F8FF", # данные
                         bordercolor="#cccccc",
                         borderwidth=1)
@@ -109,6 +203,16 @@ class AdvancedFileManager:
         ttk.Button(action_frame, text="Удалить", command=self.delete_item).pack(side=tk.LEFT, padx=2)
         ttk.Button(action_frame, text="Переименовать", command=self.rename_item).pack(side=tk.LEFT, padx=2)
         ttk.Button(action_frame, text="Обновить", command=self.refresh).pack(side=tk.LEFT, padx=2)
+        ttk.Button(action_frame, text="Поиск в файлах", command=self.search_content).pack(side=tk.LEFT, padx=2)
+        ttk.Button(action_frame, text="Дубликаты", command=self.find_duplicates).pack(side=tk.LEFT, padx=2)
+
+        self.folder_sizes_var = tk.BooleanVar(value=False) # считать ли размеры папок
+        ttk.Checkbutton(action_frame, text="Размер папок", variable=self.folder_sizes_var,
+                        command=self.start_folder_sizes).pack(side=tk.LEFT, padx=2)
+
+        self.preview_var = tk.BooleanVar(value=True) # показывать ли панель просмотра
+        ttk.Checkbutton(action_frame, text="Просмотр", variable=self.preview_var,
+                        command=self.toggle_preview).pack(side=tk.LEFT, padx=2)
 
         # Поле пути
         self.path_var = tk.StringVar() # текущий путь
@@ -118,15 +222,39 @@ class AdvancedFileManager:
         ttk.Label(path_frame, text="Путь:").pack(side=tk.LEFT)
         path_entry = ttk.Entry(path_frame, textvariable=self.path_var) # поля ввода
         path_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5) # растягивает на всю ширину поле
+        path_entry.bind("<Return>", lambda e: self.go_to_path())
+        path_entry.bind("<KeyRelease>", self.on_path_key)
+        path_entry.bind("<Tab>", lambda e: self.accept_completion())
+        path_entry.bind("<Down>", lambda e: self.focus_completion())
+        path_entry.bind("<Escape>", lambda e: self.cancel_path_edit())
+        path_entry.bind("<FocusIn>", lambda e: self.warm_completion())
+        path_entry.bind("<FocusOut>", lambda e: self.root.after(100, self.hide_completion_if_unfocused))
+        self.path_entry = path_entry
+
+        # Подсказки к полю пути - список прямо под ним
+        self.completion_list = tk.Listbox(self.root, height=COMPLETION_MAX_ITEMS, activestyle="none")
+        self.completion_list.bind("<Return>", lambda e: self.accept_completion())
+        self.completion_list.bind("<Tab>", lambda e: self.accept_completion())
+        self.completion_list.bind("<Double-1>", lambda e: self.accept_completion())
+        self.completion_list.bind("<Escape>", lambda e: self.cancel_path_edit())
+        self.completion_shown = False
+
+        # Поиск по именам во всех прочитанных папках
+        self.search_var = tk.StringVar()
+        search_entry = ttk.Entry(path_frame, textvariable=self.search_var, width=30)
+        search_entry.pack(side=tk.RIGHT, padx=5)
+        search_entry.bind("<Return>", lambda e: self.search_files())
+        ttk.Label(path_frame, text="Поиск:").pack(side=tk.RIGHT)
 
         # Дерево файлов
-        self.tree = ttk.Treeview(main_frame, columns=("type", "size", "modified"), selectmode="browse")
+        self.tree = ttk.Treeview(main_frame, columns=("type", "size", "modified"), selectmode="extended")
 
         # Настройка колонок
-        self.tree.heading("#0", text="Имя", anchor=tk.W)
-        self.tree.heading("type", text="Тип", anchor=tk.W)
-        self.tree.heading("size", text="Размер", anchor=tk.W)
-        self.tree.heading("modified", text="Изменен", anchor=tk.W)
+        self.tree.heading("#0", text="Имя", anchor=tk.W, command=lambda: self.sort_by("name"))
+        self.tree.heading("type", text="Тип", anchor=tk.W, command=lambda: self.sort_by("type"))
+        self.tree.heading("size", text="Размер", anchor=tk.W, command=lambda: self.sort_by("size"))
+        self.tree.heading("modified", text="Изменен", anchor=tk.W, command=lambda: self.sort_by("modified"))
+        self.update_sort_headings()
 
         self.tree.column("#0", width=400)
         self.tree.column("type", width=150)
@@ -134,26 +262,82 @@ class AdvancedFileManager:
         self.tree.column("modified", width=150)
 
         # Полосы прокрутки
-        vsb = ttk.Scrollbar(main_frame, orient="vertical", command=self.tree.yview) # вертикальная
+        # вертикальная показывает позицию во всем списке, а не в созданных строках
+        self.vsb = ttk.Scrollbar(main_frame, orient="vertical", command=self.on_scrollbar)
         hsb = ttk.Scrollbar(main_frame, orient="horizontal", command=self.tree.xview) # горизонтальная
-        self.tree.configure(yscrollcommand=vsb.set, xscrollcommand=hsb.set) # привязывание скроллов к дереву
+        self.tree.configure(yscrollcommand=self.on_tree_yscroll, xscrollcommand=hsb.set) # привязывание скроллов к дереву
+
+        # Панель просмотра записи с фокусом
+        self.preview_frame = ttk.Frame(main_frame, width=PREVIEW_WIDTH)
+        self.preview_frame.pack_propagate(False) # ширина не зависит от содержимого
+        self.preview_title = tk.StringVar()
+        ttk.Label(self.preview_frame, textvariable=self.preview_title, wraplength=PREVIEW_WIDTH - 10).pack(fill=tk.X)
+        self.preview_image = ttk.Label(self.preview_frame, anchor=tk.CENTER)
+        self.preview_text = tk.Text(self.preview_frame, wrap=tk.NONE, font="TkFixedFont", state=tk.DISABLED)
 
         # Размещение элементов
+        self.preview_frame.pack(side=tk.RIGHT, fill=tk.Y, padx=(5, 0)) # просмотр справа
         self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True) # дерево слева, расстягивается
-        vsb.pack(side=tk.RIGHT, fill=tk.Y) # справа скролл вертикаль
+        self.vsb.pack(side=tk.RIGHT, fill=tk.Y) # справа скролл вертикаль
         hsb.pack(side=tk.BOTTOM, fill=tk.X) # снизу скролл горизонт
 
         # Привязка событий
         self.tree.bind("<Double-1>", self.on_double_click) # двойной клик
         self.tree.bind("<Return>", self.on_double_click) # ENTER
+        self.tree.bind("<<TreeviewSelect>>", self.on_tree_select)
+        self.root.bind("<Control-i>", lambda e: self.show_cache_stats())
+        self.root.bind("<F12>", lambda e: self.toggle_profiler())
+        self.root.bind_all("<Key>", lambda e: self.prefetcher.touch(), add="+") # ввод - не время читать заранее
+        self.tree.bind("<Configure>", lambda e: self.render_window(self.view_top)) # изменилась высота окна
+
+        # Клавиши перемещения обрабатываем сами: соседней строки может не быть в Treeview
+        self.tree.bind("<Up>", lambda e: self.move_focus(-1))
+        self.tree.bind("<Down>", lambda e: self.move_focus(1))
+        self.tree.bind("<Prior>", lambda e: self.move_focus(-self.visible_row_count()))
+        self.tree.bind("<Next>", lambda e: self.move_focus(self.visible_row_count()))
+        self.tree.bind("<Home>", lambda e: self.move_focus(-len(self.view_items)))
+        self.tree.bind("<End>", lambda e: self.move_focus(len(self.view_items)))
+        self.tree.bind("<Shift-Up>", lambda e: self.move_focus(-1, extend=True))
+        self.tree.bind("<Shift-Down>", lambda e: self.move_focus(1, extend=True))
+        self.tree.bind("<Shift-Prior>", lambda e: self.move_focus(-self.visible_row_count(), extend=True))
+        self.tree.bind("<Shift-Next>", lambda e: self.move_focus(self.visible_row_count(), extend=True))
+        self.tree.bind("<Shift-Home>", lambda e: self.move_focus(-len(self.view_items), extend=True))
+        self.tree.bind("<Shift-End>", lambda e: self.move_focus(len(self.view_items), extend=True))
+        self.tree.bind("<Control-a>", lambda e: self.select_all())
+
+        # Выделение мышью тоже ведем сами: Treeview знает только о созданных строках
+        self.tree.bind("<Button-1>", self.on_tree_click)
+
+        # Буфер обмена файлов
+        self.tree.bind("<Control-c>", lambda e: self.copy_items())
+        self.tree.bind("<Control-x>", lambda e: self.cut_items())
+        self.tree.bind("<Control-v>", lambda e: self.paste_items())
+        self.tree.bind("<Delete>", lambda e: self.delete_item())
 
         # Контекстное меню
         self.setup_context_menu()
 
         # Статус бар
+        status_frame = ttk.Frame(self.root)
+        status_frame.pack(fill=tk.X, side=tk.BOTTOM)
         self.status_var = tk.StringVar()
-        status_bar = ttk.Label(self.root, textvariable=self.status_var, style="Status.TLabel")
-        status_bar.pack(fill=tk.X, side=tk.BOTTOM)
+        status_bar = ttk.Label(status_frame, textvariable=self.status_var, style="Status.TLabel")
+        status_bar.pack(fill=tk.X, side=tk.LEFT, expand=True)
+
+        # Прогресс файловых операций, виден только пока они идут
+        self.job_frame = ttk.Frame(status_frame)
+        self.job_var = tk.StringVar()
+        ttk.Label(self.job_frame, textvariable=self.job_var, style="Status.TLabel").pack(side=tk.LEFT)
+        self.job_pause_btn = ttk.Button(self.job_frame, text="Пауза", command=self.toggle_file_job_pause)
+        self.job_pause_btn.pack(side=tk.LEFT, padx=2)
+        ttk.Button(self.job_frame, text="Отмена", command=self.cancel_file_job).pack(side=tk.LEFT, padx=2)
+
+        # Разбивка последней операции по стадиям, включается F12
+        self.profile_frame = ttk.Frame(self.root)
+        self.profile_var = tk.StringVar()
+        ttk.Label(self.profile_frame, textvariable=self.profile_var, style="Status.TLabel").pack(
+            side=tk.LEFT, fill=tk.X, expand=True)
+        ttk.Button(self.profile_frame, text="Трасса...", command=self.export_trace).pack(side=tk.LEFT, padx=2)
 
     def setup_context_menu(self):
         """Создает контекстное меню"""
@@ -163,6 +347,11 @@ class AdvancedFileManager:
         self.context_menu.add_separator()
         self.context_menu.add_command(label="Копировать путь", command=self.copy_path)
         self.context_menu.add_separator()
+        self.context_menu.add_command(label="Копировать", command=self.copy_items)
+        self.context_menu.add_command(label="Вырезать", command=self.cut_items)
+        self.context_menu.add_command(label="Вставить", command=self.paste_items)
+        self.context_menu.add_command(label="Извлечь...", command=self.extract_selected)
+        self.context_menu.add_separator()
         self.context_menu.add_command(label="Удалить", command=self.delete_item)
         self.context_menu.add_command(label="Переименовать", command=self.rename_item)
 
@@ -172,261 +361,1831 @@ class AdvancedFileManager:
         """Показывает контекстное меню"""
         item = self.tree.identify_row(event.y)
         if item:
-            self.tree.selection_set(item)
+            if self.row_nodes.get(item) not in self.selected:
+                self.select_index(self.window_start + self.tree.index(item))
             self.context_menu.post(event.x_root, event.y_root)
 
     def load_real_drives(self):
-        """Загружает реальные диски компьютера"""
-        self.root_node = {
-            "path": "Этот компьютер",
-            "name": "Этот компьютер",
-            "type": "computer",
-            "parent": None
-        }
-
-        # Получаем список дисков
-        if os.name == 'nt':  # Windows
-            import string
-            drives = [f"{d}:\\" for d in string.ascii_uppercase if os.path.exists(f"{d}:\\")]
-        else:  # Linux/Mac
-            drives = ["/"]
-
-        self.root_node["children"] = []
-
-        for drive in drives:
-            drive_name = drive
-            if os.name == 'nt':
-                try:
-                    import win32api
-                    label = win32api.GetVolumeInformation(drive)[0]
-                    if label:
-                        drive_name = f"{drive} ({label})"
-                except:
-                    pass
-
-            self.root_node["children"].append({
-                "path": drive,
-                "name": drive_name,
-                "type": "drive",
-                "parent": self.root_node
-            })
-
+        """Загружает реальные диски компьютера (метки и емкость придут позже)"""
+        self.root_node = load_drives()
         self.current_node = self.root_node
+        probe_drives(self.root_node.children, lambda *args: self.post(self.on_drive_probed, *args))
+
+    def reload_drives(self):
+        """Перечитывает список дисков: новые добавляются, пропавшие убираются, узлы остальных остаются"""
+        fresh = {drive.path: drive for drive in load_drives().children}
+        computer = self.root_node
+        for drive in list(computer.children):
+            if drive.path not in fresh:
+                self.listing_cache.discard(drive)
+                drive.forget_children()
+                computer.remove_child(drive)
+        for path, drive in fresh.items():
+            if computer.find_child(path) is None:
+                computer.add_children([DriveNode(path, path, computer, drive.fstype)])
+        probe_drives(computer.children, lambda *args: self.post(self.on_drive_probed, *args))
+
+    def on_drive_probed(self, drive, info):
+        """Диск ответил (или не ответил вовремя - info is None)"""
+        if info is None:
+            if drive.capacity is None:
+                drive.capacity = ()
+        else:
+            drive.label, drive.capacity = info
+        self.view_update(drive)
 
     def get_node_children(self, node):
-        """Возвращает дочерние элементы для узла"""
-        if "children" in node:
-            return node["children"]
+        """Возвращает дочерние элементы для узла (пока идет загрузка - уже полученную часть)"""
+        if self.prefetched.pop(node, None) is not None:
+            self.prefetch_hits += 1
+        if node.children is None:
+            self.listing_cache.lookup(node) # промах - папку придется читать
+            self.start_scan(node)
+        elif not node.loading and node.type != "computer":
+            self.listing_cache.lookup(node)
+        return node.children
+
+    def post(self, func, *args):
+        """Передает вызов из фонового потока в главный цикл Tk"""
+        self.ui_queue.put((func, args))
+
+    def process_ui_queue(self):
+        """Выполняет вызовы из фоновых потоков, не дольше UI_BUDGET за тик"""
+        deadline = time.monotonic() + UI_BUDGET
+        try:
+            while time.monotonic() < deadline:
+                func, args = self.ui_queue.get_nowait()
+                func(*args)
+        except queue.Empty:
+            pass
+        self.root.after(UI_POLL_MS, self.process_ui_queue)
+
+    def pinned_nodes(self):
+        """Папки, которые нельзя вытеснять: текущая, читаемая и все их родители"""
+        pinned = set()
+        nodes = [self.current_node]
+        if self.scan_task:
+            nodes.append(self.scan_task.node)
+        for node in nodes:
+            while node is not None and node not in pinned:
+                pinned.add(node)
+                node = node.parent
+        return pinned
+
+    def show_cache_stats(self):
+        """Показывает счетчики кэша папок"""
+        stats = self.listing_cache.stats()
+        messagebox.showinfo("Кэш папок",
+                            f"Папок: {stats['folders']}\n"
+                            f"Записей: {stats['entries']} из {stats['max_entries']}\n"
+                            f"Память: {self.format_size(stats['bytes'])} из {self.format_size(stats['max_bytes'])}\n"
+                            f"Попадания: {stats['hits']}, промахи: {stats['misses']} "
+                            f"({stats['hit_rate']:.0%})\n"
+                            f"Вытеснено: {stats['evictions']}\n"
+                            f"Прочитано заранее: {self.prefetcher.reads}, пригодилось: {self.prefetch_hits}"
+                            + self.disk_cache_stats())
+
+    def toggle_profiler(self):
+        """Включает или выключает замеры и строку с разбивкой по стадиям"""
+        profiler.enabled = not profiler.enabled
+        if profiler.enabled:
+            profiler.clear()
+            self.profile_frame.pack(fill=tk.X, side=tk.BOTTOM)
+            self.update_profile_overlay()
+        else:
+            self.profile_frame.pack_forget()
 
-        children = []
-        path = node["path"]
+    def update_profile_overlay(self):
+        """Обновляет строку профилирования, пока замеры включены"""
+        if not profiler.enabled:
+            return
+        self.profile_var.set(profiler.summary())
+        self.root.after(PROFILE_REFRESH_MS, self.update_profile_overlay)
+
+    def export_trace(self):
+        """Сохраняет накопленные события в файл трассы Chrome"""
+        path = filedialog.asksaveasfilename(title="Сохранить трассу", defaultextension=".json",
+                                            initialfile="trace.json", filetypes=[("Chrome trace", "*.json")])
+        if not path:
+            return
+        try:
+            count = profiler.export(path)
+        except OSError as e:
+            messagebox.showerror("Ошибка", f"Не удалось сохранить трассу: {e}")
+            return
+        messagebox.showinfo("Трасса", f"Сохранено событий: {count}\n{path}\n\nОткройте в chrome://tracing или ui.perfetto.dev")
+
+    def disk_cache_stats(self):
+        """Строки статистики постоянного кэша"""
+        if self.disk_cache is None:
+            return "\n\nКэш на диске выключен"
+        stats = self.disk_cache.stats()
+        return (f"\n\nНа диске: папок {stats['folders']}, {self.format_size(stats['bytes'])}\n"
+                f"Попадания: {stats['hits']}, промахи: {stats['misses']}")
+
+    def start_scan(self, node):
+        """Запускает фоновое сканирование папки"""
+        self.cancel_scan()
+        self.listing_cache.discard(node)
+        node.forget_children()
+        node.children = [] # сюда будут добавляться порции по мере чтения
+        node.loading = True
+
+        archive = archive_root(node)
+        if archive is not None:
+            inner = os.path.relpath(node.path, archive.path)
+            task = ScanTask(node, archive=(archive.path, "" if inner == "." else inner.replace(os.sep, "/")))
+            self.scan_task = task
+            threading.Thread(target=self.run_archive_scan, args=(task,), daemon=True).start()
+            return
+
+        task = ScanTask(node, self.is_lazy_folder(node))
+        self.scan_task = task
+        threading.Thread(target=self.run_scan, args=(task,), daemon=True).start()
 
+    def cancel_scan(self):
+        """Останавливает текущее сканирование, недочитанный список выбрасывается"""
+        task = self.scan_task
+        if task is None:
+            return
+        task.cancel()
+        self.scan_task = None
+        if task.node.loading:
+            task.node.forget_children() # неполный список не кэшируем, при следующем заходе читаем заново
+
+    def run_scan(self, task):
+        """Тело фонового потока: читает папку и отправляет порции в интерфейс
+
+        Если папка есть в кэше на диске и не менялась, интерфейс сразу
+        получает сохраненный список, а чтение только сверяет его с диском.
+        """
+        chunks = []
+        cached = False
         try:
-            with os.scandir(path) as entries:
-                for entry in entries:
-                    try:
-                        if entry.is_dir():
-                            children.append({
-                                "path": entry.path,
-                                "name": entry.name,
-                                "type": "folder",
-                                "parent": node,
-                                "modified": datetime.fromtimestamp(entry.stat().st_mtime)
-                            })
-                        else:
-                            size = entry.stat().st_size
-                            children.append({
-                                "path": entry.path,
-                                "name": entry.name,
-                                "type": "file",
-                                "size": self.format_size(size),
-                                "parent": node,
-                                "modified": datetime.fromtimestamp(entry.stat().st_mtime)
-                            })
-                    except:
-                        continue
-        except:
-            messagebox.showerror("Ошибка", f"Нет доступа к {path}")
-            return None
+            st = os.stat(task.path) # до чтения: изменения во время чтения сделают запись в кэше устаревшей
+            if self.disk_cache is not None:
+                with profiler.span("disk_cache_load"):
+                    entries = self.disk_cache.load(task.path, st)
+                if entries is not None:
+                    cached = True
+                    self.post(self.on_scan_cached, task, entries)
+            for chunk in scan_directory(task.path, task.cancel_event, lazy=task.lazy):
+                chunks.append(chunk)
+                if not cached:
+                    self.post(self.on_scan_chunk, task, chunk)
+        except OSError as e:
+            self.post(self.on_scan_error, task, e)
+            return
+        if not task.cancelled:
+            entries = [entry for chunk in chunks for entry in chunk]
+            self.filename_index.replace_dir(task.path, entries)
+            if self.disk_cache is not None:
+                with profiler.span("disk_cache_store"):
+                    self.disk_cache.store(task.path, st, entries)
+            if cached:
+                self.post(self.on_scan_reconcile, task, entries)
+                return
+        self.post(self.on_scan_done, task)
+
+    def run_archive_scan(self, task):
+        """Тело фонового потока для папки внутри архива: список берется из оглавления"""
+        archive_path, inner = task.archive
+        try:
+            with profiler.span("archive_index", path=archive_path):
+                entries = self.archive_cache.get(archive_path).listing(inner)
+        except OSError as e:
+            self.post(self.on_scan_error, task, e)
+            return
+        for start in range(0, len(entries), SCAN_CHUNK_SIZE):
+            self.post(self.on_scan_chunk, task, entries[start:start + SCAN_CHUNK_SIZE])
+        self.post(self.on_scan_done, task)
+
+    def on_scan_chunk(self, task, chunk):
+        """Добавляет очередную порцию записей в узел и в дерево"""
+        if task.cancelled:
+            return
+
+        node = task.node
+        with profiler.span("nodes"):
+            new_children = [self.make_node(node, name, is_dir, size, mtime) for name, is_dir, size, mtime in chunk]
+            node.add_children(new_children)
+        task.count += len(new_children)
+
+        # Папка на экране - дописываем в конец списка, отсортируем по окончании
+        if node is self.view_node:
+            shown_until = self.view_top + self.visible_row_count() + VIRTUAL_OVERSCAN
+            new_in_window = len(self.view_items) < shown_until
+            self.view_items.extend(new_children)
+            if new_in_window:
+                self.render_window(self.view_top)
+            else:
+                self.update_scrollbar()
+            self.status_var.set(f"Загрузка... прочитано: {task.count} | {self.get_current_path()}")
 
-        node["children"] = children
-        return children
+    def on_scan_done(self, task):
+        """Сканирование завершено"""
+        if task.cancelled:
+            return
+        self.scan_task = None
+        self.finish_listing(task)
+
+    def on_scan_cached(self, task, entries):
+        """Список из кэша на диске - показываем сразу, чтение папки продолжается для сверки"""
+        if task.cancelled:
+            return
+        self.on_scan_chunk(task, entries)
+        self.finish_listing(task)
+
+    def on_scan_reconcile(self, task, entries):
+        """Чтение закончено - приводим показанный из кэша список к тому, что на диске"""
+        if task.cancelled:
+            return
+        self.scan_task = None
+        node = task.node
+        self.begin_view_batch()
+        try:
+            seen = set()
+            for name, is_dir, size, mtime in entries:
+                seen.add(name)
+                child = node.find_child(name)
+                if child is not None and (child.type == "folder") != is_dir:
+                    self.apply_deleted(node, name) # файл заменили папкой или наоборот
+                    child = None
+                if child is None:
+                    child = self.make_node(node, name, is_dir, size, mtime)
+                    node.add_children([child])
+                    self.listing_cache.resize(node, 1, entry_bytes(child))
+                    self.view_insert(child)
+                elif mtime is not None and (child.mtime != mtime or (not is_dir and child.size != size)):
+                    self.update_node(child, mtime, size) # без stat (mtime None) сверяем только имена
+            for child in [child for child in node.children if child.name not in seen]:
+                self.apply_deleted(node, child.name)
+        finally:
+            self.end_view_batch()
+
+    def plan_prefetch(self):
+        """Читаем заранее подпапки текущей папки (видимые первыми), родителя и соседние папки"""
+        node = self.current_node
+        if (node.type == "computer" or node.loading or archive_root(node) is not None
+                or self.prefetch_backlog() >= PREFETCH_MAX_TOTAL):
+            self.prefetcher.plan([])
+            return
+
+        candidates = []
+        focused = self.get_selected_node()
+        if focused is not None and focused is not PARENT_ROW:
+            candidates.append(focused)
+        top = self.view_top
+        candidates.extend(self.view_items[top:top + PREFETCH_MAX_FOLDERS * 4])
+        candidates.extend(self.view_items[:top][-PREFETCH_MAX_FOLDERS:])
+        if node.parent is not None and node.parent.type != "computer":
+            candidates.append(node.parent) # для "Вверх"
+            if node.parent.children and not node.parent.loading:
+                siblings = node.parent.children
+                index = siblings.index(node) if node in siblings else 0
+                candidates.extend(siblings[max(0, index - PREFETCH_MAX_FOLDERS // 2):index + PREFETCH_MAX_FOLDERS // 2])
+
+        targets = []
+        seen = set()
+        for candidate in candidates:
+            if candidate is PARENT_ROW or candidate.type == "file" or candidate in seen:
+                continue
+            seen.add(candidate)
+            if candidate.children is None:
+                targets.append((candidate, candidate.path, 1, self.is_lazy_folder(candidate)))
+                if len(targets) >= PREFETCH_MAX_FOLDERS:
+                    break
+        self.prefetcher.plan(targets)
+
+    def prefetch_focus(self):
+        """Фокус сдвинулся: чтение заранее ждет, папка под курсором - первая в очереди"""
+        self.prefetcher.touch()
+        node = self.get_selected_node()
+        if (node is not None and node is not PARENT_ROW and node.type == "folder" and node.children is None
+                and archive_root(node) is None):
+            self.prefetcher.boost((node, node.path, 1, self.is_lazy_folder(node)))
+
+    def prefetch_backlog(self):
+        """Записей в прочитанных заранее папках, которые еще не открывали и кэш не вытеснил"""
+        for node in [node for node in self.prefetched if node not in self.listing_cache]:
+            del self.prefetched[node]
+        return sum(self.prefetched.values())
+
+    def on_prefetched(self, node, path, depth, entries):
+        """Папка прочитана заранее - кладем ее в кэш, как будто ее уже открывали"""
+        if node.children is not None or node.loading or node.path != path:
+            return # уже прочитана обычным путем, или ее переименовали
+        parent = node.parent
+        if parent is None or parent.find_child(node.name) is not node:
+            return # папку удалили, пока читали
+        if self.prefetch_backlog() + len(entries) > PREFETCH_MAX_TOTAL:
+            return
+
+        node.children = []
+        node.add_children([self.make_node(node, name, is_dir, size, mtime) for name, is_dir, size, mtime in entries])
+        self.listing_cache.add(node)
+        self.listing_cache.evict(self.pinned_nodes())
+        self.prefetched[node] = len(entries)
+        self.filename_index.replace_dir(path, entries)
+        self.sync_watches()
+        if depth < PREFETCH_DEPTH:
+            lazy = self.is_lazy_folder(node)
+            self.prefetcher.extend([(child, child.path, depth + 1, lazy) for child in node.children
+                                    if child.type == "folder"][:PREFETCH_MAX_FOLDERS])
+
+    def is_lazy_folder(self, node):
+        """Папка на диске, где stat дорог (сетевые файловые системы): читаем ее без stat"""
+        while node is not None and node.type != "drive":
+            node = node.parent
+        return node is not None and is_lazy_filesystem(node.fstype)
+
+    def request_stats(self):
+        """Запрашивает размер и дату для строк окна, прочитанных без stat
+
+        При сортировке по размеру или дате нужны все записи папки, иначе -
+        только созданные строки: записи, которые ни разу не показывались,
+        так и остаются без stat.
+        """
+        folder = self.view_node
+        if folder is None or folder.type == "computer":
+            return
+        if self.sort_column in ("size", "modified") and not folder.loading:
+            candidates = folder.children or []
+        else:
+            candidates = self.view_items[self.window_start:self.window_end]
+        names = []
+        for node in candidates:
+            if node is not PARENT_ROW and node.mtime is None and node not in self.stat_requested and node.parent is folder:
+                self.stat_requested.add(node)
+                names.append(node.name)
+        if names:
+            self.stat_outstanding += len(names)
+            self.stat_fetcher.request(folder, folder.path, names)
+
+    def on_stats(self, folder, stats):
+        """Пришли размер и дата пачки записей - обновляем строки
+
+        При сортировке по размеру или дате строки не переставляются по одной:
+        список пересортировывается один раз, когда придет последняя пачка.
+        """
+        if folder is not self.view_node:
+            return
+        self.stat_outstanding -= len(stats)
+        resort = self.sort_column in ("size", "modified") and not folder.loading
+        for name, size, mtime in stats:
+            node = folder.find_child(name)
+            if node is None or node.mtime is not None or mtime is None:
+                continue
+            node.mtime = mtime
+            if node.type == "file":
+                node.size = size
+            if not resort:
+                self.view_update(node)
+        folder.child_changed()
+        if resort:
+            self.view_mode = None # список на экране больше не отсортирован - не запоминаем его
+            if self.stat_outstanding <= 0:
+                self.update_display()
+            else:
+                for node in self.view_items[self.window_start:self.window_end]:
+                    self.view_update(node)
+
+    def make_node(self, parent, name, is_dir, size, mtime):
+        """Узел для прочитанной записи, папка, открытая раньше по пути, берется готовой"""
+        if not is_dir:
+            return FileNode(name, parent, size, mtime)
+        child = self.placeholders.pop(os.path.join(parent.path, name), None) if self.placeholders else None
+        if child is None:
+            return FolderNode(name, parent, mtime)
+        child.parent = parent
+        child.mtime = mtime
+        return child
+
+    def finish_listing(self, task):
+        """Список папки готов: в кэш, на экран, отложенные события наблюдателя"""
+        task.node.loading = False
+        self.listing_cache.add(task.node)
+        self.listing_cache.evict(self.pinned_nodes())
+        if task.node is self.current_node:
+            self.update_display() # окончательная отрисовка с сортировкой
+        else:
+            self.sync_watches()
+        if task.pending_events:
+            self.on_fs_events(task.pending_events)
+
+    def sync_watches(self):
+        """Следим за текущей папкой и недавно использованными прочитанными папками"""
+        nodes = list(self.listing_cache.nodes)[-WATCH_MAX_DIRS:]
+        nodes.append(self.current_node)
+        self.watched_nodes = {}
+        wanted = {}
+        for node in nodes:
+            if node.type in ("folder", "drive") and node.children is not None and archive_root(node) is None:
+                path = node.path
+                self.watched_nodes[path] = node
+                wanted[path] = node is self.current_node # текущую папку опрашиваем подробно
+        self.watcher.sync(wanted)
+
+    def on_fs_events(self, events):
+        """Применяет пачку изменений файловой системы, список на экране перерисовывается один раз"""
+        self.begin_view_batch()
+        try:
+            self.apply_fs_events(events)
+        finally:
+            self.end_view_batch()
+
+    def begin_view_batch(self):
+        """Дальше идет много изменений списка - перерисовку откладываем"""
+        self.view_batching = True
+
+    def end_view_batch(self):
+        """Пачка изменений закончена - одна перерисовка"""
+        self.view_batching = False
+        if self.view_dirty is not None:
+            index, self.view_dirty = self.view_dirty, None
+            self.view_changed(index)
+
+    def apply_fs_events(self, events):
+        """Применяет изменения файловой системы к кэшу и к списку на экране"""
+        seen = set()
+        moved_folders = False
+        for event in events:
+            if event in seen: # например, серия записей в один лог
+                continue
+            seen.add(event)
+            kind, folder_path, name, new_folder_path, new_name = event
+
+            if kind == "overflow":
+                self.refresh() # события потеряны - перечитываем то, что на экране
+                continue
+
+            parent = self.watched_nodes.get(folder_path)
+            if kind == "rescan":
+                if parent is self.current_node:
+                    self.refresh()
+                elif parent is not None and not parent.loading:
+                    self.listing_cache.drop_subtree(parent, evicted=False)
+                continue
+            if parent is not None and parent.loading:
+                if self.scan_task and self.scan_task.node is parent:
+                    self.scan_task.pending_events.append(event) # применим после чтения
+                continue
+            if parent is not None and parent.children is None:
+                parent = None # список уже вытеснен из кэша
+
+            if kind == "moved":
+                new_parent = self.watched_nodes.get(new_folder_path)
+                if new_parent is not None and (new_parent.loading or new_parent.children is None):
+                    new_parent = None
+                moved_folders |= self.apply_moved(parent, name, new_parent, new_name)
+                continue
+            if parent is None:
+                continue
+
+            self.size_engine.invalidate(folder_path) # файл мог измениться без смены mtime папки
+            if kind == "created":
+                self.apply_created(parent, name)
+            elif kind == "deleted":
+                self.apply_deleted(parent, name)
+            else:
+                self.apply_modified(parent, name)
+
+        if moved_folders:
+            self.sync_watches() # у переехавших папок сменились пути
+
+    def apply_created(self, parent, name):
+        """Появилась новая запись"""
+        if parent.find_child(name) is not None:
+            self.apply_modified(parent, name) # уже знаем о ней (например, создали сами)
+            return
+        child = make_child_node(parent, name)
+        if child is None:
+            return
+        parent.add_children([child])
+        self.listing_cache.resize(parent, 1, entry_bytes(child))
+        self.filename_index.add(parent.path, name, child.type == "folder")
+        self.view_insert(child)
+
+    def apply_deleted(self, parent, name):
+        """Запись удалена"""
+        child = parent.find_child(name)
+        if child is None:
+            return
+        self.view_remove(child)
+        parent.remove_child(child)
+        if child.type == "folder":
+            self.listing_cache.drop_subtree(child, evicted=False)
+            self.filename_index.remove_tree(child.path)
+        self.listing_cache.resize(parent, -1, -entry_bytes(child))
+        self.filename_index.remove(parent.path, name)
+
+    def apply_modified(self, parent, name):
+        """Изменились размер или дата записи"""
+        child = parent.find_child(name)
+        if child is None:
+            self.apply_created(parent, name)
+            return
+        try:
+            st = os.stat(child.path)
+        except OSError:
+            return
+        self.update_node(child, st.st_mtime, st.st_size)
+
+    def update_node(self, node, mtime, size):
+        """Меняет дату и размер узла, строка переезжает, если от них зависит сортировка"""
+        index = self.view_index(node) if self.sort_column in ("size", "modified") else None
+        if index is None:
+            node.mtime = mtime
+            if node.type == "file":
+                node.size = size
+            node.parent.child_changed()
+            self.view_update(node)
+            return
+
+        # Ищем строку по старому ключу, поэтому убираем ее до изменения
+        selected = node in self.selected
+        focused = self.focus_index == index
+        self.view_remove(node)
+        node.mtime = mtime
+        if node.type == "file":
+            node.size = size
+        node.parent.child_changed()
+        self.view_insert(node)
+        if selected:
+            self.selected.add(node)
+        if focused:
+            self.focus_index = self.view_index(node)
+
+    def apply_moved(self, old_parent, old_name, new_parent, new_name):
+        """Запись переименована или перенесена, True - если переехала папка"""
+        if old_parent is None or new_parent is not old_parent:
+            # Перенос между папками - удаление в одной и создание в другой
+            child = old_parent.find_child(old_name) if old_parent else None
+            if old_parent is not None:
+                self.apply_deleted(old_parent, old_name)
+            if new_parent is not None:
+                self.apply_created(new_parent, new_name)
+            return child is not None and child.type == "folder"
+
+        child = old_parent.find_child(old_name)
+        if child is None:
+            self.apply_created(new_parent, new_name) # уже переименовали сами
+            return False
+        if old_parent.find_child(new_name) is not None:
+            self.apply_deleted(old_parent, new_name) # переименование поверх существующей записи
+        was_selected = child in self.selected
+        self.view_remove(child)
+        old_path = child.path
+        old_bytes = entry_bytes(child)
+        old_parent.rename_child(child, new_name)
+        self.filename_index.rename(old_parent.path, old_name, new_name)
+        if child.type == "folder":
+            self.filename_index.move_tree(old_path, child.path)
+        self.listing_cache.resize(old_parent, 0, entry_bytes(child) - old_bytes)
+        self.view_insert(child)
+        if was_selected:
+            self.selected.add(child) # после группового переименования выделение остается
+        return child.type == "folder"
+
+    def on_scan_error(self, task, error):
+        """Не удалось прочитать папку"""
+        if task.cancelled:
+            return
+        node = task.node
+        self.listing_cache.discard(node) # мог попасть в кэш из списка на диске
+        node.forget_children()
+        self.scan_task = None
+        if node is self.current_node:
+            self.status_var.set(f"Нет доступа | {self.get_current_path()}")
+            if task.archive is not None:
+                messagebox.showerror("Ошибка", error.strerror or str(error))
+            else:
+                messagebox.showerror("Ошибка", f"Нет доступа к {node.path}")
 
     def format_size(self, size):
         """Форматирует размер файла"""
-        for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-            if size < 1024.0:
-                return f"{size:.1f} {unit}"
-            size /= 1024.0
-        return f"{size:.1f} PB"
+        return format_size(size)
 
     def update_display(self):
         """Обновляет отображение файловой системы"""
-        self.tree.delete(*self.tree.get_children())
         self.path_var.set(self.get_current_path())
 
         # Обновляем состояние кнопок навигации
-        self.back_btn.state(['!disabled' if self.history_index > 0 else 'disabled'])
-        self.forward_btn.state(['!disabled' if self.history_index < len(self.nav_history) - 1 else 'disabled'])
+        self.back_btn.state(['!disabled' if self.history.can_back else 'disabled'])
+        self.forward_btn.state(['!disabled' if self.history.can_forward else 'disabled'])
         self.up_btn.state(['!disabled' if self.current_node != self.root_node else 'disabled'])
 
+        # Уходим из папки, которая еще читается - ее сканирование больше не нужно
+        if self.scan_task and self.scan_task.node is not self.current_node:
+            self.cancel_scan()
+
+        self.remember_view_order()
+
+        # Та же папка - сохраняем позицию прокрутки, новая - начинаем сверху (или с места из истории)
+        top = self.view_top if self.view_node is self.current_node else 0
+        snapshot = self.restore_snapshot
+        if snapshot is not None and self.current_node.children is not None and not self.current_node.loading:
+            top = snapshot.top
+        if self.view_node is not self.current_node:
+            self.focus_index = None
+            self.selected = set()
+            self.select_anchor = None
+            self.stat_fetcher.cancel()
+            self.stat_requested = set()
+            self.stat_outstanding = 0
+        self.view_node = self.current_node
+        self.view_items = []
+
         # Получаем дочерние элементы
         children = self.get_node_children(self.current_node)
         if children is None:
+            self.render_window(0)
             return
 
-        # Добавляем элементы в дерево
-        if self.current_node["type"] == "computer":
+        # Собираем полный список строк, в дерево попадет только видимое окно
+        if self.current_node.type == "computer":
             # Показываем диски
-            for child in sorted(children, key=lambda x: x["name"]):
-                self.add_tree_item("", child)
+            self.view_items.extend(sorted(children, key=lambda x: x.name))
         else:
             # Добавляем родительскую ссылку (кроме корня)
             if self.current_node != self.root_node:
-                self.tree.insert("", "end", text="..", values=("Папка", "", ""))
+                self.view_items.append(PARENT_ROW)
+
+            # Сначала папки, потом файлы, внутри - по выбранной колонке
+            self.view_items.extend(self.sorted_children(self.current_node))
+            # Во время чтения порции дописываются в конец без сортировки - такой список не запоминаем
+            self.view_mode = None if self.current_node.loading else (self.sort_column, self.sort_reverse)
+
+        self.render_window(top)
+        self.update_status()
+        self.sync_watches()
+        self.start_folder_sizes()
+        self.plan_prefetch()
+
+        # Возврат по истории - фокус и выделение, когда папка прочитана
+        if self.restore_snapshot is not None and not self.current_node.loading:
+            self.restore_snapshot = None
+            self.restore_selection(snapshot)
+
+        # Переход из поиска - ставим фокус на найденную запись, когда папка прочитана
+        if self.reveal_name and not self.current_node.loading:
+            child = self.current_node.find_child(self.reveal_name)
+            self.reveal_name = None
+            if child is not None:
+                self.focus_node(child)
+
+    def sorted_children(self, node):
+        """Дети папки в порядке текущей сортировки, у больших папок порядок запоминается"""
+        mode = (self.sort_column, self.sort_reverse)
+        if node.orders is not None and mode in node.orders:
+            return node.orders[mode]
+        key = lambda child: view_sort_key(child, self.sort_column)
+        with profiler.span("sort", entries=len(node.children)):
+            folders = sorted((c for c in node.children if c.type == "folder"), key=key, reverse=self.sort_reverse)
+            files = sorted((c for c in node.children if c.type == "file"), key=key, reverse=self.sort_reverse)
+        order = folders + files
+        if len(order) >= SORT_CACHE_MIN_ENTRIES and not node.loading:
+            if node.orders is None:
+                node.orders = {}
+            node.orders[mode] = order
+        return order
+
+    def remember_view_order(self):
+        """Список на экране поддерживается в порядке при изменениях - сохраняем его как порядок папки"""
+        node = self.view_node
+        if node is None or node.type == "computer" or node.loading or node.children is None or self.view_mode is None:
+            return
+        order = self.view_items[self.view_offset():]
+        if len(order) >= SORT_CACHE_MIN_ENTRIES and len(order) == len(node.children):
+            if node.orders is None:
+                node.orders = {}
+            node.orders[self.view_mode] = order
+
+    @profiled("sort_by")
+    def sort_by(self, column):
+        """Щелчок по заголовку: сортировка по колонке, повторный щелчок меняет направление"""
+        self.remember_view_order()
+        if column == self.sort_column:
+            self.sort_reverse = not self.sort_reverse
+        else:
+            self.sort_column = column
+            self.sort_reverse = False
+        focused = self.get_selected_node()
+        selected = self.selected
+        self.update_sort_headings()
+        self.update_display()
+        if focused is not None and focused is not PARENT_ROW:
+            self.focus_node(focused) # строка с фокусом остается видна на новом месте
+        self.selected = selected # выделение не зависит от порядка
+        self.render_selection()
+        self.update_status()
+
+    def update_sort_headings(self):
+        """Стрелка у заголовка колонки сортировки"""
+        titles = {"#0": ("name", "Имя"), "type": ("type", "Тип"), "size": ("size", "Размер"),
+                  "modified": ("modified", "Изменен")}
+        for column, (mode, title) in titles.items():
+            if mode == self.sort_column:
+                title += " ▼" if self.sort_reverse else " ▲"
+            self.tree.heading(column, text=title)
+
+    def view_key(self, node):
+        return view_sort_key(node, self.sort_column)
+
+    def start_folder_sizes(self):
+        """Запускает подсчет размеров папок текущего списка (если включен)"""
+        if self.size_job:
+            self.size_job.cancel()
+            self.size_job = None
+        self.folder_sizes = {}
+        self.size_roots = {}
+
+        node = self.current_node
+        if (self.folder_sizes_var.get() and node.type != "computer" and not node.loading and node.children
+                and archive_root(node) is None):
+            for child in node.children:
+                if child.type == "folder":
+                    self.size_roots[child.path] = child
+            if self.size_roots:
+                self.size_job = self.size_engine.start(
+                    list(self.size_roots), lambda *args: self.post(self.on_folder_sizes, *args))
+
+        self.render_window(self.view_top) # убрать или показать колонку размеров папок
+
+    def on_folder_sizes(self, job, totals, finished):
+        """Промежуточные суммы размеров папок"""
+        if job is not self.size_job:
+            return
+        for path, total in totals.items():
+            node = self.size_roots.get(path)
+            if node is not None:
+                self.folder_sizes[node] = (total, path in finished)
+                self.view_update(node)
+
+    def update_status(self):
+        """Обновляет статус бар"""
+        children = self.current_node.children or []
+        if self.current_node.loading:
+            self.status_var.set(f"Загрузка... прочитано: {len(children)} | {self.get_current_path()}")
+            return
 
-            # Сортируем: сначала папки, потом файлы
-            folders = [c for c in children if c["type"] == "folder"]
-            files = [c for c in children if c["type"] == "file"]
+        selected = f" | Выбрано: {len(self.selected)}" if len(self.selected) > 1 else ""
+        self.status_var.set(f"Элементов: {len(children)}{selected} | {self.get_current_path()}")
+        self.schedule_preview()
+        self.prefetch_focus()
 
-            # Добавляем папки
-            for child in sorted(folders, key=lambda x: x["name"]):
-                self.add_tree_item("", child)
+    def toggle_preview(self):
+        """Показывает или прячет панель просмотра"""
+        if self.preview_var.get():
+            self.preview_frame.pack(side=tk.RIGHT, fill=tk.Y, padx=(5, 0), before=self.tree)
+            self.schedule_preview()
+        else:
+            self.preview_frame.pack_forget()
+            self.preview_engine.cancel()
+            self.preview_stamp = None
 
-            # Добавляем файлы
-            for child in sorted(files, key=lambda x: x["name"]):
-                self.add_tree_item("", child)
+    def schedule_preview(self):
+        """Просмотр записи с фокусом с задержкой: пока фокус бежит по списку, файлы не читаются"""
+        if not self.preview_var.get():
+            return
+        node = self.get_selected_node()
+        if node is PARENT_ROW:
+            node = None
+        stamp = (node, node.mtime, getattr(node, "size", None)) if node is not None else None
+        if stamp == self.preview_stamp:
+            return
+        self.preview_stamp = stamp
+        if self.preview_after is not None:
+            self.root.after_cancel(self.preview_after)
+        self.preview_after = self.root.after(PREVIEW_DELAY_MS, self.start_preview, node)
+
+    def start_preview(self, node):
+        """Файл уходит в фоновый поток, для папки все известно сразу"""
+        self.preview_after = None
+        if node is None or node.type != "file":
+            self.preview_engine.cancel()
+            self.preview_generation = None
+            if node is None:
+                self.show_preview("", None)
+            elif node.children is not None and not node.loading:
+                self.show_preview(node.name, f"Папка\nЭлементов: {len(node.children)}")
+            else:
+                self.show_preview(node.name, "Папка")
+            return
+        if archive_root(node) is not None:
+            self.preview_engine.cancel()
+            self.preview_generation = None
+            self.show_preview(node.name, f"Файл в архиве\n{self.format_size(node.size or 0)}")
+            return
+        self.preview_title.set(node.name)
+        self.preview_generation = self.preview_engine.request(node.path)
+
+    def on_preview(self, generation, path, result):
+        """Результат фонового потока: текст или картинка"""
+        if generation != self.preview_generation:
+            return # фокус уже на другой записи
+        name = os.path.basename(path)
+        kind = result["kind"]
+        if kind == "text":
+            self.show_preview(name, result["text"] + ("\n…" if result["truncated"] else ""))
+        elif kind == "binary":
+            self.show_preview(name, "Двоичный файл")
+        elif kind == "error":
+            self.show_preview(name, f"Не удалось прочитать: {result['message']}")
+        else:
+            try:
+                photo = tk.PhotoImage(data=result["data"])
+            except tk.TclError:
+                self.show_preview(name, "Не удалось показать картинку")
+                return
+            if not result["scaled"]:
+                # Без PIL уменьшаем здесь: Tk работает только в главном потоке
+                factor = max(1, -(-max(photo.width(), photo.height()) // PREVIEW_THUMB_SIZE))
+                if factor > 1:
+                    photo = photo.subsample(factor)
+                self.preview_engine.store_thumbnail(result["key"], lambda file: photo.write(file, format="png"))
+            self.show_preview(name, None, photo)
+
+    def show_preview(self, title, text, photo=None):
+        """Показывает в панели текст или картинку"""
+        self.preview_title.set(title)
+        self.preview_photo = photo
+        if photo is not None:
+            self.preview_text.pack_forget()
+            self.preview_image.configure(image=photo)
+            self.preview_image.pack(fill=tk.BOTH, expand=True)
+            return
+        self.preview_image.pack_forget()
+        self.preview_image.configure(image="")
+        self.preview_text.configure(state=tk.NORMAL)
+        self.preview_text.delete("1.0", tk.END)
+        if text:
+            self.preview_text.insert("1.0", text)
+        self.preview_text.configure(state=tk.DISABLED)
+        self.preview_text.pack(fill=tk.BOTH, expand=True)
+
+    def view_offset(self):
+        """С какого индекса в view_items начинаются узлы (пропускаем "..")"""
+        return 1 if self.view_items and self.view_items[0] is PARENT_ROW else 0
+
+    def view_index(self, node):
+        """Индекс узла в списке на экране, None - если его там нет"""
+        if node.parent is not self.view_node:
+            return None
+        if self.view_node.type == "computer": # диски идут не по сортировке, их немного
+            return self.view_items.index(node) if node in self.view_items else None
+        index = sorted_position(self.view_items, node, self.view_key, self.sort_reverse, lo=self.view_offset())
+        if index < len(self.view_items) and self.view_items[index] is node:
+            return index
+        return None
+
+    def view_insert(self, node):
+        """Вставляет узел в список на экране на его место по сортировке"""
+        if node.parent is not self.view_node or self.view_node.type == "computer":
+            return
+        index = sorted_position(self.view_items, node, self.view_key, self.sort_reverse, lo=self.view_offset(), right=True)
+        self.view_items.insert(index, node)
+        if self.focus_index is not None and index <= self.focus_index:
+            self.focus_index += 1
+        self.view_changed(index)
+
+    def view_remove(self, node):
+        """Убирает узел из списка на экране"""
+        index = self.view_index(node)
+        if index is None:
+            return
+        del self.view_items[index]
+        self.selected.discard(node)
+        if self.focus_index == index:
+            self.focus_index = None
+        elif self.focus_index is not None and index < self.focus_index:
+            self.focus_index -= 1
+        self.view_changed(index)
+
+    def view_update(self, node):
+        """Перерисовывает строку узла, если она сейчас создана в Treeview"""
+        index = self.view_index(node)
+        if index is None or not self.window_start <= index < self.window_end:
+            return
+        if self.view_batching:
+            self.view_changed(index) # строки Treeview сейчас не соответствуют списку
+            return
+        iid = self.tree.get_children()[index - self.window_start]
+        text, values = self.format_row(node)
+        self.tree.item(iid, text=text, values=values)
+        self.row_stamps[iid] = self.row_stamp(node)
+
+    def view_changed(self, index):
+        """Список на экране изменился начиная с index - трогаем Treeview только если это видно"""
+        if self.view_batching:
+            self.view_dirty = index if self.view_dirty is None else min(self.view_dirty, index)
+            return
+        if index < self.window_end or self.window_end - self.window_start < self.visible_row_count():
+            self.render_window(self.view_top)
+        else:
+            self.update_scrollbar()
+        self.update_status()
+
+    def visible_row_count(self):
+        """Сколько строк помещается в видимой части дерева"""
+        height = self.tree.winfo_height()
+        if height <= 1: # окно еще не показано
+            return 30
+        return max(1, height // ROW_HEIGHT - 1) # одна строка уходит на заголовки колонок
+
+    def render_window(self, top):
+        """Создает в Treeview только строки вокруг позиции top (плюс запас сверху и снизу)"""
+        total = len(self.view_items)
+        visible = self.visible_row_count()
+        top = max(0, min(top, total - visible))
+        start = max(0, top - VIRTUAL_OVERSCAN)
+        end = min(total, top + visible + VIRTUAL_OVERSCAN)
+
+        self.reconcile_rows(self.view_items[start:end])
+
+        self.window_start, self.window_end, self.view_top = start, end, top
+        if end > start:
+            self.tree.yview_moveto((top - start) / (end - start))
+
+        self.render_selection()
+        self.update_scrollbar()
+        self.request_stats()
+
+    def reconcile_rows(self, items):
+        """Приводит строки Treeview к списку items, трогая только изменившиеся строки"""
+        wanted = set(items)
+        stale = [iid for iid, item in self.row_nodes.items() if item not in wanted]
+        if stale:
+            with profiler.span("tk_delete"):
+                self.tree.delete(*stale)
+            for iid in stale:
+                del self.row_nodes[iid]
+                self.row_stamps.pop(iid, None)
+
+        node_rows = {item: iid for iid, item in self.row_nodes.items()}
+        existing = self.tree.get_children()
+        pointer = 0 # первая строка Treeview, которая еще не сверена
+        for position, item in enumerate(items):
+            iid = node_rows.get(item)
+            if iid is None:
+                # Новая строка
+                if item is PARENT_ROW:
+                    iid = self.tree.insert("", position, text="..", values=("Папка", "", ""))
+                else:
+                    text, values = self.format_row(item)
+                    with profiler.span("tk_insert"):
+                        iid = self.tree.insert("", position, text=text, values=values)
+                    self.row_stamps[iid] = self.row_stamp(item)
+                self.row_nodes[iid] = item
+                continue
+
+            if pointer < len(existing) and existing[pointer] == iid:
+                pointer += 1 # строка уже на своем месте
+            else:
+                self.tree.move(iid, "", position) # узел сменил место (например, после переименования)
+
+            # Узел изменился с момента отрисовки - обновляем только его колонки
+            if item is not PARENT_ROW and self.row_stamps.get(iid) != self.row_stamp(item):
+                text, values = self.format_row(item)
+                with profiler.span("tk_update"):
+                    self.tree.item(iid, text=text, values=values)
+                self.row_stamps[iid] = self.row_stamp(item)
+
+    def row_stamp(self, node):
+        """То, от чего зависит текст строки"""
+        return (node.name, getattr(node, "size", None), node.mtime, self.folder_sizes.get(node),
+                getattr(node, "capacity", None))
+
+    def update_scrollbar(self):
+        """Показывает на полосе прокрутки позицию во всем списке"""
+        total = len(self.view_items)
+        visible = self.visible_row_count()
+        if total <= visible:
+            self.vsb.set(0.0, 1.0)
+        else:
+            self.vsb.set(self.view_top / total, min(1.0, (self.view_top + visible) / total))
+
+    def scroll_to(self, top):
+        """Прокручивает список так, чтобы строка top была первой видимой"""
+        total = len(self.view_items)
+        visible = self.visible_row_count()
+        top = max(0, min(top, total - visible))
+        if self.window_start <= top and top + visible <= self.window_end:
+            # Строки уже созданы - прокручиваем сам Treeview
+            self.tree.yview_moveto((top - self.window_start) / (self.window_end - self.window_start))
+        else:
+            self.render_window(top)
+
+    def on_scrollbar(self, *args):
+        """Перемещение полосы прокрутки: позиция полосы - доля всего списка"""
+        self.prefetcher.touch()
+        if args[0] == "moveto":
+            self.scroll_to(int(float(args[1]) * len(self.view_items)))
+        elif args[0] == "scroll":
+            step = int(args[1])
+            if args[2] == "pages":
+                step *= self.visible_row_count()
+            self.scroll_to(self.view_top + step)
+
+    def on_tree_yscroll(self, first, last):
+        """Treeview прокрутился сам (колесо мыши, see) - пересчитываем окно"""
+        self.prefetcher.touch()
+        length = self.window_end - self.window_start
+        if length == 0:
+            self.vsb.set(0.0, 1.0)
+            return
+
+        self.view_top = self.window_start + round(float(first) * length)
+        self.update_scrollbar()
+
+        # Подошли к краю созданных строк - перестраиваем окно, но не изнутри обработчика прокрутки
+        visible = self.visible_row_count()
+        near_top = self.window_start > 0 and self.view_top - self.window_start < VIRTUAL_OVERSCAN // 2
+        near_bottom = (self.window_end < len(self.view_items)
+                       and self.window_end - (self.view_top + visible) < VIRTUAL_OVERSCAN // 2)
+        if (near_top or near_bottom) and not self.rewindow_pending:
+            self.rewindow_pending = True
+            self.root.after_idle(self.rewindow)
+
+    def rewindow(self):
+        """Перестраивает окно строк вокруг текущей позиции прокрутки"""
+        self.rewindow_pending = False
+        self.render_window(self.view_top)
+
+    def render_selection(self):
+        """Переносит фокус и выделение на созданные строки окна"""
+        rows = self.tree.get_children()
+        if self.focus_index is not None and self.window_start <= self.focus_index < self.window_end:
+            self.tree.focus(rows[self.focus_index - self.window_start])
+        self.tree.selection_set([iid for iid in rows if self.row_nodes.get(iid) in self.selected])
+
+    def on_tree_click(self, event):
+        """Щелчок по строке: выбор, с Ctrl - добавить или убрать, с Shift - диапазон"""
+        iid = self.tree.identify_row(event.y)
+        if not iid:
+            return None # заголовки колонок и пустое место обрабатывает сам Treeview
+        self.tree.focus_set()
+        self.select_index(self.window_start + self.tree.index(iid),
+                          toggle=bool(event.state & 0x4), extend=bool(event.state & 0x1))
+        return "break"
+
+    def select_index(self, index, toggle=False, extend=False):
+        """Ставит фокус на строку index и меняет выделение"""
+        item = self.view_items[index]
+        anchor = self.anchor_index()
+        if extend and anchor is not None:
+            low, high = sorted((anchor, index))
+            self.selected = {node for node in self.view_items[low:high + 1] if node is not PARENT_ROW}
+        elif toggle:
+            if item in self.selected:
+                self.selected.discard(item)
+            elif item is not PARENT_ROW:
+                self.selected.add(item)
+            self.select_anchor = item
+        else:
+            self.selected = {item} if item is not PARENT_ROW else set()
+            self.select_anchor = item
+        self.focus_index = index
+
+        visible = self.visible_row_count()
+        if index < self.view_top:
+            self.scroll_to(index)
+        elif index >= self.view_top + visible:
+            self.scroll_to(index - visible + 1)
+        self.render_selection()
+        self.update_status()
+
+    def anchor_index(self):
+        """Индекс строки-якоря диапазона, None - если ее больше нет в списке"""
+        if self.select_anchor is PARENT_ROW:
+            return 0 if self.view_offset() else None
+        if self.select_anchor is None:
+            return None
+        return self.view_index(self.select_anchor)
+
+    def select_all(self):
+        """Выделяет все записи папки"""
+        self.selected = {node for node in self.view_items if node is not PARENT_ROW}
+        self.render_selection()
+        self.update_status()
+        return "break"
 
-        # Обновляем статус бар
-        count = len(children)
-        if self.current_node != self.root_node and ".." in [self.tree.item(i, "text") for i in
-                                                            self.tree.get_children()]:
-            count -= 1
-        self.status_var.set(f"Элементов: {count} | {self.get_current_path()}")
+    def on_tree_select(self, event):
+        """Запоминаем индекс строки с фокусом, чтобы вернуть его после перестройки окна"""
+        item = self.tree.focus()
+        if item:
+            self.focus_index = self.window_start + self.tree.index(item)
+
+    def focus_node(self, node):
+        """Ставит фокус на строку узла и прокручивает к ней"""
+        index = self.view_index(node)
+        if index is not None:
+            self.focus_index = index
+            self.move_focus(0)
+
+    def move_focus(self, delta, extend=False):
+        """Перемещает фокус на delta строк по всему списку, с extend - расширяет выделение"""
+        total = len(self.view_items)
+        if total == 0:
+            return "break"
+        current = self.focus_index if self.focus_index is not None else self.view_top - 1
+        index = max(0, min(current + delta, total - 1))
+        self.select_index(index, extend=extend)
+        return "break"
 
     def add_tree_item(self, parent, node):
         """Добавляет узел в дерево"""
-        if node["type"] == "folder":
+        text, values = self.format_row(node)
+        return self.tree.insert(parent, "end", text=text, values=values)
+
+    def format_row(self, node):
+        """Текст и значения колонок строки узла"""
+        if node.type == "folder":
             icon = "📁"
             item_type = "Папка"
             size = ""
-        elif node["type"] == "drive":
+            if node in self.folder_sizes:
+                total, finished = self.folder_sizes[node]
+                with profiler.span("format_size"):
+                    size = self.format_size(total) if finished else f"{self.format_size(total)}…"
+        elif node.type == "drive":
             icon = "💽"
-            item_type = "Диск"
-            size = ""
-        elif node["type"] == "computer":
+            item_type = f"Диск ({node.fstype})" if node.fstype else "Диск"
+            if node.capacity is None:
+                size = "…"
+            elif not node.capacity:
+                size = "нет ответа"
+            else:
+                total, free = node.capacity
+                size = f"{self.format_size(free)} из {self.format_size(total)}"
+            if node.label:
+                return f"{icon} {node.name} ({node.label})", (item_type, size, "")
+            return f"{icon} {node.name}", (item_type, size, "")
+        elif node.type == "computer":
             icon = "🖥️"
             item_type = "Компьютер"
             size = ""
         else:
-            icon = self.get_file_icon(node["name"])
-            ext = os.path.splitext(node["name"])[1][1:].upper()
+            icon = self.get_file_icon(node.name)
+            ext = os.path.splitext(node.name)[1][1:].upper()
             item_type = f"{ext} файл" if ext else "Файл"
-            size = node.get("size", "")
-
-        modified = node.get("modified", datetime.now()).strftime("%Y-%m-%d %H:%M")
-        self.tree.insert(parent, "end", text=f"{icon} {node['name']}",
-                         values=(item_type, size, modified))
-
+            with profiler.span("format_size"):
+                size = self.format_size(node.size) if node.size is not None else ""
+
+        # Дата форматируется только для строк, которые действительно рисуются
+        with profiler.span("fromtimestamp"):
+            modified = datetime.fromtimestamp(node.mtime).strftime("%Y-%m-%d %H:%M") if node.mtime is not None else ""
+        return f"{icon} {node.name}", (item_type, size, modified)
+
+
+    def get_file_icon(self, name):
+        """Возвращает иконку файла по расширению"""
+        ext = os.path.splitext(name)[1].lower()
+        if ext in (".txt", ".md", ".log", ".doc", ".docx", ".pdf"):
+            return "📄"
+        if ext in (".png", ".jpg", ".jpeg", ".gif", ".bmp", ".svg"):
+            return "🖼️"
+        if ext in (".mp3", ".wav", ".flac", ".ogg"):
+            return "🎵"
+        if ext in (".mp4", ".avi", ".mkv", ".mov"):
+            return "🎬"
+        if ext in (".zip", ".rar", ".7z", ".tar", ".gz"):
+            return "📦"
+        if ext in (".py", ".js", ".c", ".cpp", ".java", ".html", ".css"):
+            return "📜"
+        if ext in (".exe", ".msi", ".sh", ".bat"):
+            return "⚙️"
+        return "📄"
 
     def get_current_path(self):
         """Возвращает текущий путь"""
-        return self.current_node["path"]
+        return self.current_node.path
+
+    def get_selected_node(self):
+        """Возвращает узел строки с фокусом (PARENT_ROW для "..") или None"""
+        if self.focus_index is None or self.focus_index >= len(self.view_items):
+            return None
+        return self.view_items[self.focus_index]
+
+    def get_selected_nodes(self):
+        """Выбранные файлы и папки в порядке списка, без выделения - запись с фокусом"""
+        folder = self.view_node
+        nodes = [node for node in self.selected
+                 if node.type in ("file", "folder") and node.parent is folder and folder.find_child(node.name) is node]
+        if not nodes:
+            node = self.get_selected_node()
+            if node is not None and node is not PARENT_ROW and node.type in ("file", "folder"):
+                nodes = [node]
+        return sorted(nodes, key=lambda node: self.view_index(node) or 0)
 
     def on_double_click(self, event):
         """Обработка двойного щелчка"""
-        item = self.tree.focus()
-        if not item:
+        self.open_item()
+
+    def node_for_path(self, path):
+        """Находит узел папки по пути, недостающие промежуточные узлы создает без чтения папок"""
+        archive_path, inner = self.split_archive_path(path)
+        if archive_path is not None:
+            archive = self.archive_node(archive_path)
+            return descend_path(archive, inner, self.placeholders) if archive is not None else None
+        return resolve_path(self.root_node, path, self.placeholders)
+
+    def split_archive_path(self, path):
+        """Путь внутри архива -> (путь файла архива, путь внутри или "."), иначе (None, None)
+
+        На диске проверяются только части пути с расширением архива.
+        """
+        parts = os.path.abspath(path).split(os.sep)
+        for i, part in enumerate(parts):
+            if not is_archive_name(part):
+                continue
+            archive_path = os.sep.join(parts[:i + 1]) or os.sep
+            if archive_path in self.archives or os.path.isfile(archive_path):
+                return archive_path, os.path.join(*parts[i + 1:]) if i + 1 < len(parts) else "."
+        return None, None
+
+    def archive_node(self, archive_path):
+        """Узел архива, открытого как папка (один на файл архива)"""
+        archive = self.archives.get(archive_path)
+        if archive is None:
+            parent = self.node_for_path(os.path.dirname(archive_path))
+            if parent is None:
+                return None
+            archive = ArchiveNode(os.path.basename(archive_path), parent)
+            self.archives[archive_path] = archive
+        return archive
+
+    def open_archive(self, file_node):
+        """Открывает архив как папку; измененный на диске архив читается заново"""
+        archive = self.archive_node(file_node.path)
+        if archive is None:
             return
+        if archive.mtime != file_node.mtime:
+            self.listing_cache.discard(archive)
+            archive.forget_children()
+            archive.mtime = file_node.mtime
+        self.navigate_to(archive)
+
+    def read_only_archive(self, node=None):
+        """Внутри архива можно только смотреть и извлекать - сообщаем об этом"""
+        if archive_root(node or self.current_node) is None:
+            return False
+        messagebox.showerror("Ошибка", "Архив открыт только для чтения, файлы можно только извлечь")
+        return True
+
+    def archive_members(self, nodes):
+        """Путь архива и пути выбранных записей внутри него"""
+        archive = archive_root(nodes[0])
+        return archive.path, [os.path.relpath(node.path, archive.path).replace(os.sep, "/") for node in nodes]
+
+    def extract_selected(self):
+        """Извлекает выбранные записи архива в папку, выбранную в диалоге"""
+        nodes = self.get_selected_nodes()
+        if not nodes or archive_root(nodes[0]) is None:
+            messagebox.showerror("Ошибка", "Выберите файлы внутри архива")
+            return
+        destination = filedialog.askdirectory(title="Извлечь в папку")
+        if destination:
+            self.start_extract(*self.archive_members(nodes), destination)
+
+    def open_archive_member(self, node):
+        """Файл внутри архива: распаковываем только его во временную папку и открываем программой"""
+        if self.archive_temp is None:
+            self.archive_temp = tempfile.mkdtemp(prefix="filemanager-")
+            atexit.register(shutil.rmtree, self.archive_temp, True)
+        archive_path, inners = self.archive_members([node])
+        destination = tempfile.mkdtemp(dir=self.archive_temp) # свое место каждому, имена могут совпадать
+        self.start_extract(archive_path, inners, destination, open_after=True)
+
+    def start_extract(self, archive_path, inners, destination, open_after=False):
+        """Распаковка в фоновом потоке, прогресс - в строке состояния"""
+        self.status_var.set(f"Извлечение из {os.path.basename(archive_path)}...")
+        threading.Thread(target=self.run_extract, args=(archive_path, inners, destination, open_after),
+                         daemon=True).start()
+
+    def run_extract(self, archive_path, inners, destination, open_after):
+        """Тело фонового потока: каждый файл распаковывается потоком, остальной архив не читается"""
+        def on_progress(done, total):
+            self.post(self.status_var.set, f"Извлечение: {done} из {total}")
+        try:
+            errors = self.archive_cache.get(archive_path).extract(inners, destination, on_progress=on_progress)
+        except OSError as e:
+            errors = [(archive_path, e.strerror or str(e))]
+        opened = os.path.join(destination, inners[0].rpartition("/")[2]) if open_after and not errors else None
+        self.post(self.on_extract_done, errors, opened)
+
+    def on_extract_done(self, errors, opened):
+        """Распаковка закончилась: открываем файл или показываем ошибки"""
+        self.update_status()
+        if errors:
+            lines = [f"{path}: {error}" for path, error in errors[:10]]
+            if len(errors) > 10:
+                lines.append(f"... и еще {len(errors) - 10}")
+            messagebox.showerror("Ошибка", "Не удалось извлечь:\n" + "\n".join(lines))
+        elif opened is not None:
+            self.open_file(opened)
+
+    def go_to_path(self):
+        """Enter в поле пути: переход сразу в папку, промежуточные узлы создаются без чтения папок"""
+        self.hide_completion()
+        text = self.path_var.get().strip()
+        if not text:
+            return
+        path = os.path.abspath(os.path.expanduser(text))
+        if os.path.isdir(path) or self.split_archive_path(path)[0] is not None:
+            node = self.node_for_path(path) # папка или путь внутри архива
+            if node is None:
+                messagebox.showerror("Ошибка", f"Не удалось открыть {path}")
+                return
+            if node is not self.current_node:
+                self.navigate_to(node)
+        elif os.path.exists(path):
+            self.reveal(os.path.dirname(path), os.path.basename(path)) # файл - открываем папку с ним
+        else:
+            messagebox.showerror("Ошибка", f"Путь не найден: {text}")
+            return
+        self.path_var.set(self.get_current_path())
+        self.tree.focus_set()
+
+    def completion_folder(self, text):
+        """Папка, в которой дополняется имя, и набранное начало имени (папка None - путь не абсолютный)"""
+        folder, prefix = os.path.split(os.path.expanduser(text))
+        if not os.path.isabs(folder):
+            return None, prefix
+        return os.path.normpath(folder), prefix
+
+    def completion_request(self, folder):
+        """stamp списка папки для CompletionIndex и узлы, из которых его строить (None - читать имена с диска)"""
+        node = resolve_path(self.root_node, folder, self.placeholders, create=False)
+        if node is None or node.children is None or node.loading:
+            return None, None
+        return (id(node.children), len(node.children)), node.children
+
+    def warm_completion(self):
+        """Фокус в поле пути - заранее строим список текущей папки, с нее обычно и начинают набирать"""
+        folder = self.current_node.path
+        if self.current_node.type == "computer":
+            return
+        stamp, nodes = self.completion_request(folder)
+        if self.completion_index.complete(folder, "", stamp, limit=0) is None:
+            self.completion_index.request(folder, stamp, None if nodes is None else list(nodes))
 
-        name = self.tree.item(item, "text")
+    def on_path_key(self, event):
+        """Набор в поле пути - обновляем подсказки"""
+        if event.keysym in ("Return", "Tab", "Down", "Up", "Escape") or not event.char and event.keysym != "BackSpace":
+            return
+        self.update_completion()
 
-        if name == "..":
-            self.navigate_up()
+    def update_completion(self):
+        """Подсказки для набранного пути: поиск по началу имени в отсортированном списке папки"""
+        folder, prefix = self.completion_folder(self.path_var.get())
+        if folder is None:
+            self.hide_completion()
+            return
+        stamp, nodes = self.completion_request(folder)
+        names = self.completion_index.complete(folder, prefix, stamp)
+        if names is None:
+            self.completion_index.request(folder, stamp, None if nodes is None else list(nodes))
+            self.hide_completion() # список строится, покажем, когда придет on_completion_ready
             return
+        if not names or names == [prefix]:
+            self.hide_completion()
+            return
+        self.completion_list.delete(0, tk.END)
+        self.completion_list.insert(tk.END, *names)
+        if not self.completion_shown:
+            self.completion_list.place(in_=self.path_entry, relx=0, rely=1.0, relwidth=1.0, anchor="nw")
+            self.completion_list.lift()
+            self.completion_shown = True
+
+    def on_completion_ready(self, folder):
+        """Список папки построен - обновляем подсказки, если набирают все еще в ней"""
+        if self.root.focus_get() is not self.path_entry:
+            return
+        if self.completion_folder(self.path_var.get())[0] == folder:
+            self.update_completion()
+
+    def accept_completion(self):
+        """Tab/Enter в подсказках: подставляем папку и сразу показываем подсказки следующего уровня"""
+        if not self.completion_shown:
+            return "break"
+        selection = self.completion_list.curselection()
+        name = self.completion_list.get(selection[0] if selection else 0)
+        folder, _ = self.completion_folder(self.path_var.get())
+        self.path_var.set(os.path.join(folder, name, ""))
+        self.path_entry.focus_set()
+        self.path_entry.icursor(tk.END)
+        self.hide_completion()
+        self.update_completion()
+        return "break"
+
+    def focus_completion(self):
+        """Стрелка вниз из поля пути - переходим в список подсказок"""
+        if self.completion_shown:
+            self.completion_list.focus_set()
+            self.completion_list.selection_clear(0, tk.END)
+            self.completion_list.selection_set(0)
+            self.completion_list.activate(0)
+        return "break"
+
+    def hide_completion(self):
+        if self.completion_shown:
+            self.completion_list.place_forget()
+            self.completion_shown = False
+
+    def hide_completion_if_unfocused(self):
+        if self.root.focus_get() not in (self.path_entry, self.completion_list):
+            self.hide_completion()
+
+    def cancel_path_edit(self):
+        """Escape: прячем подсказки и возвращаем в поле путь текущей папки"""
+        self.hide_completion()
+        self.path_var.set(self.get_current_path())
+        self.tree.focus_set()
+        return "break"
 
-        # Убираем иконку из имени
-        if " " in name:
-            name = name.split(" ", 1)[1]
+    def search_files(self):
+        """Ищет имена по индексу и показывает результаты"""
+        query = self.search_var.get().strip()
+        if not query:
+            return
 
-        # Ищем выбранный узел
-        selected_node = None
-        for child in self.get_node_children(self.current_node) or []:
-            if child["name"] == name:
-                selected_node = child
-                break
+        started = time.perf_counter()
+        results = self.filename_index.search(query)
+        elapsed = (time.perf_counter() - started) * 1000
+
+        if self.search_window is None or not self.search_window.winfo_exists():
+            self.search_window = tk.Toplevel(self.root)
+            self.search_window.geometry("800x400")
+            self.search_info = tk.StringVar()
+            ttk.Label(self.search_window, textvariable=self.search_info, style="Status.TLabel").pack(fill=tk.X)
+            self.search_tree = ttk.Treeview(self.search_window, columns=("folder",), selectmode="browse")
+            self.search_tree.heading("#0", text="Имя", anchor=tk.W)
+            self.search_tree.heading("folder", text="Папка", anchor=tk.W)
+            self.search_tree.column("#0", width=250)
+            self.search_tree.column("folder", width=500)
+            search_vsb = ttk.Scrollbar(self.search_window, orient="vertical", command=self.search_tree.yview)
+            self.search_tree.configure(yscrollcommand=search_vsb.set)
+            self.search_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+            search_vsb.pack(side=tk.RIGHT, fill=tk.Y)
+            self.search_tree.bind("<Double-1>", lambda e: self.open_search_result())
+            self.search_tree.bind("<Return>", lambda e: self.open_search_result())
+
+        self.search_window.title(f"Поиск: {query}")
+        self.search_tree.delete(*self.search_tree.get_children())
+        self.search_results = {}
+        for folder, name, is_dir in results:
+            icon = "📁" if is_dir else self.get_file_icon(name)
+            iid = self.search_tree.insert("", "end", text=f"{icon} {name}", values=(folder,))
+            self.search_results[iid] = (folder, name)
+
+        more = " (показаны первые)" if len(results) >= SEARCH_MAX_RESULTS else ""
+        self.search_info.set(f"Найдено: {len(results)}{more} за {elapsed:.1f} мс | "
+                             f"в индексе {self.filename_index.count} имен из прочитанных папок")
+
+    def open_search_result(self):
+        """Открывает папку с найденной записью через обычную навигацию"""
+        result = self.search_results.get(self.search_tree.focus())
+        if result is not None:
+            self.reveal(*result)
+
+    def reveal(self, folder, name):
+        """Переходит в папку folder и ставит фокус на запись name"""
+        node = self.node_for_path(folder)
+        if node is None:
+            messagebox.showerror("Ошибка", f"Не удалось открыть {folder}")
+            return
+        self.reveal_name = name
+        if node is self.current_node:
+            self.update_display()
+        else:
+            self.navigate_to(node)
 
-        if selected_node:
-            if selected_node["type"] in ("folder", "drive"):
-                self.navigate_to(selected_node)
-            else:
-                self.open_file(selected_node["path"])
+    def search_content(self):
+        """Ищет текст в файлах текущей папки и всех вложенных"""
+        if self.current_node.type not in ("drive", "folder") or archive_root(self.current_node) is not None:
+            messagebox.showerror("Ошибка", "Выберите папку для поиска")
+            return
+        text = self.get_input("Поиск в файлах", "Текст для поиска:")
+        if not text:
+            return
 
-    def navigate_to(self, node):
-        """Переходит к указанному узлу"""
-        # Сохраняем текущий узел в истории
-        if self.history_index < len(self.nav_history) - 1:
-            self.nav_history = self.nav_history[:self.history_index + 1]
+        self.stop_content_search()
+        root_path = self.current_node.path
+
+        self.grep_window = tk.Toplevel(self.root)
+        self.grep_window.title(f"Поиск «{text}» в {root_path}")
+        self.grep_window.geometry("900x500")
+        self.grep_window.protocol("WM_DELETE_WINDOW", self.close_content_search)
+
+        top = ttk.Frame(self.grep_window)
+        top.pack(fill=tk.X)
+        self.grep_info = tk.StringVar(value="Поиск...")
+        ttk.Label(top, textvariable=self.grep_info, style="Status.TLabel").pack(side=tk.LEFT, fill=tk.X, expand=True)
+        ttk.Button(top, text="Остановить", command=self.stop_content_search).pack(side=tk.RIGHT)
+
+        self.grep_tree = ttk.Treeview(self.grep_window, columns=("line", "text"), selectmode="browse")
+        self.grep_tree.heading("#0", text="Файл", anchor=tk.W)
+        self.grep_tree.heading("line", text="Строка", anchor=tk.W)
+        self.grep_tree.heading("text", text="Текст", anchor=tk.W)
+        self.grep_tree.column("#0", width=300)
+        self.grep_tree.column("line", width=60)
+        self.grep_tree.column("text", width=500)
+        grep_vsb = ttk.Scrollbar(self.grep_window, orient="vertical", command=self.grep_tree.yview)
+        self.grep_tree.configure(yscrollcommand=grep_vsb.set)
+        self.grep_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        grep_vsb.pack(side=tk.RIGHT, fill=tk.Y)
+        self.grep_tree.bind("<Double-1>", lambda e: self.open_grep_result())
+        self.grep_tree.bind("<Return>", lambda e: self.open_grep_result())
+        self.grep_results = {}
+
+        self.grep_job = self.content_searcher.start(
+            root_path, text,
+            lambda *args: self.post(self.on_grep_results, *args),
+            lambda *args: self.post(self.on_grep_done, *args))
+
+    def on_grep_results(self, job, matches):
+        """Очередная порция совпадений"""
+        if job is not self.grep_job:
+            return
+        for path, line, snippet in matches:
+            iid = self.grep_tree.insert("", "end", text=os.path.relpath(path, job.root), values=(line, snippet))
+            self.grep_results[iid] = path
+        self.grep_info.set(self.grep_status(job, "Поиск..."))
+
+    def on_grep_done(self, job):
+        """Поиск закончен или остановлен"""
+        if job is not self.grep_job:
+            return
+        state = "Остановлено" if job.cancelled else "Готово"
+        self.grep_info.set(self.grep_status(job, f"{state} за {time.monotonic() - job.started:.1f} с"))
+        self.grep_job = None
+
+    def grep_status(self, job, state):
+        return (f"{state} | файлов: {job.files}, совпадений: {job.matches}, "
+                f"двоичных пропущено: {job.binary}, больше {self.format_size(GREP_MAX_FILE_SIZE)}: {job.too_big}")
+
+    def stop_content_search(self):
+        """Останавливает поиск по содержимому"""
+        if self.grep_job:
+            self.grep_job.cancel()
+
+    def close_content_search(self):
+        self.stop_content_search()
+        self.grep_job = None
+        self.grep_window.destroy()
+
+    def open_grep_result(self):
+        """Открывает папку с найденным файлом"""
+        path = self.grep_results.get(self.grep_tree.focus())
+        if path is not None:
+            self.reveal(os.path.dirname(path), os.path.basename(path))
+
+    def find_duplicates(self):
+        """Ищет одинаковые файлы в выбранной папке (или текущей) и всех вложенных"""
+        node = self.get_selected_node()
+        if node is PARENT_ROW or node is None or node.type != "folder":
+            node = self.current_node
+        if node.type not in ("drive", "folder") or archive_root(node) is not None:
+            messagebox.showerror("Ошибка", "Выберите папку для поиска дубликатов")
+            return
 
-        self.nav_history.append(self.current_node)
-        self.history_index = len(self.nav_history) - 1
+        self.stop_duplicates()
+        if self.dup_window is not None and self.dup_window.winfo_exists():
+            self.dup_window.destroy()
+        self.dup_window = tk.Toplevel(self.root)
+        self.dup_window.title(f"Дубликаты в {node.path}")
+        self.dup_window.geometry("900x500")
+        self.dup_window.protocol("WM_DELETE_WINDOW", self.close_duplicates)
+
+        top = ttk.Frame(self.dup_window)
+        top.pack(fill=tk.X)
+        self.dup_info = tk.StringVar(value="Поиск...")
+        ttk.Label(top, textvariable=self.dup_info, style="Status.TLabel").pack(side=tk.LEFT, fill=tk.X, expand=True)
+        ttk.Button(top, text="Удалить выбранные", command=self.delete_duplicates).pack(side=tk.RIGHT, padx=2)
+        ttk.Button(top, text="Выбрать копии", command=self.select_duplicate_copies).pack(side=tk.RIGHT, padx=2)
+        ttk.Button(top, text="Остановить", command=self.stop_duplicates).pack(side=tk.RIGHT, padx=2)
+
+        self.dup_tree = ttk.Treeview(self.dup_window, columns=("size",), selectmode="extended")
+        self.dup_tree.heading("#0", text="Файл", anchor=tk.W)
+        self.dup_tree.heading("size", text="Размер", anchor=tk.W)
+        self.dup_tree.column("#0", width=700)
+        self.dup_tree.column("size", width=150)
+        dup_vsb = ttk.Scrollbar(self.dup_window, orient="vertical", command=self.dup_tree.yview)
+        self.dup_tree.configure(yscrollcommand=dup_vsb.set)
+        self.dup_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        dup_vsb.pack(side=tk.RIGHT, fill=tk.Y)
+        self.dup_tree.bind("<Double-1>", lambda e: self.open_duplicate())
+        self.dup_tree.bind("<Return>", lambda e: self.open_duplicate())
+        self.dup_tree.bind("<Delete>", lambda e: self.delete_duplicates())
+        self.dup_groups = {} # ключ группы -> iid строки группы
+        self.dup_paths = {} # iid строки файла -> путь
+        self.dup_deleted = set() # пути, уже отправленные на удаление
+
+        self.dup_job = self.duplicate_finder.start(
+            node.path,
+            lambda *args: self.post(self.on_duplicate_groups, *args),
+            lambda *args: self.post(self.on_duplicates_done, *args))
+
+    def on_duplicate_groups(self, job, groups):
+        """Новые группы и группы, в которых прибавились файлы"""
+        if job is not self.dup_job:
+            return
+        for key, paths in groups:
+            size = key[0]
+            paths = [path for path in paths if path not in self.dup_deleted]
+            group = self.dup_groups.get(key)
+            if group is None and len(paths) < 2:
+                continue
+            if group is None:
+                group = self.dup_tree.insert("", "end", open=True)
+                self.dup_groups[key] = group
+            shown = {self.dup_paths[iid] for iid in self.dup_tree.get_children(group)}
+            for path in paths:
+                if path not in shown:
+                    iid = self.dup_tree.insert(group, "end", text=os.path.relpath(path, job.root),
+                                               values=(self.format_size(size),))
+                    self.dup_paths[iid] = path
+            self.update_duplicate_group(group, size)
+        self.dup_info.set(self.duplicates_status(job, "Поиск..."))
+
+    def update_duplicate_group(self, group, size):
+        """Подпись группы: сколько копий и сколько места они занимают лишнего"""
+        count = len(self.dup_tree.get_children(group))
+        self.dup_tree.item(group, text=f"Одинаковых файлов: {count}", values=(
+            f"лишних {self.format_size(size * (count - 1))}",))
+
+    def on_duplicates_done(self, job):
+        """Поиск закончен: группы по убыванию лишнего места"""
+        if job is not self.dup_job:
+            return
+        wasted = lambda item: item[0][0] * (len(self.dup_tree.get_children(item[1])) - 1)
+        for position, (key, group) in enumerate(sorted(self.dup_groups.items(), key=wasted, reverse=True)):
+            self.dup_tree.move(group, "", position)
+        state = "Остановлено" if job.cancelled else "Готово"
+        self.dup_info.set(self.duplicates_status(job, f"{state} за {time.monotonic() - job.started:.1f} с"))
+        self.dup_job = None
+
+    def duplicates_status(self, job, state):
+        read = job.bytes_read / job.bytes_total * 100 if job.bytes_total else 0
+        return (f"{state} | файлов: {job.files}, групп: {len(self.dup_groups)}, "
+                f"лишних: {self.format_size(job.wasted)} | прочитано {read:.1f}% объема")
+
+    def select_duplicate_copies(self):
+        """Выбирает в каждой группе все файлы, кроме первого"""
+        copies = []
+        for group in self.dup_groups.values():
+            copies.extend(self.dup_tree.get_children(group)[1:])
+        self.dup_tree.selection_set(copies)
+
+    def delete_duplicates(self):
+        """Удаляет выбранные файлы обычной фоновой операцией удаления"""
+        iids = [iid for iid in self.dup_tree.selection() if iid in self.dup_paths]
+        if not iids:
+            return
+        groups = {self.dup_tree.parent(iid) for iid in iids}
+        if any(len(self.dup_tree.get_children(group)) == sum(1 for iid in iids if self.dup_tree.parent(iid) == group)
+               for group in groups):
+            if not messagebox.askyesno("Подтверждение", "В некоторых группах выбраны все копии - "
+                                       "файлы пропадут совсем. Продолжить?", parent=self.dup_window):
+                return
+        elif not messagebox.askyesno("Подтверждение", f"Удалить выбранные файлы ({len(iids)})?",
+                                     parent=self.dup_window):
+            return
+
+        self.start_file_job(FileOpJob("delete", [self.dup_paths[iid] for iid in iids]))
+        for iid in iids:
+            self.dup_deleted.add(self.dup_paths.pop(iid))
+        self.dup_tree.delete(*iids)
+        for key, group in list(self.dup_groups.items()):
+            if group in groups:
+                if len(self.dup_tree.get_children(group)) < 2: # копий не осталось
+                    for iid in self.dup_tree.get_children(group):
+                        del self.dup_paths[iid]
+                    self.dup_tree.delete(group)
+                    del self.dup_groups[key]
+                else:
+                    self.update_duplicate_group(group, key[0])
+
+    def stop_duplicates(self):
+        """Останавливает поиск дубликатов"""
+        if self.dup_job:
+            self.dup_job.cancel()
 
+    def close_duplicates(self):
+        self.stop_duplicates()
+        self.dup_job = None
+        self.dup_window.destroy()
+
+    def open_duplicate(self):
+        """Открывает папку с файлом"""
+        path = self.dup_paths.get(self.dup_tree.focus())
+        if path is not None:
+            self.reveal(os.path.dirname(path), os.path.basename(path))
+
+    @profiled("navigate")
+    def navigate_to(self, node):
+        """Переходит к указанному узлу"""
+        # Запоминаем вид текущей папки и добавляем новую в историю
+        self.history.save(self.view_snapshot())
+        self.history.push(ViewSnapshot(node.path, self.sort_column, self.sort_reverse))
+        self.restore_snapshot = None
         self.current_node = node
         self.update_display()
 
+    @profiled("back")
     def navigate_back(self):
         """Переход назад по истории"""
-        if self.history_index > 0:
-            self.history_index -= 1
-            self.current_node = self.nav_history[self.history_index]
-            self.update_display()
+        if self.history.can_back:
+            self.history.save(self.view_snapshot())
+            self.restore_view(self.history.back())
 
+    @profiled("forward")
     def navigate_forward(self):
         """Переход вперед по истории"""
-        if self.history_index < len(self.nav_history) - 1:
-            self.history_index += 1
-            self.current_node = self.nav_history[self.history_index]
-            self.update_display()
+        if self.history.can_forward:
+            self.history.save(self.view_snapshot())
+            self.restore_view(self.history.forward())
+
+    def view_snapshot(self):
+        """Снимок вида текущей папки для истории"""
+        focused = self.get_selected_node()
+        if focused is PARENT_ROW:
+            focus = ".."
+        else:
+            focus = focused.name if focused is not None else None
+        selected = sorted(node.name for node in self.selected if node.parent is self.current_node)
+        return ViewSnapshot(self.current_node.path, self.sort_column, self.sort_reverse, self.view_top, focus, selected)
+
+    def restore_view(self, snapshot):
+        """Открывает папку из снимка с его сортировкой; прокрутка и выделение - когда папка прочитана"""
+        if snapshot.path == self.root_node.path:
+            node = self.root_node
+        else:
+            node = self.node_for_path(snapshot.path)
+        if node is None:
+            messagebox.showerror("Ошибка", f"Не удалось открыть {snapshot.path}")
+            return
+        if (snapshot.sort_column, snapshot.sort_reverse) != (self.sort_column, self.sort_reverse):
+            self.remember_view_order()
+            self.sort_column, self.sort_reverse = snapshot.sort_column, snapshot.sort_reverse
+            self.update_sort_headings()
+        self.current_node = node
+        self.restore_snapshot = snapshot
+        self.update_display()
 
+    def restore_selection(self, snapshot):
+        """Фокус, выделение и якорь диапазона из снимка - по именам, которые еще есть в папке"""
+        folder = self.current_node
+        self.selected = {node for node in map(folder.find_child, snapshot.selected) if node is not None}
+        if snapshot.focus == "..":
+            focused = PARENT_ROW if self.view_offset() else None
+        else:
+            focused = folder.find_child(snapshot.focus) if snapshot.focus is not None else None
+        if focused is not None:
+            self.focus_index = 0 if focused is PARENT_ROW else self.view_index(focused)
+            self.select_anchor = focused
+        self.render_selection()
+        self.update_status()
+
+    @profiled("up")
     def navigate_up(self):
         """Переход в родительскую папку"""
-        if self.current_node["parent"]:
-            self.navigate_to(self.current_node["parent"])
+        if self.current_node.parent:
+            self.navigate_to(self.current_node.parent)
 
+    @profiled("refresh")
     def refresh(self):
         """Обновляет текущую директорию"""
-        if "children" in self.current_node:
-            del self.current_node["children"]
+        if self.scan_task and self.scan_task.node is self.current_node:
+            self.cancel_scan() # перечитываем с начала
+        if self.current_node.type != "computer": # список дисков не сканируется
+            self.size_engine.invalidate(self.current_node.path)
+            self.listing_cache.discard(self.current_node)
+            self.current_node.forget_children()
+        else:
+            self.reload_drives()
         self.update_display()
 
+    @profiled("open")
     def open_item(self):
         """Открывает выбранный элемент"""
-        item = self.tree.focus()
-        if not item:
+        selected_node = self.get_selected_node()
+        if selected_node is None:
             return
 
-        name = self.tree.item(item, "text")
-
-        if name == "..":
+        if selected_node is PARENT_ROW:
             self.navigate_up()
             return
 
-        # Убираем иконку из имени
-        if " " in name:
-            name = name.split(" ", 1)[1]
-
-        # Ищем выбранный узел
-        selected_node = None
-        for child in self.get_node_children(self.current_node) or []:
-            if child["name"] == name:
-                selected_node = child
-                break
-
-        if selected_node:
-            if selected_node["type"] in ("folder", "drive"):
-                self.navigate_to(selected_node)
-            else:
-                self.open_file(selected_node["path"])
+        if selected_node.type in ("folder", "drive"):
+            self.navigate_to(selected_node)
+        elif archive_root(selected_node) is not None:
+            self.open_archive_member(selected_node)
+        elif is_archive_name(selected_node.name):
+            self.open_archive(selected_node) # архив открывается как папка
+        else:
+            self.open_file(selected_node.path)
 
     def open_file(self, filepath):
         """Открывает файл с помощью системного приложения"""
@@ -434,31 +2193,19 @@ class AdvancedFileManager:
             if platform.system() == 'Windows':
                 os.startfile(filepath)
             elif platform.system() == 'Darwin':  # macOS
-                subprocess.run(['open', filepath])
+                subprocess.Popen(['open', filepath]) # не ждем, пока приложение закроется
             else:  # Linux
-                subprocess.run(['xdg-open', filepath])
+                subprocess.Popen(['xdg-open', filepath])
         except Exception as e:
             messagebox.showerror("Ошибка", f"Не удалось открыть файл: {e}")
 
     def open_with(self):
         """Открывает диалог выбора программы для открытия файла"""
-        item = self.tree.focus()
-        if not item:
-            return
-
-        name = self.tree.item(item, "text")
-        if " " in name:
-            name = name.split(" ", 1)[1]
-
-        # Ищем выбранный файл
-        selected_node = None
-        for child in self.get_node_children(self.current_node) or []:
-            if child["name"] == name and child["type"] == "file":
-                selected_node = child
-                break
-
-        if selected_node:
-            if platform.system() == 'Windows':
+        selected_node = self.get_selected_node()
+        if selected_node is not None and selected_node is not PARENT_ROW and selected_node.type == "file":
+            if archive_root(selected_node) is not None:
+                self.open_archive_member(selected_node)
+            elif platform.system() == 'Windows':
                 try:
                     import win32gui
                     import win32con
@@ -467,41 +2214,30 @@ class AdvancedFileManager:
                     win32gui.ShellExecute(
                         0,
                         "openas",
-                        selected_node["path"],
+                        selected_node.path,
                         None,
                         None,
                         win32con.SW_SHOW)
                 except:
-                    self.open_file(selected_node["path"])
+                    self.open_file(selected_node.path)
             else:
                 # Для других ОС просто открываем файл
-                self.open_file(selected_node["path"])
+                self.open_file(selected_node.path)
 
     def copy_path(self):
         """Копирует путь к файлу в буфер обмена"""
-        item = self.tree.focus()
-        if not item:
-            return
-
-        name = self.tree.item(item, "text")
-        if " " in name:
-            name = name.split(" ", 1)[1]
-
-        # Ищем выбранный узел
-        selected_node = None
-        for child in self.get_node_children(self.current_node) or []:
-            if child["name"] == name:
-                selected_node = child
-                break
-
-        if selected_node:
+        selected_node = self.get_selected_node()
+        if selected_node is not None and selected_node is not PARENT_ROW:
             self.root.clipboard_clear()
-            self.root.clipboard_append(selected_node["path"])
-            messagebox.showinfo("Скопировано", f"Путь скопирован в буфер обмена:\n{selected_node['path']}")
+            self.root.clipboard_append(selected_node.path)
+            messagebox.showinfo("Скопировано", f"Путь скопирован в буфер обмена:\n{selected_node.path}")
 
+    @profiled("create_folder")
     def create_folder(self):
         """Создает новую папку"""
-        if self.current_node["type"] not in ("drive", "folder"):
+        if self.read_only_archive():
+            return
+        if self.current_node.type not in ("drive", "folder"):
             messagebox.showerror("Ошибка", "Нельзя создать папку в этом месте")
             return
 
@@ -509,110 +2245,238 @@ class AdvancedFileManager:
         if not name:
             return
 
-        new_path = os.path.join(self.current_node["path"], name)
+        new_path = os.path.join(self.current_node.path, name)
 
         try:
             os.mkdir(new_path)
 
             # Добавляем новую папку в текущий узел
-            new_folder = {
-                "path": new_path,
-                "name": name,
-                "type": "folder",
-                "parent": self.current_node,
-                "modified": datetime.now()
-            }
-
-            if "children" not in self.current_node:
-                self.current_node["children"] = []
-
-            self.current_node["children"].append(new_folder)
-            self.update_display()
+            new_folder = FolderNode(name, self.current_node, os.stat(new_path).st_mtime)
+
+            self.current_node.add_children([new_folder])
+            self.listing_cache.resize(self.current_node, 1, entry_bytes(new_folder))
+            self.filename_index.add(self.current_node.path, name, True)
+            self.view_insert(new_folder) # перерисуются только строки окна, без пересортировки
+            self.focus_node(new_folder)
         except Exception as e:
             messagebox.showerror("Ошибка", f"Не удалось создать папку: {e}")
 
+    @profiled("delete")
     def delete_item(self):
-        """Удаляет выбранный элемент"""
-        item = self.tree.focus()
-        if not item:
+        """Удаляет выбранные элементы (папки - со всем содержимым) одной фоновой операцией"""
+        nodes = self.get_selected_nodes()
+        if not nodes or self.read_only_archive():
             return
 
-        name = self.tree.item(item, "text")
-        if name == "..":
+        if len(nodes) > 1:
+            question = f"Удалить выбранные объекты ({len(nodes)}) со всем содержимым?"
+        elif nodes[0].type == "folder":
+            question = f"Удалить папку '{nodes[0].name}' со всем содержимым?"
+        else:
+            question = f"Удалить '{nodes[0].name}'?"
+        if not messagebox.askyesno("Подтверждение", question):
             return
 
-        # Убираем иконку из имени
-        if " " in name:
-            name = name.split(" ", 1)[1]
+        # Строки уйдут из списка разом, когда операция закончится
+        self.start_file_job(FileOpJob("delete", [node.path for node in nodes]))
+
+    def copy_items(self):
+        """Запоминает выбранные элементы для копирования"""
+        self.put_to_clipboard("copy", "Скопировано в буфер")
+
+    def cut_items(self):
+        """Запоминает выбранные элементы для переноса"""
+        if not self.read_only_archive():
+            self.put_to_clipboard("move", "Вырезано в буфер")
 
-        if not messagebox.askyesno("Подтверждение", f"Удалить '{name}'?"):
+    def put_to_clipboard(self, kind, message):
+        nodes = self.get_selected_nodes()
+        if nodes:
+            if archive_root(nodes[0]) is not None:
+                self.file_clipboard = ("extract", self.archive_members(nodes)) # вставка = извлечение
+            else:
+                self.file_clipboard = (kind, [node.path for node in nodes])
+            what = nodes[0].name if len(nodes) == 1 else f"объектов: {len(nodes)}"
+            self.status_var.set(f"{message}: {what}")
+
+    @profiled("paste")
+    def paste_items(self):
+        """Копирует или переносит записи из буфера в текущую папку"""
+        if self.file_clipboard is None:
+            return
+        if self.read_only_archive():
+            return
+        if self.current_node.type not in ("drive", "folder"):
+            messagebox.showerror("Ошибка", "Нельзя вставить в этом месте")
             return
+        kind, paths = self.file_clipboard
+        if kind == "extract":
+            archive_path, inners = paths
+            self.start_extract(archive_path, inners, self.current_node.path)
+            return
+        if kind == "move":
+            self.file_clipboard = None # перенесенные записи второй раз не вставить
+        self.start_file_job(FileOpJob(kind, paths, self.current_node.path))
+
+    def start_file_job(self, job):
+        """Ставит файловую операцию в очередь движка"""
+        self.file_jobs.append(job)
+        self.file_ops.submit(
+            job,
+            lambda *args: self.post(self.update_file_job_status),
+            lambda *args: self.post(self.on_fs_events, args[1]),
+            lambda *args: self.post(self.ask_conflict, *args),
+            lambda *args: self.post(self.on_file_job_done, *args))
+        self.update_file_job_status()
+
+    def on_file_job_done(self, job):
+        """Операция закончилась, ошибки показываем списком"""
+        if job in self.file_jobs:
+            self.file_jobs.remove(job)
+        self.update_file_job_status()
+        if job.errors:
+            lines = [f"{path}: {error}" for path, error in job.errors[:10]]
+            if len(job.errors) > 10:
+                lines.append(f"... и еще {len(job.errors) - 10}")
+            messagebox.showerror("Ошибка", f"{job.title}: не все удалось\n\n" + "\n".join(lines))
+
+    def update_file_job_status(self):
+        """Показывает прогресс текущей операции в статус баре"""
+        if not self.file_jobs:
+            self.job_frame.pack_forget()
+            return
+        job = self.file_jobs[0]
+        parts = [job.title]
+        if job.paused:
+            parts[0] += " (пауза)"
+        if job.total_files:
+            parts.append(f"{min(job.done_files, job.total_files)} из {job.total_files}")
+        if job.total_bytes:
+            parts.append(f"{self.format_size(job.done_bytes)} из {self.format_size(job.total_bytes)}")
+        if job.rate and not job.paused:
+            parts.append(f"{job.rate / (1024 * 1024):.1f} MB/s")
+        if job.current:
+            parts.append(os.path.basename(job.current))
+        if len(self.file_jobs) > 1:
+            parts.append(f"в очереди: {len(self.file_jobs) - 1}")
+        self.job_var.set(" | ".join(parts))
+        self.job_pause_btn.configure(text="Продолжить" if job.paused else "Пауза")
+        self.job_frame.pack(side=tk.RIGHT)
+
+    def toggle_file_job_pause(self):
+        """Пауза или продолжение текущей операции"""
+        if self.file_jobs:
+            job = self.file_jobs[0]
+            if job.paused:
+                job.resume()
+            else:
+                job.pause()
+            self.update_file_job_status()
 
-        # Ищем выбранный узел
-        selected_node = None
-        for child in self.get_node_children(self.current_node) or []:
-            if child["name"] == name:
-                selected_node = child
-                break
+    def cancel_file_job(self):
+        """Отменяет текущую операцию, то, что уже сделано, остается"""
+        if self.file_jobs:
+            self.file_jobs[0].cancel()
 
-        if selected_node:
-            try:
-                if selected_node["type"] == "folder":
-                    os.rmdir(selected_node["path"])
-                else:
-                    os.remove(selected_node["path"])
+    def ask_conflict(self, job, path, reply):
+        """Спрашивает, что делать с уже существующей записью, окно не блокирует интерфейс"""
+        if job.cancelled:
+            return
+        dialog = tk.Toplevel(self.root)
+        dialog.title(job.title)
+        dialog.transient(self.root)
 
-                # Удаляем из списка детей
-                self.current_node["children"] = [c for c in self.current_node["children"] if c["name"] != name]
-                self.update_display()
-            except Exception as e:
-                messagebox.showerror("Ошибка", f"Не удалось удалить: {e}")
+        folder, name = os.path.split(path)
+        ttk.Label(dialog, text=f"'{name}' уже есть в папке\n{folder}").pack(padx=10, pady=5)
+        for_all = tk.BooleanVar(value=False)
+        ttk.Checkbutton(dialog, text="Для всех конфликтов", variable=for_all).pack(padx=10, pady=5)
 
+        def answer(choice):
+            dialog.destroy()
+            reply(choice, for_all.get())
+
+        dialog.protocol("WM_DELETE_WINDOW", lambda: answer("skip"))
+        ttk.Button(dialog, text="Отмена", command=lambda: answer("cancel")).pack(side=tk.RIGHT, padx=5, pady=5)
+        ttk.Button(dialog, text="Пропустить", command=lambda: answer("skip")).pack(side=tk.RIGHT, padx=5, pady=5)
+        ttk.Button(dialog, text="Оставить обе", command=lambda: answer("rename")).pack(side=tk.RIGHT, padx=5, pady=5)
+        ttk.Button(dialog, text="Заменить", command=lambda: answer("overwrite")).pack(side=tk.RIGHT, padx=5, pady=5)
+
+    @profiled("rename")
     def rename_item(self):
-        """Переименовывает выбранный элемент"""
-        item = self.tree.focus()
-        if not item:
+        """Переименовывает выбранный элемент, несколько выбранных - по шаблону"""
+        nodes = self.get_selected_nodes()
+        if not nodes or self.read_only_archive():
             return
-
-        old_name = self.tree.item(item, "text")
-        if old_name == "..":
+        if len(nodes) > 1:
+            self.rename_by_pattern(nodes)
             return
+        selected_node = nodes[0]
 
-        # Убираем иконку из имени
-        if " " in old_name:
-            old_name = old_name.split(" ", 1)[1]
-
+        old_name = selected_node.name
         new_name = self.get_input("Переименование", "Введите новое имя:", old_name)
         if not new_name or new_name == old_name:
             return
 
         # Проверяем уникальность имени
-        if any(child["name"] == new_name for child in self.get_node_children(self.current_node) or []):
+        if self.current_node.find_child(new_name) is not None:
             messagebox.showerror("Ошибка", "Элемент с таким именем уже существует")
             return
 
-        # Ищем выбранный узел
-        selected_node = None
-        for child in self.get_node_children(self.current_node) or []:
-            if child["name"] == old_name:
-                selected_node = child
-                break
+        old_path = selected_node.path
+        new_path = os.path.join(os.path.dirname(old_path), new_name)
 
-        if selected_node:
-            old_path = selected_node["path"]
-            new_path = os.path.join(os.path.dirname(old_path), new_name)
+        try:
+            os.rename(old_path, new_path)
+
+            # Обновляем данные узла
+            # Путь вложенных узлов собирается через родителя, их трогать не нужно
+            self.view_remove(selected_node)
+            old_bytes = entry_bytes(selected_node)
+            self.current_node.rename_child(selected_node, new_name)
+            self.listing_cache.resize(self.current_node, 0, entry_bytes(selected_node) - old_bytes)
+            self.filename_index.rename(self.current_node.path, old_name, new_name)
+            if selected_node.type == "folder":
+                self.filename_index.move_tree(old_path, new_path)
+            selected_node.mtime = os.stat(new_path).st_mtime
+            self.view_insert(selected_node) # строка переедет на новое место по сортировке
+            self.focus_node(selected_node)
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось переименовать: {e}")
 
-            try:
-                os.rename(old_path, new_path)
+    def rename_by_pattern(self, nodes):
+        """Групповое переименование по регулярному выражению и нумерации"""
+        find = self.get_input("Групповое переименование", "Найти (регулярное выражение):", "^(.*?)(\\.[^.]*)?$")
+        if find is None:
+            return
+        replace = self.get_input("Групповое переименование",
+                                 "Заменить на (\\1, \\2 - группы, {n} или {n:03} - номер):", "\\1_{n}\\2")
+        if replace is None:
+            return
 
-                # Обновляем данные узла
-                selected_node["name"] = new_name
-                selected_node["path"] = new_path
-                selected_node["modified"] = datetime.now()
+        try:
+            names = pattern_names([node.name for node in nodes], find, replace)
+        except (re.error, ValueError, IndexError) as e:
+            messagebox.showerror("Ошибка", f"Неверный шаблон: {e}")
+            return
+        bad = [name for name in names if not name or name in (".", "..") or os.sep in name
+               or (os.altsep and os.altsep in name)]
+        if bad:
+            messagebox.showerror("Ошибка", f"Недопустимое имя: '{bad[0]}'")
+            return
+        if len(set(names)) != len(names):
+            messagebox.showerror("Ошибка", "Шаблон дает одинаковые имена")
+            return
 
-                self.update_display()
-            except Exception as e:
-                messagebox.showerror("Ошибка", f"Не удалось переименовать: {e}")
+        changes = [(node, name) for node, name in zip(nodes, names) if name != node.name]
+        if not changes:
+            return
+        preview = "\n".join(f"{node.name} → {name}" for node, name in changes[:10])
+        if len(changes) > 10:
+            preview += f"\n... и еще {len(changes) - 10}"
+        if not messagebox.askyesno("Подтверждение", f"Переименовать объекты ({len(changes)})?\n\n{preview}"):
+            return
+        self.start_file_job(FileOpJob("rename", [node.path for node, _ in changes],
+                                      names=[name for _, name in changes]))
 
     def get_input(self, title, prompt, default=""):
         """Отображает диалог ввода"""
@@ -0,0 +1,437 @@
+"""Замеры горячих путей файлового менеджера на синтетических деревьях
+
+Деревья строятся воспроизводимо (по seed) во временной папке и переиспользуются
+между запусками. Результат - JSON, который можно сравнить с прошлым запуском:
+    python bench.py run --output base.json
+    python bench.py run --baseline base.json       # сравнение, код 1 при регрессии
+    python bench.py run --sizes 10k,100k,1m --ui    # с окном (нужен дисплей или Xvfb)
+    python bench.py compare base.json new.json
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+from core import (
+    DiskListingCache, format_size, load_drives, name_matcher, read_folder,
+    resolve_path, scan_directory, view_sort_key,
+)
+
+TREE_VERSION = 1 # меняется вместе с генератором деревьев, старые деревья строятся заново
+FLAT_SIZES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+DEEP_LEVELS = 200
+DEEP_FILES_PER_LEVEL = 5
+LONG_NAMES = 5_000
+MIXED_ENTRIES = 10_000
+LOOKUPS = 10_000 # поисков по имени в одном замере
+UI_INSERT_ROWS = 10_000 # строк вставляем в Treeview за один замер
+EXTENSIONS = ["", ".txt", ".py", ".png", ".jpg", ".mp3", ".mkv", ".zip", ".pdf", ".log", ".tar.gz", ".cpp"]
+NOISE_SEC = 0.001 # разница меньше этого не считается регрессией
+
+
+# --- Синтетические деревья
+
+def random_mtime(rng):
+    return 1_500_000_000 + rng.random() * 250_000_000
+
+
+def make_file(path, rng, max_size=10 * 1024 * 1024):
+    """Пустой файл нужного размера (дырявый, место на диске не занимает) и со случайной датой"""
+    with open(path, "wb") as f:
+        f.truncate(rng.randrange(max_size))
+    mtime = random_mtime(rng)
+    os.utime(path, (mtime, mtime))
+
+
+def build_flat(path, count, rng):
+    """Одна папка с count файлами и небольшой долей подпапок"""
+    os.makedirs(path)
+    for i in range(count):
+        name = f"file{i}{rng.choice(EXTENSIONS)}"
+        if i % 100 == 0:
+            os.mkdir(os.path.join(path, f"dir{i}"))
+        else:
+            make_file(os.path.join(path, name), rng)
+
+
+def build_deep(path, rng):
+    """Цепочка из DEEP_LEVELS вложенных папок с несколькими файлами на каждом уровне"""
+    level = path
+    for depth in range(DEEP_LEVELS):
+        level = os.path.join(level, f"level{depth}")
+        os.makedirs(level)
+        for i in range(DEEP_FILES_PER_LEVEL):
+            make_file(os.path.join(level, f"f{i}.txt"), rng, 4096)
+
+
+def build_long_names(path, rng):
+    """Имена на пределе длины, латиница и кириллица (не больше 255 байт в UTF-8)"""
+    os.makedirs(path)
+    letters = "abcdefghijklmnopqrstuvwxyzабвгдежзийклмнопрстуфхцчшщэюя0123456789 _-"
+    for i in range(LONG_NAMES):
+        ext = rng.choice(EXTENSIONS)
+        name = f"{i:05}_" + "".join(rng.choice(letters) for _ in range(rng.randrange(60, 200)))
+        while len((name + ext).encode()) > 255:
+            name = name[:-1]
+        make_file(os.path.join(path, name.rstrip() + ext), rng)
+
+
+def build_mixed(path, rng):
+    """Папки, файлы, ссылки (в том числе битые), числа в именах для естественной сортировки"""
+    os.makedirs(path)
+    for i in range(MIXED_ENTRIES):
+        kind = rng.random()
+        name = f"{rng.choice(['Report', 'photo', 'Фото', 'data', 'IMG_'])}{rng.randrange(10_000)}_{i}"
+        full = os.path.join(path, name)
+        if kind < 0.1:
+            os.mkdir(full)
+        elif kind < 0.15:
+            os.symlink(f"file_target_{i}", full) # битая ссылка
+        elif kind < 0.2 and i:
+            os.symlink(os.path.join(path, "target"), full)
+        else:
+            make_file(full + rng.choice(EXTENSIONS), rng)
+    make_file(os.path.join(path, "target"), rng)
+
+
+def tree_specs(sizes):
+    """Имя дерева -> функция построения"""
+    specs = {f"flat_{size}": (lambda path, rng, count=FLAT_SIZES[size]: build_flat(path, count, rng))
+             for size in sizes}
+    specs["deep"] = build_deep
+    specs["long_names"] = build_long_names
+    specs["mixed"] = build_mixed
+    return specs
+
+
+def ensure_tree(workdir, name, build, seed):
+    """Путь к дереву, строит его, если готового нет или оно от другой версии генератора"""
+    path = os.path.join(workdir, name)
+    marker = os.path.join(workdir, f".{name}.done")
+    stamp = f"{TREE_VERSION}:{seed}"
+    try:
+        with open(marker) as f:
+            if f.read() == stamp:
+                return path
+    except OSError:
+        pass
+    if os.path.exists(path):
+        remove_tree(path)
+    print(f"строим {name}...", file=sys.stderr)
+    build(path, random.Random(f"{seed}:{name}"))
+    with open(marker, "w") as f:
+        f.write(stamp)
+    return path
+
+
+def remove_tree(path):
+    for dirpath, dirnames, filenames in os.walk(path, topdown=False):
+        for name in filenames + [d for d in dirnames if os.path.islink(os.path.join(dirpath, d))]:
+            os.unlink(os.path.join(dirpath, name))
+        for name in dirnames:
+            if not os.path.islink(os.path.join(dirpath, name)):
+                os.rmdir(os.path.join(dirpath, name))
+    os.rmdir(path)
+
+
+# --- Замеры
+
+def measure(func, repeat, setup=None):
+    """Время func в секундах: min, медиана и все прогоны; setup готовит аргумент вне замера"""
+    runs = []
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        gc.collect()
+        start = time.perf_counter()
+        func(arg) if setup else func()
+        runs.append(time.perf_counter() - start)
+    return {"min": min(runs), "median": statistics.median(runs), "runs": runs}
+
+
+def deepest_folder(path):
+    while True:
+        subdirs = [entry.path for entry in os.scandir(path) if entry.is_dir(follow_symlinks=False)]
+        if not subdirs:
+            return path
+        path = subdirs[0]
+
+
+def sort_like_view(children, column):
+    """Тот же порядок, что sorted_children в окне: папки, потом файлы"""
+    key = lambda child: view_sort_key(child, column)
+    return (sorted((c for c in children if c.type == "folder"), key=key)
+            + sorted((c for c in children if c.type == "file"), key=key))
+
+
+def row_formatter():
+    """format_row окна без самого окна (нужен только модуль tkinter, не дисплей)"""
+    try:
+        from app import AdvancedFileManager
+    except ImportError:
+        return None
+    stub = SimpleNamespace(folder_sizes={}, format_size=format_size,
+                           get_file_icon=lambda name: AdvancedFileManager.get_file_icon(stub, name))
+    return lambda node: AdvancedFileManager.format_row(stub, node)
+
+
+def bench_core(path, repeat, workdir):
+    """Замеры без интерфейса: чтение, сортировка, форматирование, поиск имени, память, кэш на диске"""
+    results = {}
+
+    def fresh_node():
+        return resolve_path(load_drives(), path)
+
+    def read(node):
+        read_folder(node)
+
+    results["scan"] = measure(read, repeat, fresh_node)
+    results["scan_raw"] = measure(lambda: sum(len(chunk) for chunk in scan_directory(path, threading.Event())), repeat)
+
+    node = fresh_node()
+    children = read_folder(node)
+    results["entries"] = len(children)
+    for column in ("name", "size", "modified"):
+        def sort_cold(nodes, column=column):
+            sort_like_view(nodes, column)
+
+        def cold_children():
+            for child in children:
+                child.sort_name = None # ключ естественной сортировки считается заново
+            return children
+
+        results[f"sort_{column}"] = measure(sort_cold, repeat, cold_children)
+
+    format_row = row_formatter()
+    if format_row is not None:
+        results["format_rows"] = measure(lambda: [format_row(child) for child in children], repeat)
+
+    rng = random.Random(0)
+    names = [child.name for child in rng.sample(children, min(LOOKUPS, len(children)))]
+    names += [name + "~missing" for name in names[:len(names) // 10]]
+
+    def lookup_cold(_):
+        node.index = None # индекс имен строится при первом поиске
+        for name in names:
+            node.find_child(name)
+
+    results["lookup_cold"] = measure(lookup_cold, repeat, lambda: None)
+    results["lookup_warm"] = measure(lambda: [node.find_child(name) for name in names], repeat)
+    matcher, _ = name_matcher("*1?3*")
+    results["match_glob"] = measure(lambda: [matcher(child.name.lower()) for child in children], repeat)
+
+    deepest = deepest_folder(path)
+    if deepest != path:
+        results["resolve_deep"] = measure(lambda: resolve_path(load_drives(), deepest), repeat)
+
+    results["bytes_per_node"] = node_memory(path)
+
+    cache = DiskListingCache(os.path.join(workdir, "bench-cache.sqlite3"))
+    st = os.stat(path)
+    entries = [(child.name, child.type == "folder", getattr(child, "size", None) or 0, child.mtime)
+               for child in children]
+    results["disk_cache_store"] = measure(lambda: cache.store(path, st, entries), repeat)
+    results["disk_cache_load"] = measure(lambda: cache.load(path, st), repeat)
+    cache.conn.close()
+    return results
+
+
+def node_memory(path):
+    """Байт на узел вместе с именем и ключом сортировки"""
+    node = resolve_path(load_drives(), path)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    children = read_folder(node)
+    for child in children:
+        view_sort_key(child) # ключ сортировки хранится в узле
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return round(used / max(1, len(children)), 1)
+
+
+def open_display():
+    """Tk с дисплеем: текущий или виртуальный Xvfb (если установлен xvfbwrapper)"""
+    import tkinter as tk
+    try:
+        return tk.Tk(), None
+    except tk.TclError:
+        try:
+            from xvfbwrapper import Xvfb
+        except ImportError:
+            raise RuntimeError("нет дисплея и не установлен xvfbwrapper")
+        xvfb = Xvfb(width=1280, height=1024)
+        xvfb.start()
+        return tk.Tk(), xvfb
+
+
+def bench_ui(paths, repeat):
+    """Замеры окна: открытие папки, перерисовка, смена сортировки, вставка строк"""
+    from app import AdvancedFileManager
+    root, xvfb = open_display()
+    try:
+        app = AdvancedFileManager(root)
+        app.disk_cache = None # меряем чтение папки, а не кэш на диске
+        root.update()
+        results = {}
+        for name, path in paths.items():
+            node = app.node_for_path(path)
+
+            def open_cold():
+                app.navigate_to(node)
+                app.refresh()
+                while app.scan_task is not None:
+                    root.update()
+
+            case = {"open": measure(open_cold, repeat)}
+            case["display"] = measure(lambda: (app.update_display(), root.update_idletasks()), repeat)
+
+            def sort_cycle():
+                for column in ("size", "modified", "name"):
+                    app.sort_by(column)
+                root.update_idletasks()
+
+            case["sort_cycle"] = measure(sort_cycle, repeat)
+
+            rows = node.children[:UI_INSERT_ROWS]
+
+            def insert_rows():
+                iids = [app.add_tree_item("", child) for child in rows]
+                app.tree.delete(*iids)
+
+            case["insert_rows"] = measure(insert_rows, repeat)
+            case["insert_rows_count"] = len(rows)
+            results[name] = case
+        return results
+    finally:
+        root.destroy()
+        if xvfb is not None:
+            xvfb.stop()
+
+
+def run(args):
+    sizes = [size.strip().lower() for size in args.sizes.split(",") if size.strip()]
+    unknown = [size for size in sizes if size not in FLAT_SIZES]
+    if unknown:
+        raise SystemExit(f"неизвестный размер: {', '.join(unknown)} (есть {', '.join(FLAT_SIZES)})")
+    workdir = args.workdir or os.path.join(tempfile.gettempdir(), f"afm-bench-{args.seed}")
+    os.makedirs(workdir, exist_ok=True)
+
+    paths = {name: ensure_tree(workdir, name, build, args.seed) for name, build in tree_specs(sizes).items()}
+    report = {
+        "version": 1,
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "repeat": args.repeat,
+            "seed": args.seed,
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        },
+        "results": {},
+    }
+    for name, path in paths.items():
+        print(f"замер {name}...", file=sys.stderr)
+        report["results"][name] = bench_core(path, args.repeat, workdir)
+
+    if args.ui:
+        try:
+            for name, case in bench_ui(paths, args.repeat).items():
+                report["results"][name].update({f"ui_{key}": value for key, value in case.items()})
+        except (RuntimeError, ImportError) as e:
+            report["meta"]["ui_skipped"] = str(e)
+            print(f"замеры окна пропущены: {e}", file=sys.stderr)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            return print_comparison(json.load(f), report, args.threshold)
+    return 0
+
+
+def metric_value(value):
+    """Число для сравнения: медиана времени или само значение (память, счетчики)"""
+    if isinstance(value, dict):
+        return value["median"], True
+    return value, False
+
+
+def compare_reports(base, new, threshold):
+    """Строки сравнения (дерево, метрика, было, стало, отношение, регрессия?)"""
+    rows = []
+    for tree, metrics in new["results"].items():
+        for metric, value in metrics.items():
+            old = base.get("results", {}).get(tree, {}).get(metric)
+            if old is None or metric.endswith(("entries", "_count")):
+                continue
+            old_value, timed = metric_value(old)
+            new_value, _ = metric_value(value)
+            ratio = new_value / old_value if old_value else float("inf")
+            noise = NOISE_SEC if timed else 0
+            regressed = new_value > old_value * (1 + threshold) and new_value - old_value > noise
+            rows.append((tree, metric, old_value, new_value, ratio, regressed))
+    return rows
+
+
+def print_comparison(base, new, threshold):
+    rows = compare_reports(base, new, threshold)
+    for tree, metric, old, new_value, ratio, regressed in rows:
+        mark = "  РЕГРЕССИЯ" if regressed else ""
+        print(f"{tree:16} {metric:20} {old:12.6g} -> {new_value:12.6g}  x{ratio:.2f}{mark}", file=sys.stderr)
+    regressions = sum(1 for row in rows if row[5])
+    print(f"регрессий: {regressions} из {len(rows)} (порог {threshold:.0%})", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+def compare(args):
+    with open(args.base, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)
+    return print_comparison(base, new, args.threshold)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="bench.py", description="Замеры на синтетических деревьях")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_cmd = commands.add_parser("run", help="построить деревья и выполнить замеры")
+    run_cmd.add_argument("--sizes", default="10k,100k", help="плоские папки: 10k, 100k, 1m")
+    run_cmd.add_argument("--repeat", type=int, default=5)
+    run_cmd.add_argument("--seed", type=int, default=1)
+    run_cmd.add_argument("--workdir", help="где строить деревья (по умолчанию во временной папке)")
+    run_cmd.add_argument("--ui", action="store_true", help="замеры окна (нужен дисплей или xvfbwrapper)")
+    run_cmd.add_argument("--output", help="файл для JSON (по умолчанию stdout)")
+    run_cmd.add_argument("--baseline", help="JSON прошлого запуска для сравнения")
+    run_cmd.add_argument("--threshold", type=float, default=0.1, help="допустимое замедление (0.1 = 10%%)")
+    run_cmd.set_defaults(func=run)
+
+    compare_cmd = commands.add_parser("compare", help="сравнить два JSON")
+    compare_cmd.add_argument("base")
+    compare_cmd.add_argument("new")
+    compare_cmd.add_argument("--threshold", type=float, default=0.1)
+    compare_cmd.set_defaults(func=compare)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,233 @@
+"""Командная строка файлового менеджера без графики
+
+Использует то же ядро (core.py), что и окно, tkinter не импортируется:
+    python cli.py ls /usr/lib --sort size --reverse
+    python cli.py du ~/projects /var/log --json
+    python cli.py find ~ "*.py" --limit 100
+    python cli.py tree . --depth 2
+    python cli.py dups ~/Downloads
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+from datetime import datetime
+
+from core import (
+    DuplicateFinder, FolderSizeEngine, FolderNode, format_size, load_drives, name_matcher,
+    read_folder, resolve_path, view_sort_key,
+)
+
+SORT_COLUMNS = ("name", "type", "size", "modified")
+
+
+def open_folder(path):
+    """Узел папки по пути (как в окне: от узла дисков)"""
+    if not os.path.isdir(path):
+        raise NotADirectoryError(f"{path}: не папка")
+    node = resolve_path(load_drives(), path)
+    if node is None:
+        raise FileNotFoundError(f"{path}: не найден диск")
+    return node
+
+
+def sorted_nodes(nodes, column="name", reverse=False):
+    """Порядок как в окне: папки перед файлами, естественная сортировка имен
+
+    reverse меняет порядок только внутри групп - папки остаются первыми.
+    """
+    key = lambda node: view_sort_key(node, column)
+    folders = sorted((node for node in nodes if isinstance(node, FolderNode)), key=key, reverse=reverse)
+    files = sorted((node for node in nodes if not isinstance(node, FolderNode)), key=key, reverse=reverse)
+    return folders + files
+
+
+def node_info(node):
+    """Описание записи для вывода в JSON"""
+    info = {"name": node.name, "path": node.path, "type": node.type}
+    if node.type == "file":
+        info["size"] = node.size
+    info["mtime"] = node.mtime
+    return info
+
+
+def format_mtime(mtime):
+    return datetime.fromtimestamp(mtime).strftime("%Y-%m-%d %H:%M") if mtime else ""
+
+
+def cmd_ls(args):
+    """Список папки"""
+    node = open_folder(args.path)
+    children = sorted_nodes(read_folder(node), args.sort, args.reverse)
+    if args.json:
+        return [node_info(child) for child in children]
+    for child in children:
+        size = "<DIR>" if isinstance(child, FolderNode) else format_size(child.size or 0)
+        print(f"{format_mtime(child.mtime):16}  {size:>10}  {child.name}")
+
+
+def cmd_du(args):
+    """Размеры папок (тем же пулом, что колонка размеров в окне)"""
+    sizes = {}
+    roots = []
+    for path in args.paths:
+        path = os.path.abspath(path)
+        if os.path.isdir(path) and not os.path.islink(path):
+            roots.append(path)
+        else:
+            sizes[path] = os.stat(path, follow_symlinks=False).st_size
+
+    totals = {}
+    if roots:
+        job = FolderSizeEngine().start(roots, lambda job, sums, ready: totals.update(sums))
+        job.done.wait() # ставится и при ошибке в движке
+        if job.error is not None:
+            raise OSError(f"подсчет размеров прерван: {job.error}")
+    for path in roots:
+        sizes[path] = totals.get(path, 0)
+
+    result = [{"path": path, "size": sizes[os.path.abspath(path)]} for path in args.paths]
+    if args.json:
+        return result
+    for item in result:
+        print(f"{format_size(item['size']):>10}  {item['path']}")
+
+
+def cmd_find(args):
+    """Поиск по именам: подстрока или маска, как в окне поиска"""
+    matcher, _ = name_matcher(args.pattern)
+    found = []
+    stack = [os.path.abspath(args.path)]
+    while stack and len(found) < args.limit:
+        path = stack.pop()
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    if is_dir:
+                        stack.append(entry.path)
+                    if args.type and args.type != ("d" if is_dir else "f"):
+                        continue
+                    if matcher(entry.name.lower()):
+                        found.append(entry.path)
+                        if not args.json:
+                            print(entry.path) # результаты выводятся по мере нахождения
+                        if len(found) >= args.limit:
+                            break
+        except OSError:
+            continue
+    if args.json:
+        return found
+
+
+def build_tree(node, depth):
+    """Вложенное описание папки до заданной глубины"""
+    info = node_info(node)
+    if isinstance(node, FolderNode) and depth > 0:
+        try:
+            children = read_folder(node)
+        except OSError as e:
+            info["error"] = e.strerror or str(e)
+        else:
+            info["children"] = [build_tree(child, depth - 1) for child in sorted_nodes(children)]
+    return info
+
+
+def print_tree(info, prefix=""):
+    children = info.get("children", [])
+    for i, child in enumerate(children):
+        last = i == len(children) - 1
+        name = child["name"] + ("/" if child["type"] != "file" else "")
+        print(f"{prefix}{'└── ' if last else '├── '}{name}")
+        print_tree(child, prefix + ("    " if last else "│   "))
+
+
+def cmd_tree(args):
+    """Дерево папок"""
+    tree = build_tree(open_folder(args.path), args.depth)
+    if args.json:
+        return tree
+    print(tree["path"])
+    print_tree(tree)
+
+
+def cmd_dups(args):
+    """Одинаковые файлы: размер, края, полный хэш - как в окне"""
+    root = os.path.abspath(args.path)
+    if not os.path.isdir(root):
+        raise NotADirectoryError(f"{args.path}: не папка")
+    done = threading.Event()
+    job = DuplicateFinder().start(root, lambda job, groups: None, lambda job: done.set())
+    done.wait() # on_done зовется и при ошибке в движке
+    if job.error is not None:
+        raise OSError(f"поиск прерван: {job.error}")
+    groups = sorted(((size, sorted(paths)) for (size, _), paths in job.groups.items() if len(paths) > 1),
+                    key=lambda group: group[0] * (len(group[1]) - 1), reverse=True)
+    if args.json:
+        return [{"size": size, "paths": paths} for size, paths in groups]
+    for size, paths in groups:
+        print(f"{format_size(size)} × {len(paths)}")
+        for path in paths:
+            print(f"  {path}")
+    read = job.bytes_read / job.bytes_total * 100 if job.bytes_total else 0
+    print(f"лишних: {format_size(job.wasted)}, прочитано {read:.1f}% объема", file=sys.stderr)
+
+
+def build_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--json", action="store_true", help="вывод в JSON")
+
+    parser = argparse.ArgumentParser(prog="cli.py", description="Файловый менеджер без графики")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ls = commands.add_parser("ls", parents=[common], help="список папки")
+    ls.add_argument("path", nargs="?", default=".")
+    ls.add_argument("--sort", choices=SORT_COLUMNS, default="name")
+    ls.add_argument("-r", "--reverse", action="store_true")
+    ls.set_defaults(func=cmd_ls)
+
+    du = commands.add_parser("du", parents=[common], help="размеры папок")
+    du.add_argument("paths", nargs="*", default=["."])
+    du.set_defaults(func=cmd_du)
+
+    find = commands.add_parser("find", parents=[common], help="поиск по именам")
+    find.add_argument("path")
+    find.add_argument("pattern", help="часть имени или маска (*, ?, [])")
+    find.add_argument("--type", choices=("f", "d"))
+    find.add_argument("--limit", type=int, default=1000)
+    find.set_defaults(func=cmd_find)
+
+    tree = commands.add_parser("tree", parents=[common], help="дерево папок")
+    tree.add_argument("path", nargs="?", default=".")
+    tree.add_argument("--depth", type=int, default=3)
+    tree.set_defaults(func=cmd_tree)
+
+    dups = commands.add_parser("dups", parents=[common], help="одинаковые файлы")
+    dups.add_argument("path", nargs="?", default=".")
+    dups.set_defaults(func=cmd_dups)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if os.name != "nt":
+        sys.stdout.reconfigure(errors="surrogateescape") # имена с байтами не в UTF-8
+    try:
+        result = args.func(args)
+    except OSError as e:
+        print(f"{args.command}: {e}", file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        return 130
+    if args.json:
+        json.dump(result, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,3087 @@
+"""Ядро файлового менеджера без Tkinter
+
+Узлы дерева файлов, кэши списков папок, наблюдение за изменениями, индекс
+имен, поиск по содержимому, размеры папок и файловые операции. Модуль не
+импортирует tkinter - его используют окно (app.py), командная строка
+(cli.py) и процессы поиска по содержимому.
+"""
+import os
+import threading
+import queue
+import time
+import sys
+import stat
+import select
+import struct
+import fnmatch
+import re
+import errno
+import shutil
+from array import array
+import mmap
+import marshal
+import zlib
+import json
+import functools
+import io
+import base64
+import bisect
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+try:
+    from PIL import Image # миниатюры любых картинок, без него - только форматы, которые понимает Tk
+except ImportError:
+    Image = None
+
+
+SCAN_CHUNK_SIZE = 500 # сколько записей отправлять в интерфейс за одну порцию
+LISTING_CACHE_MAX_ENTRIES = 1_000_000 # сколько записей всех прочитанных папок держим в памяти
+LISTING_CACHE_MAX_BYTES = 256 * 1024 * 1024 # примерный предел памяти под прочитанные папки
+HISTORY_MAX_ENTRIES = 100 # снимков в истории переходов
+HISTORY_MAX_SELECTED = 1000 # больше выделенных имен в снимок не записываем
+NODE_BYTES = 120 # узел без строк имени и ключа: объект, mtime, size и ссылка в children (замер bench.py node_memory)
+EMPTY_STR_BYTES = sys.getsizeof("") # заголовок строки, у ключа и имени он свой
+WATCH_MAX_DIRS = 1000 # сколько прочитанных папок отслеживаем на изменения
+WATCH_BATCH_SEC = 0.1 # события файловой системы копятся и отправляются пачкой
+WATCH_POLL_INTERVAL = 2.0 # период опроса папок, если inotify недоступен
+SIZE_WORKERS = 8 # потоков для подсчета размеров папок (работа в основном ждет диск)
+SIZE_CACHE_MAX_DIRS = 500_000 # сколько папок помним в кэше размеров
+SIZE_PROGRESS_SEC = 0.2 # как часто отправлять промежуточные суммы в интерфейс
+SEARCH_MAX_RESULTS = 1000 # больше результатов поиска не показываем
+COMPLETION_MAX_FOLDERS = 64 # для скольких папок храним списки автодополнения пути
+COMPLETION_MAX_ITEMS = 12 # подсказок под полем пути
+GREP_WORKERS = max(1, (os.cpu_count() or 2) - 1) # процессов для поиска по содержимому
+GREP_MAX_FILE_SIZE = 64 * 1024 * 1024 # файлы больше не читаем
+GREP_SNIFF_BYTES = 8192 # по началу файла решаем, двоичный ли он
+GREP_BATCH_FILES = 64 # файлов в одной задаче процесса
+GREP_BATCH_BYTES = 16 * 1024 * 1024 # или столько байт, что наступит раньше
+GREP_MAX_MATCHES = 10000 # больше совпадений не показываем
+GREP_MATCHES_PER_FILE = 100
+GREP_SNIPPET = 200 # символов строки в результатах
+DUP_EDGE_BYTES = 4096 # байт начала и конца файла на втором этапе поиска дубликатов
+DUP_EDGE_BATCH = 256 # файлов в одной задаче хэширования краев
+DUP_BATCH_FILES = 64 # файлов в одной задаче полного хэша
+DUP_BATCH_BYTES = 256 * 1024 * 1024 # или столько байт, что наступит раньше
+DUP_HASH_CHUNK = 1024 * 1024 # блок чтения при полном хэше
+DUP_PROGRESS_SEC = 0.3 # как часто отправлять найденные группы в интерфейс
+COPY_CHUNK = 16 * 1024 * 1024 # байт за один вызов copy_file_range/sendfile, между ними проверяем паузу и отмену
+COPY_BUFFER = 1024 * 1024 # буфер копирования, если ядро не умеет копировать само
+ARCHIVE_EXTENSIONS = (".zip", ".jar", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+ZIP_EXTENSIONS = (".zip", ".jar")
+ARCHIVE_CACHE_MAX = 8 # оглавлений архивов в памяти
+COPY_FALLBACK_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF, errno.EPERM}
+FILEOP_PROGRESS_SEC = 0.2 # как часто файловые операции сообщают прогресс
+DISK_CACHE_ENABLED = True # хранить прочитанные папки на диске между запусками
+DISK_CACHE_MAX_DIRS = 20_000 # сколько папок держим в базе
+DISK_CACHE_MAX_BYTES = 256 * 1024 * 1024 # предел размера сжатых списков в базе
+DISK_CACHE_PRUNE_EVERY = 100 # через сколько записей в базу проверяем пределы
+SORT_CACHE_MIN_ENTRIES = 1000 # папки меньше этого сортируем заново, больше - запоминаем порядок
+PREFETCH_WORKERS = 2 # одновременных фоновых чтений папок "на будущее"
+PREFETCH_DEPTH = 1 # на сколько уровней ниже текущей папки читаем заранее
+PREFETCH_MAX_FOLDERS = 64 # папок в одном плане
+PREFETCH_MAX_ENTRIES = 20_000 # папки больше не читаем заранее
+PREFETCH_MAX_TOTAL = 200_000 # записей в прочитанных заранее, но еще не открытых папках
+PREFETCH_IDLE_SEC = 0.3 # тишина после действий пользователя, прежде чем читать заранее
+STAT_WORKERS = 8 # потоков, догружающих размер и дату в ленивом режиме (ждут сеть)
+STAT_BATCH = 64 # записей в одной задаче stat
+LAZY_STAT_FILESYSTEMS = {
+    "nfs", "nfs4", "cifs", "smb3", "smbfs", "afs", "9p", "ceph", "glusterfs", "lustre",
+    "fuse.sshfs", "fuse.rclone", "fuse.s3fs", "davfs", "fuse.davfs2",
+} # на этих дисках stat дорог: папка показывается по именам, размер и дата догружаются
+DRIVE_PROBE_TIMEOUT = 2.0 # сколько ждем ответа диска (statvfs, метка тома), потом пишем "нет ответа"
+MOUNTINFO_PATH = "/proc/self/mountinfo"
+PSEUDO_FILESYSTEMS = {
+    "proc", "sysfs", "devtmpfs", "devpts", "tmpfs", "ramfs", "cgroup", "cgroup2", "securityfs",
+    "pstore", "debugfs", "tracefs", "configfs", "fusectl", "mqueue", "hugetlbfs", "bpf", "binfmt_misc",
+    "autofs", "rpc_pipefs", "nsfs", "efivarfs", "selinuxfs", "squashfs", "nfsd", "fuse.gvfsd-fuse",
+    "fuse.portal", "fuse.lxcfs",
+} # служебные файловые системы - не диски
+SYSTEM_MOUNT_PREFIXES = ("/proc/", "/sys/", "/dev/", "/run/", "/snap/", "/var/lib/docker/")
+TRACE_MAX_EVENTS = 200_000 # событий трассы в памяти, старые вытесняются
+PREVIEW_TEXT_BYTES = 64 * 1024 # сколько байт начала файла читаем для просмотра
+PREVIEW_TEXT_LINES = 200
+PREVIEW_THUMB_SIZE = 256 # сторона миниатюры в пикселях
+PREVIEW_IMAGE_MAX_BYTES = 32 * 1024 * 1024 # картинки больше без PIL не декодируем (Tk читает их целиком)
+THUMB_CACHE_MAX_BYTES = 64 * 1024 * 1024 # предел кэша миниатюр на диске
+TK_IMAGE_EXTENSIONS = {".png", ".gif", ".ppm", ".pgm"} # форматы, которые Tk декодирует сам
+PIL_IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".bmp", ".webp", ".tif", ".tiff", ".ico"}
+
+
+class Node:
+    """Узел дерева файлов (паттерн Компоновщик)
+
+    Хранит только имя и ссылку на родителя: полный путь собирается по цепочке
+    родителей, а размер и дата хранятся сырыми числами и форматируются при отрисовке.
+    """
+    __slots__ = ("name", "parent", "mtime", "sort_name")
+    type = None # тип узла - атрибут класса, в самих узлах не хранится
+
+    def __init__(self, name, parent, mtime=None):
+        self.name = name
+        self.parent = parent
+        self.mtime = mtime # st_mtime, None - неизвестно
+        self.sort_name = None # ключ естественной сортировки, считается при первой сортировке
+
+    @property
+    def path(self):
+        return os.path.join(self.parent.path, self.name)
+
+    def __repr__(self):
+        return f"<{type(self).__name__} {self.path!r}>"
+
+
+class FileNode(Node):
+    """Файл"""
+    __slots__ = ("size",)
+    type = "file"
+
+    def __init__(self, name, parent, size=None, mtime=None):
+        super().__init__(name, parent, mtime)
+        self.size = size # st_size в байтах
+
+
+class FolderNode(Node):
+    """Папка: дочерние узлы читаются при первом обращении"""
+    __slots__ = ("children", "loading", "index", "orders")
+    type = "folder"
+
+    def __init__(self, name, parent, mtime=None):
+        super().__init__(name, parent, mtime)
+        self.children = None # None - папка еще не прочитана
+        self.loading = False # идет фоновое чтение, в children неполный список
+        self.index = None # имя -> узел, строится при первом поиске по имени
+        self.orders = None # (колонка, по убыванию) -> отсортированный список детей
+
+    def find_child(self, name):
+        """Ищет дочерний узел по имени за O(1)"""
+        if self.children is None:
+            return None
+        if self.index is None:
+            self.index = {child.name: child for child in self.children}
+        return self.index.get(name)
+
+    def add_children(self, nodes):
+        """Добавляет дочерние узлы, поддерживая индекс имен"""
+        if self.children is None:
+            self.children = []
+        self.children.extend(nodes)
+        self.orders = None
+        if self.index is not None:
+            for node in nodes:
+                self.index[node.name] = node
+
+    def remove_child(self, node):
+        """Удаляет дочерний узел"""
+        self.children.remove(node)
+        self.orders = None
+        if self.index is not None:
+            self.index.pop(node.name, None)
+
+    def rename_child(self, node, new_name):
+        """Меняет имя дочернего узла вместе с ключом в индексе"""
+        if self.index is not None:
+            self.index.pop(node.name, None)
+            self.index[new_name] = node
+        node.name = new_name
+        node.sort_name = None
+        self.orders = None
+
+    def child_changed(self):
+        """Размер или дата дочернего узла изменились - запомненные порядки устарели"""
+        self.orders = None
+
+    def forget_children(self):
+        """Забывает прочитанный список, при следующем обращении папка читается заново"""
+        self.children = None
+        self.index = None
+        self.orders = None
+        self.loading = False
+
+
+class DriveNode(FolderNode):
+    """Диск: путь хранится явно
+
+    Метка тома и емкость приходят позже из probe_drives: capacity - None,
+    пока диск не ответил, () - если не ответил вовремя, иначе (всего, свободно).
+    """
+    __slots__ = ("_path", "fstype", "label", "capacity")
+    type = "drive"
+
+    def __init__(self, path, name, parent, fstype=""):
+        super().__init__(name, parent)
+        self._path = path
+        self.fstype = fstype
+        self.label = ""
+        self.capacity = None
+
+    @property
+    def path(self):
+        return self._path
+
+
+class ComputerNode(DriveNode):
+    """Корень дерева - "Этот компьютер" """
+    __slots__ = ()
+    type = "computer"
+
+    def __init__(self, name):
+        super().__init__(name, name, None)
+
+
+def unescape_mount_field(field):
+    """В mountinfo пробелы и другие символы путей записаны как \\040"""
+    return os.fsdecode(re.sub(rb"\\([0-7]{3})", lambda m: bytes([int(m.group(1), 8)]), field))
+
+
+def read_mounts(path=MOUNTINFO_PATH):
+    """Точки монтирования настоящих файловых систем [(путь, тип)] из mountinfo
+
+    Служебные файловые системы пропускаются, повторное монтирование того же
+    тома (та же пара устройство + корень внутри него) показывается один раз.
+    Корень "/" есть всегда, даже если mountinfo недоступен.
+    """
+    mounts = [("/", "")]
+    seen = set()
+    try:
+        with open(path, "rb") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return mounts
+    for line in lines:
+        # 36 35 98:0 /mnt1 /mnt/parent rw,noatime master:1 - ext3 /dev/root rw
+        fields = line.split()
+        try:
+            separator = fields.index(b"-", 6)
+            device, root, mount_point = fields[2], fields[3], unescape_mount_field(fields[4])
+            fstype = os.fsdecode(fields[separator + 1])
+        except (ValueError, IndexError):
+            continue
+        if fstype in PSEUDO_FILESYSTEMS or (device, root) in seen:
+            continue
+        if mount_point == "/":
+            mounts[0] = ("/", fstype)
+        elif (mount_point + "/").startswith(SYSTEM_MOUNT_PREFIXES) and not mount_point.startswith("/run/media/"):
+            continue
+        else:
+            mounts.append((mount_point, fstype))
+        seen.add((device, root))
+    return mounts
+
+
+def windows_drive_letters():
+    """Буквы дисков без обращения к самим дискам (os.path.exists на сетевом диске может висеть)"""
+    if hasattr(os, "listdrives"): # Python 3.12+
+        return os.listdrives()
+    import ctypes
+    import string
+    mask = ctypes.windll.kernel32.GetLogicalDrives()
+    return [f"{letter}:\\" for number, letter in enumerate(string.ascii_uppercase) if mask & (1 << number)]
+
+
+def load_drives():
+    """Узел "Этот компьютер" со списком дисков
+
+    Список строится без обращения к самим дискам, метки и емкость
+    запрашивает probe_drives в фоне.
+    """
+    root = ComputerNode("Этот компьютер")
+    root.children = []
+    if os.name == 'nt':  # Windows
+        drives = [(drive, "") for drive in windows_drive_letters()]
+    elif os.path.exists(MOUNTINFO_PATH):  # Linux
+        drives = read_mounts()
+    else:  # Mac
+        drives = [("/", "")]
+    for path, fstype in drives:
+        root.children.append(DriveNode(path, path, root, fstype))
+    return root
+
+
+def measure_drive(drive):
+    """Метка тома и (всего, свободно) байт диска; может надолго зависнуть на недоступном диске"""
+    label = ""
+    if os.name == 'nt':
+        try:
+            import win32api
+            label = win32api.GetVolumeInformation(drive.path)[0]
+        except Exception:
+            pass
+    usage = shutil.disk_usage(drive.path) # statvfs
+    return label, (usage.total, usage.free)
+
+
+def probe_drives(drives, on_result, timeout=DRIVE_PROBE_TIMEOUT):
+    """Опрашивает диски параллельно, каждый в своем потоке
+
+    on_result(диск, (метка, емкость) или None) вызывается из фоновых потоков.
+    Не ответивший за timeout диск получает None, но его поток не бросается:
+    если диск все-таки ответит, придет и настоящий результат.
+    """
+    pending = {}
+
+    def measure(drive, finished):
+        try:
+            info = measure_drive(drive)
+        except OSError:
+            info = None
+        finished.set()
+        on_result(drive, info)
+
+    def expire():
+        for drive, finished in pending.items():
+            if not finished.is_set():
+                on_result(drive, None)
+
+    for drive in drives:
+        pending[drive] = threading.Event()
+        threading.Thread(target=measure, args=(drive, pending[drive]), daemon=True, name="drive-probe").start()
+    timer = threading.Timer(timeout, expire)
+    timer.daemon = True
+    timer.start()
+
+
+def resolve_path(root, path, placeholders=None, create=True):
+    """Находит узел папки по пути, недостающие промежуточные узлы создает без чтения папок
+
+    placeholders (путь -> узел) запоминает узлы, созданные под еще не
+    прочитанными папками, чтобы при чтении родителя они заняли свое место.
+    create=False - только поиск среди уже существующих узлов, иначе None.
+    """
+    path = os.path.abspath(path)
+    drive = None
+    for candidate in root.children:
+        drive_path = candidate.path
+        if path == drive_path.rstrip(os.sep) or path.startswith(os.path.join(drive_path, "")):
+            if drive is None or len(drive_path) > len(drive.path):
+                drive = candidate
+    if drive is None:
+        return None
+    return descend_path(drive, os.path.relpath(path, drive.path), placeholders, create)
+
+
+def descend_path(node, rel, placeholders=None, create=True):
+    """Спускается от узла node по относительному пути rel (как resolve_path от диска)"""
+    if rel == ".":
+        return node
+    for part in rel.split(os.sep):
+        child = node.find_child(part)
+        if child is None or child.type == "file":
+            unread = node.children is None or node.loading
+            child_path = os.path.join(node.path, part)
+            child = placeholders.get(child_path) if unread and placeholders is not None else None
+            if child is None:
+                if not create:
+                    return None
+                child = FolderNode(part, node) # папка node еще не прочитана - узел без списка детей
+                if unread and placeholders is not None:
+                    placeholders[child_path] = child
+        node = child
+    return node
+
+
+def read_folder(node, cancel_event=None):
+    """Читает папку в узел целиком, в текущем потоке"""
+    node.forget_children()
+    node.children = []
+    for chunk in scan_directory(node.path, cancel_event or threading.Event()):
+        node.add_children([FolderNode(name, node, mtime) if is_dir else FileNode(name, node, size, mtime)
+                           for name, is_dir, size, mtime in chunk])
+    return node.children
+
+
+def is_archive_name(name):
+    """Архив, который можно открыть как папку"""
+    return name.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+class ArchiveNode(FolderNode):
+    """Архив, открытый как папка: списки читаются из оглавления архива, а не с диска
+
+    Путь узлов внутри архива - путь файла архива плюс путь внутри, на диске
+    таких путей нет: записи можно только смотреть и извлекать.
+    """
+    __slots__ = ()
+    type = "archive"
+
+
+def archive_root(node):
+    """Архив, внутри которого лежит узел (или сам архив), иначе None"""
+    while node is not None and node.type != "archive":
+        node = node.parent
+    return node
+
+
+class ArchiveIndex:
+    """Оглавление архива: папка внутри архива -> записи (имя, папка?, размер, дата)
+
+    У zip читается только центральный каталог в конце файла. tar оглавления
+    не имеет, его приходится пройти целиком (сжатый - распаковывая), поэтому
+    оглавления держит ArchiveCache и второй раз архив не читается. Отдельные
+    файлы распаковываются потоком, не трогая остальной архив.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.is_zip = path.lower().endswith(ZIP_EXTENSIONS)
+        self.folders = {"": {}} # путь внутри архива -> {имя: запись}
+        self.members = {} # путь файла внутри архива -> ZipInfo / TarInfo
+        import tarfile # нужны только при открытии архива, import core остается быстрым
+        import zipfile
+        if self.is_zip:
+            with zipfile.ZipFile(path) as archive:
+                for info in archive.infolist():
+                    try:
+                        mtime = time.mktime(info.date_time + (0, 0, -1))
+                    except (OverflowError, ValueError):
+                        mtime = None # испорченная дата DOS - показываем без даты
+                    self.add(info.filename, info.is_dir(), info.file_size, mtime, info)
+        else:
+            with tarfile.open(path, "r:*") as archive:
+                for info in archive: # один проход по потоку
+                    self.add(info.name, info.isdir(), info.size, info.mtime, info if info.isfile() else None)
+
+    def add(self, name, is_dir, size, mtime, info):
+        """Запись архива; недостающие папки пути создаются, пути с .. и абсолютные пропускаются"""
+        parts = [part for part in name.replace("\\", "/").split("/") if part not in ("", ".")]
+        if not parts or ".." in parts:
+            return
+        folder = ""
+        for part in parts[:-1]:
+            entries = self.folders[folder]
+            child = f"{folder}/{part}" if folder else part
+            if part not in entries:
+                entries[part] = (part, True, 0, mtime)
+                self.folders.setdefault(child, {})
+            folder = child
+        inner = "/".join(parts)
+        self.folders[folder][parts[-1]] = (parts[-1], is_dir, 0 if is_dir else size, mtime)
+        if is_dir:
+            self.folders.setdefault(inner, {})
+        elif info is not None:
+            self.members[inner] = info
+
+    def listing(self, inner=""):
+        """Записи папки внутри архива в формате scan_directory"""
+        entries = self.folders.get(inner)
+        if entries is None:
+            raise FileNotFoundError(errno.ENOENT, "Нет такой папки в архиве", f"{self.path}/{inner}")
+        return list(entries.values())
+
+    def files_under(self, inner):
+        """Файлы архива под путем inner (сам файл или все файлы папки)"""
+        if inner in self.members:
+            return [inner]
+        prefix = inner + "/"
+        return [name for name in self.members if name.startswith(prefix)]
+
+    def extract(self, inners, destination, cancel_event=None, on_progress=None):
+        """Распаковывает файлы и папки inners в папку destination, каждый файл - потоком
+
+        Структура сохраняется относительно папки, в которой лежат inners.
+        Возвращает [(путь, ошибка)]; существующие файлы не перезаписываются.
+        """
+        errors = []
+        targets = []
+        for inner in inners:
+            base = inner.rpartition("/")[0]
+            for name in self.files_under(inner):
+                relative = name[len(base) + 1:] if base else name
+                targets.append((name, os.path.join(destination, *relative.split("/"))))
+        if not self.is_zip:
+            targets.sort(key=lambda target: self.members[target[0]].offset_data) # сжатый tar - по порядку потока
+        done = 0
+        import tarfile
+        import zipfile
+        opener = zipfile.ZipFile if self.is_zip else tarfile.open
+        with opener(self.path) as archive:
+            for name, target in targets:
+                if cancel_event is not None and cancel_event.is_set():
+                    break
+                try:
+                    if os.path.lexists(target):
+                        raise FileExistsError(errno.EEXIST, "Файл уже существует", target)
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    info = self.members[name]
+                    source = archive.open(info) if self.is_zip else archive.extractfile(info)
+                    with source, open(target, "xb") as output:
+                        shutil.copyfileobj(source, output, COPY_BUFFER)
+                except (OSError, RuntimeError, zipfile.BadZipFile, tarfile.TarError) as e:
+                    errors.append((target, getattr(e, "strerror", None) or str(e)))
+                done += 1
+                if on_progress is not None:
+                    on_progress(done, len(targets))
+        return errors
+
+
+class ArchiveCache:
+    """Последние прочитанные оглавления архивов; архив, измененный на диске, читается заново"""
+    def __init__(self, limit=ARCHIVE_CACHE_MAX):
+        self.limit = limit
+        self.indexes = OrderedDict() # путь -> ((размер, дата), ArchiveIndex)
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        """Оглавление архива, при необходимости читается (в вызывающем потоке)"""
+        st = os.stat(path)
+        stamp = (st.st_size, st.st_mtime_ns)
+        with self.lock:
+            cached = self.indexes.get(path)
+            if cached is not None and cached[0] == stamp:
+                self.indexes.move_to_end(path)
+                return cached[1]
+        import tarfile
+        import zipfile
+        try:
+            index = ArchiveIndex(path)
+        except (zipfile.BadZipFile, tarfile.TarError, EOFError) as e:
+            raise OSError(errno.EINVAL, f"Не удалось прочитать архив: {e}", path)
+        with self.lock:
+            self.indexes[path] = (stamp, index)
+            while len(self.indexes) > self.limit:
+                self.indexes.popitem(last=False)
+        return index
+
+
+def format_size(size):
+    """Форматирует размер файла"""
+    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+        if size < 1024.0:
+            return f"{size:.1f} {unit}"
+        size /= 1024.0
+    return f"{size:.1f} PB"
+
+
+def entry_bytes(node):
+    """Примерный объем памяти одного узла в кэше
+
+    Считается только по имени, чтобы добавление и удаление узла стоили
+    одинаково: ключ естественной сортировки - это имя, приведенное к нижнему
+    регистру, плюс само имя, той же ширины символов (1, 2 или 4 байта).
+    """
+    name_bytes = sys.getsizeof(node.name)
+    return NODE_BYTES + 3 * name_bytes - EMPTY_STR_BYTES
+
+
+class ViewSnapshot:
+    """Снимок вида папки для истории переходов
+
+    Только строки и числа: путь, сортировка, первая видимая строка, имя
+    записи с фокусом ("..", если фокус на строке родителя) и выделенные
+    имена. Узлы не хранятся, поэтому история не держит в памяти списки
+    давно закрытых папок - их вытесняет ListingCache.
+    """
+    __slots__ = ("path", "sort_column", "sort_reverse", "top", "focus", "selected")
+
+    def __init__(self, path, sort_column="name", sort_reverse=False, top=0, focus=None, selected=()):
+        self.path = path
+        self.sort_column = sort_column
+        self.sort_reverse = sort_reverse
+        self.top = top
+        self.focus = focus
+        self.selected = tuple(selected)[:HISTORY_MAX_SELECTED]
+
+
+class NavigationHistory:
+    """История переходов (паттерн Снимок): список ViewSnapshot и позиция в нем
+
+    Текущая папка - тоже запись истории: перед уходом из нее save() записывает
+    туда прокрутку и выделение, чтобы "Назад" вернул вид в точности. При
+    переполнении история сжимается: из повторных посещений одной папки
+    остается ближайшее к текущей позиции, потом отбрасываются самые старые.
+    """
+    def __init__(self, limit=HISTORY_MAX_ENTRIES):
+        self.limit = limit
+        self.entries = []
+        self.index = -1
+
+    @property
+    def can_back(self):
+        return self.index > 0
+
+    @property
+    def can_forward(self):
+        return self.index < len(self.entries) - 1
+
+    def save(self, snapshot):
+        """Обновляет текущую запись (вид перед уходом из папки)"""
+        if self.index >= 0:
+            self.entries[self.index] = snapshot
+
+    def push(self, snapshot):
+        """Переход в новую папку: записи "вперед" отбрасываются"""
+        del self.entries[self.index + 1:]
+        if self.entries and self.entries[-1].path == snapshot.path:
+            self.entries[-1] = snapshot
+        else:
+            self.entries.append(snapshot)
+        self.index = len(self.entries) - 1
+        self.compact()
+
+    def back(self):
+        if not self.can_back:
+            return None
+        self.index -= 1
+        return self.entries[self.index]
+
+    def forward(self):
+        if not self.can_forward:
+            return None
+        self.index += 1
+        return self.entries[self.index]
+
+    def compact(self):
+        if len(self.entries) <= self.limit:
+            return
+        # Повторные посещения: оставляем ближайшее к текущей записи
+        seen = set()
+        kept = []
+        for i in sorted(range(len(self.entries)), key=lambda i: abs(i - self.index)):
+            path = self.entries[i].path
+            if i == self.index or path not in seen:
+                seen.add(path)
+                kept.append(i)
+        kept.sort()
+        self.index = kept.index(self.index)
+        self.entries = [self.entries[i] for i in kept]
+        # Все еще много - сначала самые старые, потом самые дальние "вперед"
+        extra = len(self.entries) - self.limit
+        if extra > 0:
+            older = min(extra, self.index)
+            del self.entries[:older]
+            self.index -= older
+            del self.entries[len(self.entries) - (extra - older):]
+
+
+class ListingCache:
+    """LRU-кэш прочитанных папок
+
+    Папки хранятся от давно использованных к недавним. При превышении лимитов
+    у самых холодных папок забывается список детей вместе со всеми вложенными
+    прочитанными папками. Закрепленные папки (текущая, история и их родители)
+    не вытесняются.
+    """
+    def __init__(self, max_entries=LISTING_CACHE_MAX_ENTRIES, max_bytes=LISTING_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.nodes = OrderedDict() # папка -> [число записей, примерный объем]
+        self.entries = 0
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, node):
+        return node in self.nodes
+
+    def lookup(self, node):
+        """Отмечает обращение к папке, True - список уже в памяти"""
+        if node in self.nodes:
+            self.hits += 1
+            self.nodes.move_to_end(node)
+            return True
+        self.misses += 1
+        return False
+
+    def add(self, node):
+        """Кладет в кэш только что прочитанную папку"""
+        self.discard(node)
+        size = [len(node.children), sum(entry_bytes(child) for child in node.children)]
+        self.nodes[node] = size
+        self.entries += size[0]
+        self.bytes += size[1]
+
+    def resize(self, node, entries, nbytes):
+        """Учитывает изменение списка папки (создание, удаление, переименование)"""
+        size = self.nodes.get(node)
+        if size is None:
+            return
+        size[0] += entries
+        size[1] += nbytes
+        self.entries += entries
+        self.bytes += nbytes
+
+    def discard(self, node):
+        """Убирает папку из учета (список забыт или перечитывается)"""
+        size = self.nodes.pop(node, None)
+        if size is not None:
+            self.entries -= size[0]
+            self.bytes -= size[1]
+
+    def over_limit(self):
+        return self.entries > self.max_entries or self.bytes > self.max_bytes
+
+    def evict(self, pinned):
+        """Вытесняет холодные папки, пока кэш не уложится в лимиты"""
+        for node in list(self.nodes):
+            if not self.over_limit():
+                break
+            if node in pinned or node not in self.nodes:
+                continue
+            self.drop_subtree(node)
+
+    def drop_subtree(self, root, evicted=True):
+        """Забывает папку и все прочитанные папки внутри нее"""
+        for node in [n for n in self.nodes if self.is_inside(n, root)]:
+            self.discard(node)
+            node.forget_children()
+            if evicted:
+                self.evictions += 1
+
+    @staticmethod
+    def is_inside(node, root):
+        while node is not None:
+            if node is root:
+                return True
+            node = node.parent
+        return False
+
+    def stats(self):
+        """Счетчики для настройки лимитов"""
+        lookups = self.hits + self.misses
+        return {
+            "folders": len(self.nodes),
+            "entries": self.entries,
+            "bytes": self.bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+NUMBER_RUN = re.compile(r"\d+")
+
+
+def natural_key(name):
+    """Ключ естественной сортировки без учета регистра: "file2" раньше "file10"
+
+    Числа дополняются своей длиной, чтобы сравнивались как числа, а в конце
+    через "\\0" идет само имя - ключи разных имен никогда не совпадают.
+    """
+    def number(match):
+        digits = match.group().lstrip("0") or "0"
+        return f"{len(digits):03d}{digits}"
+    return NUMBER_RUN.sub(number, name.casefold()) + "\0" + name
+
+
+def sort_name(node):
+    """Ключ естественной сортировки узла, считается один раз"""
+    key = node.sort_name
+    if key is None:
+        key = node.sort_name = natural_key(node.name)
+    return key
+
+
+def view_sort_key(node, column="name"):
+    """Порядок строк в списке: сначала папки, потом файлы, внутри - по колонке и имени"""
+    group = node.type != "folder"
+    if column == "size":
+        size = getattr(node, "size", None)
+        return (group, -1 if size is None else size, sort_name(node))
+    if column == "modified":
+        return (group, node.mtime or 0, sort_name(node))
+    if column == "type":
+        return (group, os.path.splitext(node.name)[1].casefold(), sort_name(node))
+    return (group, sort_name(node))
+
+
+def sorted_position(items, node, key, reverse, lo=0, right=False):
+    """bisect по списку, где группы (папки, файлы) идут по возрастанию, а внутри групп - как задано"""
+    target = key(node)
+    hi = len(items)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        probe = key(items[mid])
+        if probe[0] != target[0]:
+            before = probe[0] < target[0]
+        elif probe[1:] == target[1:]:
+            before = right
+        else:
+            before = (probe[1:] > target[1:]) if reverse else (probe[1:] < target[1:])
+        if before:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def make_child_node(parent, name):
+    """Создает узел для существующей записи папки, None - если записи уже нет"""
+    try:
+        st = os.stat(os.path.join(parent.path, name))
+    except OSError:
+        return None
+    if stat.S_ISDIR(st.st_mode):
+        return FolderNode(name, parent, st.st_mtime)
+    return FileNode(name, parent, st.st_size, st.st_mtime)
+
+
+class DirectoryWatcher(ABC):
+    """Базовый наблюдатель за папками
+
+    Работает в своем потоке и отдает события пачками в callback.
+    Событие - кортеж (вид, папка, имя, новая папка, новое имя), вид:
+    "created", "deleted", "modified", "moved", "overflow" (события потеряны)
+    или "rescan" (папку надо перечитать целиком).
+    """
+    def __init__(self, callback):
+        self.callback = callback
+        self.paths = {} # путь -> подробно ли следить (только для опроса)
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def sync(self, wanted):
+        """Приводит набор отслеживаемых папок к wanted (путь -> подробно)"""
+        with self.lock:
+            for path in [p for p in self.paths if p not in wanted]:
+                self.remove_watch(path)
+                del self.paths[path]
+            for path, deep in wanted.items():
+                if path in self.paths or self.add_watch(path, deep):
+                    self.paths[path] = deep
+
+    @abstractmethod
+    def add_watch(self, path, deep):
+        """Начинает следить за папкой (под self.lock), False - не получилось"""
+
+    @abstractmethod
+    def remove_watch(self, path):
+        """Перестает следить за папкой (под self.lock)"""
+
+    @abstractmethod
+    def run(self):
+        """Цикл потока наблюдателя: до stop() отдает события в callback"""
+
+
+class InotifyWatcher(DirectoryWatcher):
+    """Наблюдатель на inotify (Linux), вызовы через ctypes"""
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    MASK = IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+    EVENT_HEADER = struct.Struct("iIII") # wd, mask, cookie, len
+
+    def __init__(self, callback):
+        super().__init__(callback)
+        import ctypes
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        self.wake_r, self.wake_w = os.pipe() # чтобы разбудить поток при остановке
+        self.wd_paths = {} # дескриптор наблюдения -> путь папки
+        self.path_wds = {}
+
+    def stop(self):
+        super().stop()
+        os.write(self.wake_w, b"x")
+
+    def add_watch(self, path, deep):
+        if path in self.path_wds:
+            return True
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), self.MASK)
+        if wd < 0:
+            return False # нет прав или кончился лимит наблюдений
+        self.wd_paths[wd] = path # тот же inode дает тот же wd - путь обновится после переименования
+        self.path_wds[path] = wd
+        return True
+
+    def remove_watch(self, path):
+        wd = self.path_wds.pop(path, None)
+        if wd is not None and self.wd_paths.get(wd) == path:
+            del self.wd_paths[wd]
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def run(self):
+        events = []
+        moves = {} # cookie -> (папка, имя) для IN_MOVED_FROM без пары
+        deadline = None
+        while not self.stopped.is_set():
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            ready, _, _ = select.select([self.fd, self.wake_r], [], [], timeout)
+            if self.fd in ready:
+                try:
+                    data = os.read(self.fd, 64 * 1024)
+                except BlockingIOError:
+                    data = b""
+                with self.lock:
+                    self.parse(data, events, moves)
+                if deadline is None and (events or moves):
+                    deadline = time.monotonic() + WATCH_BATCH_SEC
+            if deadline is not None and time.monotonic() >= deadline:
+                # Переезд без пары - запись ушла в неотслеживаемую папку
+                events.extend(("deleted", d, n, None, None) for d, n in moves.values())
+                moves.clear()
+                self.callback(events)
+                events = []
+                deadline = None
+        os.close(self.fd)
+        os.close(self.wake_r)
+        os.close(self.wake_w)
+
+    def parse(self, data, events, moves):
+        """Разбирает буфер struct inotify_event в события наблюдателя"""
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].split(b"\0", 1)[0])
+            offset += length
+
+            if mask & self.IN_Q_OVERFLOW:
+                events.append(("overflow", None, None, None, None))
+                continue
+            if mask & self.IN_IGNORED:
+                path = self.wd_paths.pop(wd, None) # папку удалили или наблюдение снято
+                if path is not None and self.path_wds.get(path) == wd:
+                    del self.path_wds[path]
+                continue
+            folder = self.wd_paths.get(wd)
+            if folder is None or not name:
+                continue
+
+            if mask & self.IN_MOVED_FROM:
+                moves[cookie] = (folder, name)
+            elif mask & self.IN_MOVED_TO:
+                source = moves.pop(cookie, None)
+                if source:
+                    events.append(("moved", source[0], source[1], folder, name))
+                else:
+                    events.append(("created", folder, name, None, None))
+            elif mask & self.IN_CREATE:
+                events.append(("created", folder, name, None, None))
+            elif mask & self.IN_DELETE:
+                events.append(("deleted", folder, name, None, None))
+            else:
+                events.append(("modified", folder, name, None, None))
+
+
+class PollingWatcher(DirectoryWatcher):
+    """Запасной наблюдатель: опрашивает mtime папок
+
+    У обычных папок содержимое перечитывается только при смене mtime самой папки
+    (создание, удаление, переименование). Подробные папки (текущая) сравниваются
+    целиком, чтобы замечать и изменения файлов.
+    """
+    def __init__(self, callback, interval=WATCH_POLL_INTERVAL):
+        super().__init__(callback)
+        self.interval = interval
+        self.snapshots = {} # путь -> (mtime_ns папки, {имя: (папка ли, размер, mtime)})
+        self.added = {} # путь -> когда начали следить (time_ns)
+
+    def add_watch(self, path, deep):
+        self.added[path] = time.time_ns() # снимок сделает поток при следующем опросе
+        return True
+
+    def remove_watch(self, path):
+        self.snapshots.pop(path, None)
+        self.added.pop(path, None)
+
+    @staticmethod
+    def snapshot(path):
+        entries = {}
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    st = entry.stat()
+                    entries[entry.name] = (entry.is_dir(), st.st_size, st.st_mtime)
+                except OSError:
+                    continue
+        return entries
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            with self.lock:
+                paths = list(self.paths.items())
+            events = []
+            for path, deep in paths:
+                try:
+                    mtime = os.stat(path).st_mtime_ns
+                    old = self.snapshots.get(path)
+                    if old is not None and old[0] == mtime and not deep:
+                        continue
+                    entries = self.snapshot(path)
+                except OSError:
+                    continue
+                with self.lock:
+                    if path not in self.paths:
+                        continue
+                    self.snapshots[path] = (mtime, entries)
+                    added = self.added.get(path, 0)
+                if old is None:
+                    # Первый снимок - сравнивать не с чем. Если папка менялась
+                    # после того, как ее прочитали, кэш надо перечитать целиком
+                    if mtime >= added - 1_000_000_000: # с запасом на грубые метки времени ФС
+                        events.append(("rescan", path, None, None, None))
+                    continue
+                old_entries = old[1]
+                for name, info in entries.items():
+                    if name not in old_entries:
+                        events.append(("created", path, name, None, None))
+                    elif old_entries[name] != info:
+                        events.append(("modified", path, name, None, None))
+                for name in old_entries:
+                    if name not in entries:
+                        events.append(("deleted", path, name, None, None))
+            if events:
+                self.callback(events)
+
+
+def create_watcher(callback):
+    """inotify на Linux, иначе опрос mtime"""
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(callback)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(callback)
+
+
+def name_matcher(query):
+    """Проверка имени для поиска: подстрока или маска (*, ?, []), без учета регистра
+
+    Возвращает функцию от имени в нижнем регистре и литералы запроса
+    длиной от трех символов (по ним индекс выбирает кандидатов).
+    """
+    query = query.lower()
+    if any(ch in query for ch in "*?["):
+        literals = [part for part in re.split(r"\*|\?|\[[^\]]*\]", query) if len(part) >= 3]
+        return re.compile(fnmatch.translate(query)).match, literals
+    return (lambda lower: query in lower), ([query] if len(query) >= 3 else [])
+
+
+def name_trigrams(name):
+    """Тройки символов имени в нижнем регистре"""
+    name = name.lower()
+    return {name[i:i + 3] for i in range(len(name) - 2)}
+
+
+class CompletionIndex:
+    """Имена подпапок для автодополнения пути: отсортированный список на папку
+
+    Поиск по началу имени - bisect, поэтому подсказки даже для папки на 100k
+    записей находятся за микросекунды. Списки строятся в фоновом потоке -
+    из уже прочитанного списка папки или, если папку не читали, из одних
+    имен (scandir без stat). stamp отличает устаревший список: прочитанная
+    папка изменилась или появилась вместо чтения имен.
+    """
+    def __init__(self, on_ready):
+        self.on_ready = on_ready # (путь), вызывается из рабочего потока
+        self.folders = OrderedDict() # путь -> (stamp, ключи casefold, имена)
+        self.building = set() # (путь, stamp)
+        self.lock = threading.Lock()
+        from concurrent.futures import ThreadPoolExecutor
+        self.pool = ThreadPoolExecutor(1, thread_name_prefix="complete")
+
+    def complete(self, path, prefix, stamp=None, limit=COMPLETION_MAX_ITEMS):
+        """Подпапки path, имена которых начинаются с prefix (без учета регистра)
+
+        None - списка для этой папки еще нет, он строится, по готовности
+        придет on_ready(path). Скрытые папки - только если prefix начинается с точки.
+        """
+        with self.lock:
+            entry = self.folders.get(path)
+            if entry is not None and entry[0] == stamp:
+                self.folders.move_to_end(path)
+            else:
+                entry = None
+        if entry is None:
+            return None
+        _, keys, names = entry
+        key = prefix.casefold()
+        hidden = key.startswith(".")
+        result = []
+        for i in range(bisect.bisect_left(keys, key), len(keys)):
+            if not keys[i].startswith(key) or len(result) >= limit:
+                break
+            if hidden or not keys[i].startswith("."):
+                result.append(names[i])
+        return result
+
+    def request(self, path, stamp=None, nodes=None):
+        """Строит список папки в фоне: из узлов прочитанной папки или чтением имен с диска"""
+        with self.lock:
+            if (path, stamp) in self.building:
+                return
+            self.building.add((path, stamp))
+        self.pool.submit(self.build, path, stamp, nodes)
+
+    def build(self, path, stamp, nodes):
+        try:
+            if nodes is not None:
+                names = [node.name for node in nodes if node.type != "file"]
+            else:
+                with os.scandir(path) as entries:
+                    names = [entry.name for entry in entries if entry.is_dir()]
+        except OSError:
+            names = []
+        pairs = sorted((name.casefold(), name) for name in names)
+        with self.lock:
+            self.building.discard((path, stamp))
+            self.folders[path] = (stamp, [key for key, _ in pairs], [name for _, name in pairs])
+            self.folders.move_to_end(path)
+            while len(self.folders) > COMPLETION_MAX_FOLDERS:
+                self.folders.popitem(last=False)
+        self.on_ready(path)
+
+
+class FilenameIndex:
+    """Индекс имен файлов для поиска по подстроке и по маске (*, ?, [])
+
+    Все имена лежат в одном списке, для каждой тройки символов имени хранится
+    массив номеров записей. Изменения копятся в очереди и применяются фоновым
+    потоком; поиск пересекает массивы троек запроса и проверяет только
+    найденных кандидатов. Номера удаленных записей переиспользуются, поэтому
+    в массивах троек бывают устаревшие номера - их отсеивает проверка имени,
+    а при большом количестве мусора массивы перестраиваются. Кандидаты берутся
+    из самого короткого массива троек запроса и проверяются по имени до
+    набора лимита результатов.
+    """
+    def __init__(self):
+        self.names = [] # номер записи -> имя (None - запись удалена)
+        self.parents = array("i") # номер записи -> номер папки
+        self.is_dir = bytearray() # номер записи -> 1 для папок
+        self.dir_paths = [] # номер папки -> путь
+        self.dir_ids = {} # путь папки -> номер
+        self.dir_entries = {} # номер папки -> {имя: номер записи}
+        self.dir_children = {} # номер папки -> множество номеров вложенных папок
+        self.trigrams = {} # тройка символов -> array номеров записей
+        self.free = [] # номера удаленных записей
+        self.stale = 0 # сколько устаревших номеров в массивах троек
+        self.count = 0 # живых записей
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    # --- изменения (из любого потока, применяются в фоне) ---
+
+    def replace_dir(self, path, entries):
+        """Полный список папки: entries - пары (имя, папка ли)"""
+        self.queue.put(("replace", path, entries))
+
+    def add(self, path, name, is_dir):
+        self.queue.put(("add", path, name, is_dir))
+
+    def remove(self, path, name):
+        self.queue.put(("remove", path, name))
+
+    def rename(self, path, old_name, new_name):
+        self.queue.put(("rename", path, old_name, new_name))
+
+    def remove_tree(self, path):
+        """Папка удалена - забываем все, что было внутри"""
+        self.queue.put(("remove_tree", path))
+
+    def move_tree(self, old_path, new_path):
+        """Папка переименована - меняем пути вложенных папок"""
+        self.queue.put(("move_tree", old_path, new_path))
+
+    def run(self):
+        while True:
+            op = self.queue.get()
+            with self.lock:
+                if op[0] == "replace":
+                    self.apply_replace(op[1], op[2])
+                elif op[0] == "add":
+                    self.apply_remove(op[1], op[2]) # повторное добавление не дублирует запись
+                    self.apply_add(self.dir_id(op[1]), op[2], op[3])
+                elif op[0] == "remove":
+                    self.apply_remove(op[1], op[2])
+                elif op[0] == "rename":
+                    is_dir = self.apply_remove(op[1], op[2])
+                    if is_dir is not None:
+                        self.apply_add(self.dir_id(op[1]), op[3], is_dir)
+                elif op[0] == "remove_tree":
+                    self.apply_remove_tree(op[1])
+                else:
+                    self.apply_move_tree(op[1], op[2])
+                if self.stale > max(100_000, self.count):
+                    self.compact()
+
+    def dir_id(self, path):
+        dir_id = self.dir_ids.get(path)
+        if dir_id is None:
+            parent = os.path.dirname(path)
+            parent_id = self.dir_id(parent) if parent != path else None # цепочка предков тоже заводится
+            dir_id = len(self.dir_paths)
+            self.dir_paths.append(path)
+            self.dir_ids[path] = dir_id
+            self.dir_entries[dir_id] = {}
+            self.dir_children[dir_id] = set()
+            if parent_id is not None:
+                self.dir_children[parent_id].add(dir_id)
+        return dir_id
+
+    def apply_replace(self, path, entries):
+        dir_id = self.dir_id(path)
+        entries = dict((name, is_dir) for name, is_dir, *_ in entries)
+        current = self.dir_entries[dir_id]
+        for name in [name for name in current if name not in entries]:
+            self.drop(dir_id, current[name])
+        for name, is_dir in entries.items():
+            if name in current:
+                self.is_dir[current[name]] = is_dir
+            else:
+                self.apply_add(dir_id, name, is_dir)
+
+    def apply_add(self, dir_id, name, is_dir):
+        if self.free:
+            entry_id = self.free.pop()
+            self.names[entry_id] = name
+            self.parents[entry_id] = dir_id
+            self.is_dir[entry_id] = is_dir
+        else:
+            entry_id = len(self.names)
+            self.names.append(name)
+            self.parents.append(dir_id)
+            self.is_dir.append(is_dir)
+        self.dir_entries[dir_id][name] = entry_id
+        trigrams = self.trigrams
+        lower = name.lower()
+        for trigram in {lower[i:i + 3] for i in range(len(lower) - 2)}:
+            postings = trigrams.get(trigram)
+            if postings is None:
+                postings = trigrams[trigram] = array("i")
+            postings.append(entry_id)
+        self.count += 1
+
+    def apply_remove(self, path, name):
+        dir_id = self.dir_ids.get(path)
+        if dir_id is None:
+            return None
+        entry_id = self.dir_entries[dir_id].get(name)
+        if entry_id is None:
+            return None
+        is_dir = self.is_dir[entry_id]
+        self.drop(dir_id, entry_id)
+        return is_dir
+
+    def subtree_dirs(self, path):
+        """Номера папок path и всех вложенных в нее"""
+        dir_id = self.dir_ids.get(path)
+        if dir_id is None:
+            return []
+        result = [dir_id]
+        for dir_id in result: # список растет по ходу обхода
+            result.extend(self.dir_children[dir_id])
+        return result
+
+    def unlink_dir(self, path, dir_id):
+        """Отцепляет папку от родителя"""
+        parent_id = self.dir_ids.get(os.path.dirname(path))
+        if parent_id is not None and parent_id != dir_id:
+            self.dir_children[parent_id].discard(dir_id)
+
+    def apply_remove_tree(self, path):
+        subtree = self.subtree_dirs(path)
+        if subtree:
+            self.unlink_dir(path, subtree[0])
+        for dir_id in subtree:
+            for entry_id in self.dir_entries.pop(dir_id).values():
+                self.release(entry_id)
+            del self.dir_children[dir_id]
+            del self.dir_ids[self.dir_paths[dir_id]]
+            self.dir_paths[dir_id] = None
+
+    def apply_move_tree(self, old_path, new_path):
+        subtree = self.subtree_dirs(old_path)
+        if not subtree:
+            return
+        if new_path in self.dir_ids: # на новом месте уже что-то было проиндексировано
+            self.apply_remove_tree(new_path)
+        self.unlink_dir(old_path, subtree[0])
+        for dir_id in subtree:
+            old = self.dir_paths[dir_id]
+            del self.dir_ids[old]
+            new = new_path + old[len(old_path):]
+            self.dir_ids[new] = dir_id
+            self.dir_paths[dir_id] = new
+        parent = os.path.dirname(new_path)
+        if parent != new_path:
+            self.dir_children[self.dir_id(parent)].add(subtree[0])
+
+    def drop(self, dir_id, entry_id):
+        del self.dir_entries[dir_id][self.names[entry_id]]
+        self.release(entry_id)
+
+    def release(self, entry_id):
+        """Освобождает номер записи для переиспользования"""
+        self.stale += max(0, len(self.names[entry_id]) - 2)
+        self.names[entry_id] = None
+        self.free.append(entry_id)
+        self.count -= 1
+
+    def compact(self):
+        """Перестраивает массивы троек без устаревших номеров"""
+        self.trigrams = {}
+        for entry_id, name in enumerate(self.names):
+            if name is not None:
+                for trigram in name_trigrams(name):
+                    postings = self.trigrams.get(trigram)
+                    if postings is None:
+                        postings = self.trigrams[trigram] = array("i")
+                    postings.append(entry_id)
+        self.stale = 0
+
+    # --- поиск (из главного потока) ---
+
+    def search(self, query, limit=SEARCH_MAX_RESULTS):
+        """Возвращает [(папка, имя, папка ли)]: подстрока или маска, без учета регистра"""
+        matcher, literals = name_matcher(query)
+
+        results = []
+        found = set()
+        names = self.names
+        with self.lock:
+            candidates = self.candidates(literals)
+            if candidates is None:
+                candidates = range(len(names)) # короткий запрос - проверяем все имена
+            for entry_id in candidates:
+                name = names[entry_id]
+                if name is None or entry_id in found:
+                    continue
+                lower = name.lower()
+                if matcher(lower):
+                    found.add(entry_id)
+                    results.append((self.dir_paths[self.parents[entry_id]], name, bool(self.is_dir[entry_id])))
+                    if len(results) >= limit:
+                        break
+        results.sort(key=lambda r: (r[0], r[1]))
+        return results
+
+    def candidates(self, literals):
+        """Кандидаты - самый короткий массив среди троек литералов запроса"""
+        trigrams = set()
+        for literal in literals:
+            trigrams |= name_trigrams(literal)
+        if not trigrams:
+            return None
+        return min((self.trigrams.get(t, ()) for t in trigrams), key=len)
+
+
+def caseless_pattern(text):
+    """Шаблон для поиска text в UTF-8 байтах без учета регистра
+
+    re.IGNORECASE у байтовых шаблонов понимает только ASCII, поэтому для
+    остальных символов перечисляются байты всех их регистров.
+    """
+    parts = []
+    for char in text:
+        if char.isascii():
+            parts.append(re.escape(char.encode("utf-8")))
+            continue
+        variants = dict.fromkeys((char, char.lower(), char.upper(), char.casefold()))
+        encoded = [re.escape(variant.encode("utf-8")) for variant in variants]
+        parts.append(encoded[0] if len(encoded) == 1 else b"(?:" + b"|".join(encoded) + b")")
+    return b"".join(parts)
+
+
+def grep_buffer(path, data, regex, max_matches):
+    """Совпадения в буфере (bytes или mmap): по одному на строку"""
+    found = []
+    line = 1
+    counted = 0 # до какого места уже посчитаны переводы строк
+    skip_until = -1
+    for match in regex.finditer(data):
+        start = match.start()
+        if start < skip_until:
+            continue # это та же строка
+        line += data[counted:start].count(b"\n")
+        counted = start
+        line_start = data.rfind(b"\n", 0, start) + 1
+        line_end = data.find(b"\n", start)
+        if line_end == -1:
+            line_end = len(data)
+        snippet = data[line_start:min(line_end, line_start + GREP_SNIPPET)]
+        found.append((path, line, snippet.decode("utf-8", "replace").strip()))
+        skip_until = line_end
+        if len(found) >= max_matches:
+            break
+    return found
+
+
+def grep_batch(paths, pattern, flags):
+    """Ищет pattern в пачке файлов, выполняется в отдельном процессе
+
+    Начало файла читается обычным read, двоичные файлы (с нулевым байтом
+    в начале) пропускаются, остальное просматривается через mmap без
+    копирования всего файла в память процесса.
+    """
+    regex = re.compile(pattern, flags)
+    matches = []
+    binary = 0
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                head = f.read(GREP_SNIFF_BYTES)
+                if b"\0" in head:
+                    binary += 1
+                    continue
+                if len(head) < GREP_SNIFF_BYTES:
+                    matches.extend(grep_buffer(path, head, regex, GREP_MATCHES_PER_FILE)) # файл прочитан целиком
+                    continue
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    matches.extend(grep_buffer(path, data, regex, GREP_MATCHES_PER_FILE))
+        except (OSError, ValueError):
+            continue
+    return matches, len(paths), binary
+
+
+def walk_files(root, cancel_event):
+    """Обходит файлы под root (без ссылок), выдает (путь, размер)"""
+    stack = [root]
+    while stack and not cancel_event.is_set():
+        path = stack.pop()
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            yield entry.path, entry.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+
+
+def spawn_pool(workers):
+    """Пул процессов; spawn, а не fork: в главном процессе работают потоки и Tk"""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+class ContentSearchJob:
+    """Поиск текста в файлах под одной папкой"""
+    def __init__(self, root, text):
+        self.root = root
+        self.text = text
+        self.cancel_event = threading.Event()
+        self.files = 0 # просмотрено файлов
+        self.binary = 0 # пропущено двоичных
+        self.too_big = 0 # пропущено из-за размера
+        self.matches = 0
+        self.started = time.monotonic()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+
+class ContentSearcher:
+    """Поиск по содержимому в пуле процессов с потоковой выдачей результатов"""
+    def __init__(self, workers=GREP_WORKERS, max_file_size=GREP_MAX_FILE_SIZE):
+        self.workers = workers
+        self.max_file_size = max_file_size
+        self.pool = None # процессы запускаются при первом поиске
+
+    def get_pool(self):
+        if self.pool is None:
+            self.pool = spawn_pool(self.workers)
+        return self.pool
+
+    def start(self, root, text, on_results, on_done):
+        """Запускает поиск; on_results(задача, совпадения) и on_done(задача) зовутся из фонового потока"""
+        job = ContentSearchJob(root, text)
+        threading.Thread(target=self.run_job, args=(job, on_results, on_done), daemon=True).start()
+        return job
+
+    def run_job(self, job, on_results, on_done):
+        """Координатор: обходит дерево и раздает пачки файлов процессам"""
+        from concurrent.futures import wait, FIRST_COMPLETED
+        pattern = caseless_pattern(job.text)
+        pool = self.get_pool()
+        in_flight = set()
+
+        def collect():
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                in_flight.discard(future)
+                if job.cancelled or future.cancelled():
+                    continue
+                try:
+                    matches, files, binary = future.result()
+                except Exception:
+                    continue
+                job.files += files
+                job.binary += binary
+                matches = matches[:max(0, GREP_MAX_MATCHES - job.matches)]
+                job.matches += len(matches)
+                on_results(job, matches)
+                if job.matches >= GREP_MAX_MATCHES:
+                    job.cancel()
+
+        try:
+            batch = []
+            batch_bytes = 0
+            for path, size in walk_files(job.root, job.cancel_event):
+                if size > self.max_file_size:
+                    job.too_big += 1
+                    continue
+                batch.append(path)
+                batch_bytes += size
+                if len(batch) >= GREP_BATCH_FILES or batch_bytes >= GREP_BATCH_BYTES:
+                    in_flight.add(pool.submit(grep_batch, batch, pattern, re.IGNORECASE))
+                    batch = []
+                    batch_bytes = 0
+                    while len(in_flight) >= 2 * self.workers: # не складываем в очередь все дерево сразу
+                        collect()
+            if batch and not job.cancelled:
+                in_flight.add(pool.submit(grep_batch, batch, pattern, re.IGNORECASE))
+
+            while in_flight:
+                if job.cancelled:
+                    for future in in_flight:
+                        future.cancel()
+                    break
+                collect()
+        except Exception:
+            # пул сломан (упал процесс или его не удалось запустить) - пересоздадим при следующем поиске
+            self.pool = None
+            job.cancel()
+        finally:
+            on_done(job)
+
+
+def walk_file_stats(root, cancel_event):
+    """Обходит файлы под root (без ссылок), выдает (путь, stat)"""
+    stack = [root]
+    while stack and not cancel_event.is_set():
+        path = stack.pop()
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            yield entry.path, entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+
+
+def edge_hash_batch(items):
+    """Хэши начала и конца файлов: [(путь, размер)] -> [(путь, размер, хэш или None, прочитано байт)]
+
+    Файл не длиннее двух краев читается целиком - его хэш краев уже полный.
+    """
+    import hashlib
+    results = []
+    for path, size in items:
+        try:
+            with open(path, "rb") as f:
+                if size <= 2 * DUP_EDGE_BYTES:
+                    data = f.read()
+                else:
+                    data = f.read(DUP_EDGE_BYTES)
+                    f.seek(-DUP_EDGE_BYTES, os.SEEK_END)
+                    data += f.read(DUP_EDGE_BYTES)
+        except OSError:
+            results.append((path, size, None, 0))
+            continue
+        results.append((path, size, hashlib.blake2b(data, digest_size=16).digest(), len(data)))
+    return results
+
+
+def full_hash_batch(items):
+    """Полные хэши (в процессе пула): [(путь, размер)] -> [(путь, размер, хэш или None, прочитано байт)]"""
+    import hashlib
+    results = []
+    buffer = bytearray(DUP_HASH_CHUNK)
+    view = memoryview(buffer)
+    for path, size in items:
+        digest = hashlib.blake2b(digest_size=20)
+        done = 0
+        try:
+            with open(path, "rb", buffering=0) as f:
+                while True:
+                    count = f.readinto(buffer)
+                    if not count:
+                        break
+                    digest.update(view[:count])
+                    done += count
+        except OSError:
+            results.append((path, size, None, done))
+            continue
+        # Файл изменился во время поиска - не считаем его копией
+        results.append((path, size, digest.digest() if done == size else None, done))
+    return results
+
+
+class DuplicateJob:
+    """Поиск одинаковых файлов под одной папкой"""
+    def __init__(self, root):
+        self.root = root
+        self.cancel_event = threading.Event()
+        self.files = 0 # обойдено файлов
+        self.bytes_total = 0 # их общий размер
+        self.bytes_read = 0 # прочитано для хэшей
+        self.edge_hashed = 0
+        self.full_hashed = 0
+        self.groups = {} # (размер, хэш) -> пути одинаковых файлов
+        self.error = None # исключение, из-за которого поиск прерван
+        self.started = time.monotonic()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    @property
+    def wasted(self):
+        """Сколько байт освободится, если оставить по одному файлу из группы"""
+        return sum(size * (len(paths) - 1) for (size, _), paths in self.groups.items() if len(paths) > 1)
+
+
+class DuplicateFinder:
+    """Поиск дубликатов по этапам, каждый следующий читает меньше файлов
+
+    1. Обход дерева: файлы группируются по размеру, жесткие ссылки на один
+       inode считаются одним файлом (их удаление места не освобождает).
+    2. Хэш первых и последних DUP_EDGE_BYTES у файлов с совпавшим размером
+       (пул потоков, чтение маленькое).
+    3. Полный хэш только у файлов с совпавшими краями - в пуле процессов,
+       блоками по DUP_HASH_CHUNK.
+    Этапы идут одновременно с обходом: файл отправляется дальше, как только
+    у него появился кандидат в пару. Группы отдаются в интерфейс по мере
+    нахождения, повторная отправка группы содержит все ее пути.
+    """
+    def __init__(self, workers=GREP_WORKERS):
+        self.workers = workers
+        self.pool = None # процессы запускаются при первом поиске
+        from concurrent.futures import ThreadPoolExecutor
+        self.threads = ThreadPoolExecutor(max_workers=4, thread_name_prefix="dup-edges")
+
+    def get_pool(self):
+        if self.pool is None:
+            self.pool = spawn_pool(self.workers)
+        return self.pool
+
+    def start(self, root, on_groups, on_done):
+        """Запускает поиск; on_groups(задача, группы) и on_done(задача) зовутся из фонового потока"""
+        job = DuplicateJob(root)
+        threading.Thread(target=self.run_job, args=(job, on_groups, on_done), daemon=True).start()
+        return job
+
+    def run_job(self, job, on_groups, on_done):
+        """Координатор: обход, раздача этапов и сбор групп"""
+        from concurrent.futures import wait, FIRST_COMPLETED
+        by_size = {} # размер -> [путь]
+        by_edge = {} # (размер, хэш краев) -> [путь]
+        inodes = set()
+        edge_queue = []
+        full_queue = []
+        full_bytes = 0
+        in_flight = {} # future -> этап
+        changed = set() # группы, изменившиеся с прошлой отправки
+        last_report = time.monotonic()
+
+        def submit_edges():
+            in_flight[self.threads.submit(edge_hash_batch, list(edge_queue))] = "edge"
+            edge_queue.clear()
+
+        def submit_full():
+            nonlocal full_bytes
+            in_flight[self.get_pool().submit(full_hash_batch, list(full_queue))] = "full"
+            full_queue.clear()
+            full_bytes = 0
+
+        def queue_full(path, size):
+            nonlocal full_bytes
+            full_queue.append((path, size))
+            full_bytes += size
+            if len(full_queue) >= DUP_BATCH_FILES or full_bytes >= DUP_BATCH_BYTES:
+                submit_full()
+
+        def add_final(path, size, digest):
+            """Файл с известным полным хэшем"""
+            paths = job.groups.setdefault((size, digest), [])
+            paths.append(path)
+            if len(paths) > 1:
+                changed.add((size, digest))
+
+        def collect(timeout):
+            done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = in_flight.pop(future)
+                if job.cancelled or future.cancelled():
+                    continue
+                for path, size, digest, read in future.result():
+                    job.bytes_read += read
+                    if digest is None:
+                        continue
+                    if stage == "full":
+                        job.full_hashed += 1
+                        add_final(path, size, digest)
+                        continue
+                    job.edge_hashed += 1
+                    if size <= 2 * DUP_EDGE_BYTES: # прочитан целиком - хэш краев окончательный
+                        add_final(path, size, digest)
+                        continue
+                    same = by_edge.setdefault((size, digest), [])
+                    same.append(path)
+                    if len(same) == 2:
+                        queue_full(same[0], size)
+                    if len(same) >= 2:
+                        queue_full(path, size)
+
+        def report(force=False):
+            nonlocal last_report
+            if force or time.monotonic() - last_report >= DUP_PROGRESS_SEC:
+                last_report = time.monotonic()
+                groups = [(key, list(job.groups[key])) for key in changed]
+                changed.clear()
+                on_groups(job, groups)
+
+        try:
+            for path, st in walk_file_stats(job.root, job.cancel_event):
+                if st.st_size == 0:
+                    continue # пустые файлы одинаковы, но места не занимают
+                if st.st_nlink > 1:
+                    if (st.st_dev, st.st_ino) in inodes:
+                        continue
+                    inodes.add((st.st_dev, st.st_ino))
+                job.files += 1
+                job.bytes_total += st.st_size
+                same = by_size.setdefault(st.st_size, [])
+                same.append(path)
+                if len(same) == 2:
+                    edge_queue.append((same[0], st.st_size))
+                if len(same) >= 2:
+                    edge_queue.append((path, st.st_size))
+                    if len(edge_queue) >= DUP_EDGE_BATCH:
+                        submit_edges()
+                if in_flight and job.files % 1000 == 0:
+                    collect(0)
+                    report()
+                while len(in_flight) >= 4 * self.workers and not job.cancelled: # не держим в очереди все дерево
+                    collect(None)
+                    report()
+
+            # Обход закончен - дописываем неполные пачки и ждем этапы, которые порождают новые
+            while not job.cancelled:
+                if edge_queue:
+                    submit_edges()
+                if full_queue and "edge" not in in_flight.values(): # краев больше не будет - пачка полная
+                    submit_full()
+                if not in_flight:
+                    break
+                collect(DUP_PROGRESS_SEC)
+                report()
+            if job.cancelled:
+                for future in in_flight:
+                    future.cancel()
+            else:
+                report(force=True)
+        except Exception as e:
+            # пул сломан (упал процесс или его не удалось запустить) - пересоздадим при следующем поиске
+            self.pool = None
+            job.error = e
+            job.cancel()
+        finally:
+            on_done(job)
+
+
+class SizeJob:
+    """Подсчет размеров набора папок"""
+    def __init__(self, roots):
+        self.roots = roots # пути папок, размер которых нужен
+        self.cancel_event = threading.Event()
+        self.done = threading.Event() # подсчет закончен, отменен или упал
+        self.error = None # исключение, из-за которого подсчет прерван
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+
+class FolderSizeEngine:
+    """Рекурсивный подсчет размеров папок в пуле потоков
+
+    Каждая папка обходится отдельной задачей пула. Для папки кэшируется сумма
+    размеров ее файлов и список подпапок с ключом по mtime самой папки, поэтому
+    повторный подсчет стоит один stat на папку, а заново читаются только
+    изменившиеся папки. Изменение содержимого файла не меняет mtime папки -
+    такие папки сбрасываются через invalidate (наблюдатель, "Обновить").
+    Подсчет не переходит на другие файловые системы и не идет по ссылкам.
+    """
+    def __init__(self, workers=SIZE_WORKERS, max_dirs=SIZE_CACHE_MAX_DIRS, on_listing=None):
+        from concurrent.futures import ThreadPoolExecutor
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="du")
+        self.max_dirs = max_dirs
+        self.on_listing = on_listing # сюда отдаются прочитанные списки папок (индекс имен)
+        self.cache = {} # путь -> (mtime_ns, байт в файлах папки, подпапки)
+        self.lock = threading.Lock()
+
+    def invalidate(self, path):
+        """Забывает сумму файлов папки, подпапки проверятся по mtime"""
+        with self.lock:
+            self.cache.pop(path, None)
+
+    def visit(self, path):
+        """Сумма файлов и подпапки одной папки (в потоке пула)"""
+        st = os.stat(path, follow_symlinks=False)
+        with self.lock:
+            cached = self.cache.get(path)
+        if cached is not None and cached[0] == st.st_mtime_ns:
+            return st.st_dev, cached[1], cached[2]
+
+        own = 0
+        subdirs = []
+        listing = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.name)
+                        listing.append((entry.name, True))
+                    else:
+                        own += entry.stat(follow_symlinks=False).st_size
+                        listing.append((entry.name, False))
+                except OSError:
+                    continue
+        subdirs = tuple(subdirs)
+        if self.on_listing:
+            self.on_listing(path, listing)
+
+        with self.lock:
+            if len(self.cache) >= self.max_dirs:
+                del self.cache[next(iter(self.cache))] # выбрасываем самую старую запись
+            self.cache[path] = (st.st_mtime_ns, own, subdirs)
+        return st.st_dev, own, subdirs
+
+    def start(self, roots, on_progress):
+        """Запускает подсчет, on_progress(задача, суммы, готовые) вызывается из фонового потока"""
+        job = SizeJob(roots)
+        threading.Thread(target=self.run_job, args=(job, on_progress), daemon=True).start()
+        return job
+
+    def run_job(self, job, on_progress):
+        """Координатор: job.done ставится в любом случае, ошибка остается в job.error"""
+        try:
+            self.sum_roots(job, on_progress)
+        except Exception as e:
+            job.error = e
+            job.cancel()
+        finally:
+            job.done.set()
+
+    def sum_roots(self, job, on_progress):
+        """Раздает папки пулу и копит суммы по корням"""
+        from concurrent.futures import wait, FIRST_COMPLETED
+        roots = list(dict.fromkeys(job.roots)) # один и тот же корень дважды не обходим и не суммируем
+        totals = {root: 0 for root in roots}
+        remaining = {root: 1 for root in roots} # сколько папок корня еще не обойдено
+        devices = {} # корень -> устройство, за его пределы не выходим
+        pending = {self.pool.submit(self.visit, root): (root, root) for root in roots}
+        changed = set() # корни, суммы которых изменились с прошлого отчета
+        finished = set()
+        last_report = time.monotonic()
+
+        while pending:
+            if job.cancelled:
+                for future in pending:
+                    future.cancel()
+                return
+            done, _ = wait(pending, timeout=SIZE_PROGRESS_SEC, return_when=FIRST_COMPLETED)
+            for future in done:
+                path, root = pending.pop(future)
+                remaining[root] -= 1
+                try:
+                    dev, own, subdirs = future.result()
+                except OSError:
+                    dev, own, subdirs = None, 0, ()
+                if dev is not None and devices.setdefault(root, dev) != dev:
+                    own, subdirs = 0, () # точка монтирования внутри папки
+                totals[root] += own
+                changed.add(root)
+                for name in subdirs:
+                    sub = os.path.join(path, name)
+                    pending[self.pool.submit(self.visit, sub)] = (sub, root)
+                    remaining[root] += 1
+                if remaining[root] == 0:
+                    finished.add(root)
+
+            if changed and (time.monotonic() - last_report >= SIZE_PROGRESS_SEC or not pending):
+                last_report = time.monotonic()
+                on_progress(job, {root: totals[root] for root in changed}, finished & changed)
+                changed = set()
+
+
+def is_inside_path(path, root):
+    """Лежит ли path внутри root (или совпадает с ним)"""
+    path = os.path.abspath(path)
+    root = os.path.abspath(root)
+    return path == root or path.startswith(root.rstrip(os.sep) + os.sep)
+
+
+def unique_path(path):
+    """Свободное имя рядом с path: "имя (2).txt", "имя (3).txt"..."""
+    folder, name = os.path.split(path)
+    stem, ext = os.path.splitext(name)
+    if name.startswith(".") and not ext:
+        stem, ext = name, ""
+    number = 2
+    while True:
+        candidate = os.path.join(folder, f"{stem} ({number}){ext}")
+        if not os.path.lexists(candidate):
+            return candidate
+        number += 1
+
+
+def copy_file_data(fsrc, fdst, job):
+    """Копирует содержимое файла: copy_file_range, sendfile или через буфер
+
+    Первые два способа копируют внутри ядра (а copy_file_range на части
+    файловых систем вообще без копирования данных). Если файловая система
+    или платформа их не поддерживают, откатываемся к чтению большим буфером.
+    """
+    offset = 0
+    if hasattr(os, "copy_file_range"):
+        try:
+            while True:
+                job.checkpoint()
+                copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), COPY_CHUNK, offset, offset)
+                if not copied:
+                    return
+                offset += copied
+                job.progress(nbytes=copied)
+        except OSError as e:
+            if offset or e.errno not in COPY_FALLBACK_ERRNOS:
+                raise
+    if hasattr(os, "sendfile") and sys.platform.startswith("linux"): # в macOS sendfile пишет только в сокеты
+        try:
+            while True:
+                job.checkpoint()
+                copied = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, COPY_CHUNK)
+                if not copied:
+                    return
+                offset += copied
+                job.progress(nbytes=copied)
+        except OSError as e:
+            if offset or e.errno not in COPY_FALLBACK_ERRNOS:
+                raise
+    buffer = memoryview(bytearray(COPY_BUFFER))
+    while True:
+        job.checkpoint()
+        copied = fsrc.readinto(buffer)
+        if not copied:
+            return
+        written = 0
+        while written < copied:
+            written += fdst.write(buffer[written:copied])
+        job.progress(nbytes=copied)
+
+
+NUMBER_FIELD = re.compile(r"\{n(?::([^}]*))?\}") # {n} или {n:03} в шаблоне переименования
+
+
+def pattern_names(names, find, replace, start=1):
+    """Новые имена для группового переименования
+
+    find - регулярное выражение (заменяется первое совпадение), в replace
+    работают группы (\\1) и номер записи {n} с форматом, например {n:03}.
+    """
+    regex = re.compile(find)
+    result = []
+    for number, name in enumerate(names, start):
+        template = NUMBER_FIELD.sub(lambda m: format(number, m.group(1) or ""), replace)
+        result.append(regex.sub(template, name, count=1))
+    return result
+
+
+class JobCancelled(Exception):
+    """Файловая операция отменена пользователем"""
+
+
+class FileOpJob:
+    """Копирование, перенос, удаление или переименование набора записей"""
+    TITLES = {"copy": "Копирование", "move": "Перемещение", "delete": "Удаление", "rename": "Переименование"}
+
+    def __init__(self, kind, sources, target=None, names=None):
+        self.kind = kind # "copy", "move", "delete" или "rename"
+        self.sources = sources # пути записей
+        self.target = target # папка назначения
+        self.names = names # новые имена для "rename", по одному на запись
+        self.changes = [] # события в формате наблюдателя, отдаются интерфейсу одной пачкой в конце
+        self.cancel_event = threading.Event()
+        self.running = threading.Event() # сброшен - задача на паузе
+        self.running.set()
+        self.total_files = 0 # объем работы, считается перед началом
+        self.total_bytes = 0
+        self.done_files = 0
+        self.done_bytes = 0
+        self.current = None # путь, который сейчас обрабатывается
+        self.errors = [] # (путь, текст ошибки)
+        self.conflict_policy = None # ответ на конфликт, выбранный "для всех"
+        self.started = None
+        self.finished = False
+        self.rate = 0.0 # байт в секунду, сглаженное
+        self.sample = None # (время, байт) прошлого замера скорости
+        self.last_report = 0.0
+        self.callbacks = None # задаются движком при постановке в очередь
+
+    @property
+    def title(self):
+        return self.TITLES[self.kind]
+
+    def cancel(self):
+        self.cancel_event.set()
+        self.running.set() # разбудить, если стоит на паузе
+
+    def pause(self):
+        self.running.clear()
+
+    def resume(self):
+        self.sample = None # время паузы не должно портить скорость
+        self.running.set()
+
+    @property
+    def paused(self):
+        return not self.running.is_set()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def checkpoint(self):
+        """Ждет снятия паузы, при отмене прерывает операцию"""
+        self.running.wait()
+        if self.cancelled:
+            raise JobCancelled()
+
+    def progress(self, nbytes=0, files=0):
+        """Учитывает сделанную работу, не чаще FILEOP_PROGRESS_SEC сообщает о ней"""
+        self.done_bytes += nbytes
+        self.done_files += files
+        now = time.monotonic()
+        if now - self.last_report < FILEOP_PROGRESS_SEC:
+            return
+        self.last_report = now
+        if self.sample is not None:
+            elapsed = now - self.sample[0]
+            rate = (self.done_bytes - self.sample[1]) / elapsed if elapsed > 0 else 0.0
+            self.rate = rate if not self.rate else self.rate * 0.7 + rate * 0.3
+        self.sample = (now, self.done_bytes)
+        self.callbacks["progress"](self)
+
+
+class FileOperationEngine:
+    """Очередь файловых операций, выполняемых по одной в фоновом потоке
+
+    Перенос внутри одной файловой системы - это rename, данные не копируются.
+    Между файловыми системами перенос идет как копирование с удалением
+    исходника, причем исходник удаляется только если все скопировалось.
+    О конфликтах имен спрашивается интерфейс, поток ждет ответа.
+    """
+    CONFLICT_CHOICES = ("overwrite", "skip", "rename", "cancel") # заменить, пропустить, оставить обе, отменить
+
+    def __init__(self):
+        self.jobs = queue.Queue()
+        self.thread = None
+
+    def submit(self, job, on_progress, on_changes, on_conflict, on_done):
+        """Ставит задачу в очередь, обработчики вызываются из фонового потока
+
+        on_changes(задача, события) один раз в конце получает все изменения
+        в формате наблюдателя, on_conflict(задача, путь, ответ) -
+        путь назначения, который уже занят; ответ(решение, для_всех) можно
+        вызвать из любого потока, решение - одно из CONFLICT_CHOICES.
+        """
+        job.callbacks = {"progress": on_progress, "changes": on_changes,
+                         "conflict": on_conflict, "done": on_done}
+        self.jobs.put(job)
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        return job
+
+    def run(self):
+        while True:
+            self.run_job(self.jobs.get())
+
+    def run_job(self, job):
+        job.started = time.monotonic()
+        try:
+            if job.cancelled:
+                return
+            self.measure(job)
+            if job.kind == "rename":
+                self.rename_batch(job)
+            else:
+                for source in job.sources:
+                    job.checkpoint()
+                    self.run_item(job, source)
+        except JobCancelled:
+            pass
+        finally:
+            job.finished = True
+            if job.changes:
+                job.callbacks["changes"](job, job.changes) # кэш и экран обновятся за один проход
+            job.callbacks["done"](job)
+
+    def run_item(self, job, source):
+        """Обрабатывает одну запись верхнего уровня и сообщает, что изменилось"""
+        folder, name = os.path.split(source.rstrip(os.sep))
+        touched = [(folder, name)]
+        try:
+            if job.kind == "delete":
+                self.remove(job, source)
+                return
+            target = os.path.join(job.target, name)
+            existed = os.path.lexists(target)
+            if job.kind == "copy":
+                target = self.copy_item(job, source, target)
+            else:
+                target = self.move_item(job, source, target)
+            if target is not None:
+                if existed and os.path.basename(target) == name:
+                    # Папку слили или запись заменили - старый список вложенной папки больше не верен
+                    job.changes.append(("deleted", job.target, name, None, None))
+                touched.append(os.path.split(target))
+        except (OSError, ValueError) as e: # ValueError - неизвестный ответ на конфликт, запись не трогаем
+            job.errors.append((source, getattr(e, "strerror", None) or str(e)))
+        finally:
+            job.changes.extend(("created" if os.path.lexists(os.path.join(folder, name)) else "deleted",
+                                folder, name, None, None) for folder, name in touched)
+
+    def measure(self, job):
+        """Считает число записей и байт для прогресса"""
+        if job.kind == "rename":
+            job.total_files = len(job.sources)
+            return
+        for source in job.sources:
+            if job.kind == "move":
+                try:
+                    if os.lstat(source).st_dev == os.stat(job.target).st_dev:
+                        job.total_files += 1 # будет rename
+                        continue
+                except OSError:
+                    pass
+            stack = [source]
+            while stack:
+                job.checkpoint()
+                path = stack.pop()
+                try:
+                    st = os.lstat(path)
+                    job.total_files += 1
+                    if stat.S_ISDIR(st.st_mode):
+                        with os.scandir(path) as entries:
+                            stack.extend(entry.path for entry in entries)
+                    elif stat.S_ISREG(st.st_mode) and job.kind != "delete":
+                        job.total_bytes += st.st_size
+                except OSError:
+                    continue
+
+    def rename_batch(self, job):
+        """Групповое переименование: только rename, данные не трогаются
+
+        Если новое имя одной записи - старое имя другой (a -> b, b -> c),
+        все записи сначала получают временные имена, потом окончательные.
+        """
+        sources = {os.path.normcase(path) for path in job.sources}
+        moves = []
+        for path, name in zip(job.sources, job.names):
+            folder, old_name = os.path.split(path)
+            target = os.path.join(folder, name)
+            if os.path.normcase(target) not in sources and os.path.lexists(target):
+                job.errors.append((path, "Запись с таким именем уже существует"))
+                continue
+            moves.append((folder, old_name, name))
+
+        two_phase = any(os.path.normcase(os.path.join(folder, name)) in sources for folder, _, name in moves)
+        if two_phase:
+            staged = []
+            for number, (folder, old_name, name) in enumerate(moves):
+                temp = f".~rename-{os.getpid()}-{number}~"
+                if self.rename_entry(job, folder, old_name, temp, count=False):
+                    staged.append((folder, temp, name))
+            moves = staged
+        for folder, old_name, name in moves:
+            # Вторую фазу не прерываем, иначе останутся временные имена
+            self.rename_entry(job, folder, old_name, name, check=not two_phase)
+
+    def rename_entry(self, job, folder, old_name, new_name, count=True, check=True):
+        """Переименовывает одну запись, False - если не получилось"""
+        if check:
+            job.checkpoint()
+        job.current = os.path.join(folder, old_name)
+        try:
+            os.rename(job.current, os.path.join(folder, new_name))
+        except OSError as e:
+            job.errors.append((job.current, e.strerror or str(e)))
+            return False
+        job.changes.append(("moved", folder, old_name, folder, new_name))
+        if count:
+            job.progress(files=1)
+        return True
+
+    def resolve_conflict(self, job, target):
+        """Спрашивает интерфейс, что делать с занятым путем"""
+        if job.conflict_policy:
+            return job.conflict_policy
+        answered = threading.Event()
+        answer = []
+
+        def reply(choice, for_all=False):
+            if choice not in self.CONFLICT_CHOICES:
+                raise ValueError(f"Неизвестный ответ на конфликт: {choice!r}")
+            if for_all and choice != "cancel":
+                job.conflict_policy = choice
+            answer.append(choice)
+            answered.set()
+
+        job.callbacks["conflict"](job, target, reply)
+        while not answered.wait(0.1):
+            job.checkpoint()
+        job.sample = None # время ожидания ответа не считаем в скорость
+        if answer[0] == "cancel":
+            job.cancel()
+            job.checkpoint()
+        return answer[0]
+
+    def prepare_target(self, job, src, dst, st):
+        """Путь, в который писать src, или None, если запись пропускается"""
+        try:
+            dst_st = os.lstat(dst)
+        except FileNotFoundError:
+            return dst
+        if (dst_st.st_dev, dst_st.st_ino) == (st.st_dev, st.st_ino):
+            # Копия в ту же папку - рядом с оригиналом, перенос на то же место ничего не делает
+            return unique_path(dst) if job.kind == "copy" else None
+        choice = self.resolve_conflict(job, dst)
+        if choice == "skip":
+            return None
+        if choice == "rename":
+            return unique_path(dst)
+        if choice != "overwrite":
+            raise ValueError(f"Неизвестный ответ на конфликт: {choice!r}") # опечатка не должна стирать файл
+        if stat.S_ISDIR(st.st_mode) and stat.S_ISDIR(dst_st.st_mode):
+            return dst # папки сливаются, конфликты внутри решаются по одному
+        self.remove(job, dst, count=False)
+        return dst
+
+    def copy_item(self, job, src, dst):
+        """Копирует файл или папку, возвращает итоговый путь или None"""
+        job.checkpoint()
+        st = os.lstat(src)
+        if stat.S_ISDIR(st.st_mode) and is_inside_path(dst, src):
+            raise OSError(errno.EINVAL, "Нельзя скопировать папку в саму себя", src)
+        dst = self.prepare_target(job, src, dst, st)
+        if dst is None:
+            return None
+        job.current = src
+
+        if stat.S_ISDIR(st.st_mode):
+            if not os.path.isdir(dst):
+                os.mkdir(dst)
+            with os.scandir(src) as entries:
+                names = [entry.name for entry in entries]
+            for name in names:
+                try:
+                    self.copy_item(job, os.path.join(src, name), os.path.join(dst, name))
+                except OSError as e:
+                    job.errors.append((os.path.join(src, name), e.strerror or str(e)))
+        elif stat.S_ISLNK(st.st_mode):
+            os.symlink(os.readlink(src), dst)
+        elif stat.S_ISREG(st.st_mode):
+            self.copy_file(job, src, dst)
+        else:
+            raise OSError(errno.EINVAL, "Особые файлы не копируются", src)
+        try:
+            shutil.copystat(src, dst, follow_symlinks=False)
+        except OSError:
+            pass # права и даты - не повод считать копию неудачной
+        job.progress(files=1)
+        return dst
+
+    def copy_file(self, job, src, dst):
+        """Копирует один файл, недописанную копию удаляет"""
+        with open(src, "rb", buffering=0) as fsrc:
+            with open(dst, "xb", buffering=0) as fdst:
+                try:
+                    copy_file_data(fsrc, fdst, job)
+                except BaseException:
+                    fdst.close()
+                    os.unlink(dst)
+                    raise
+
+    def move_item(self, job, src, dst):
+        """Переносит файл или папку, возвращает итоговый путь или None"""
+        job.checkpoint()
+        st = os.lstat(src)
+        if stat.S_ISDIR(st.st_mode) and is_inside_path(dst, src):
+            raise OSError(errno.EINVAL, "Нельзя перенести папку в саму себя", src)
+        dst = self.prepare_target(job, src, dst, st)
+        if dst is None:
+            return None
+        job.current = src
+
+        if os.path.lexists(dst): # слияние с существующей папкой
+            with os.scandir(src) as entries:
+                names = [entry.name for entry in entries]
+            for name in names:
+                try:
+                    self.move_item(job, os.path.join(src, name), os.path.join(dst, name))
+                except OSError as e:
+                    job.errors.append((os.path.join(src, name), e.strerror or str(e)))
+            try:
+                os.rmdir(src)
+            except OSError:
+                pass # что-то пропущено - папка остается
+            return dst
+
+        try:
+            os.rename(src, dst)
+            job.progress(files=1)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            errors = len(job.errors)
+            self.copy_item(job, src, dst)
+            if len(job.errors) == errors:
+                self.remove(job, src, count=False)
+        return dst
+
+    def remove(self, job, path, count=True):
+        """Удаляет файл или папку со всем содержимым"""
+        job.checkpoint()
+        job.current = path
+        if os.path.isdir(path) and not os.path.islink(path):
+            failed = False
+            with os.scandir(path) as entries:
+                names = [entry.name for entry in entries]
+            for name in names:
+                try:
+                    self.remove(job, os.path.join(path, name), count)
+                except OSError as e:
+                    job.errors.append((os.path.join(path, name), e.strerror or str(e)))
+                    failed = True
+            if failed:
+                return # папка не пуста, ошибки уже записаны
+            os.rmdir(path)
+        else:
+            os.unlink(path)
+        if count:
+            job.progress(files=1)
+
+
+def user_cache_dir():
+    """Папка для кэша приложения по правилам ОС"""
+    if os.name == "nt":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~\\AppData\\Local")
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "advanced-file-manager")
+
+
+class DiskListingCache:
+    """Прочитанные папки на диске между запусками (SQLite в кэше пользователя)
+
+    Список папки сохраняется после полного чтения вместе с устройством,
+    inode и mtime_ns папки, снятыми до чтения. Из базы список берется,
+    только если это та же папка и с тех пор она не менялась. Размеры и
+    даты файлов mtime папки не меняют - их сверяет фоновое чтение.
+    """
+    def __init__(self, path, max_dirs=DISK_CACHE_MAX_DIRS, max_bytes=DISK_CACHE_MAX_BYTES):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.max_dirs = max_dirs
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock() # одно соединение на все потоки
+        import sqlite3 # модуль тянет за собой библиотеку SQLite, грузим его только для кэша
+        self.db_error = sqlite3.Error
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS listings ("
+                              "path TEXT PRIMARY KEY, dev INTEGER, ino INTEGER, mtime_ns INTEGER, "
+                              "used REAL, entries BLOB)")
+        self.stores = 0
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def open(cls, path=None):
+        """Открывает кэш, None - если он выключен, нет sqlite3 или база не открылась"""
+        if not DISK_CACHE_ENABLED:
+            return None
+        try:
+            import sqlite3 # постоянный кэш папок, без него приложение просто читает папки заново
+        except ImportError:
+            return None
+        try:
+            return cls(path or os.path.join(user_cache_dir(), "listings.sqlite3"))
+        except (OSError, sqlite3.Error):
+            return None
+
+    def load(self, path, st):
+        """Список папки [(имя, папка?, размер, mtime)] или None, если его нет или он устарел"""
+        with self.lock:
+            try:
+                row = self.conn.execute("SELECT dev, ino, mtime_ns, entries FROM listings WHERE path = ?",
+                                        (path,)).fetchone()
+                if row is None or tuple(row[:3]) != (st.st_dev, st.st_ino, st.st_mtime_ns):
+                    self.misses += 1
+                    return None
+                with self.conn:
+                    self.conn.execute("UPDATE listings SET used = ? WHERE path = ?", (time.time(), path))
+                entries = marshal.loads(zlib.decompress(row[3]))
+            except (self.db_error, UnicodeError, ValueError, EOFError, TypeError, zlib.error):
+                self.misses += 1 # путь не в UTF-8 или запись испорчена - просто читаем папку
+                return None
+            self.hits += 1
+            return entries
+
+    def store(self, path, st, entries):
+        """Сохраняет полный список папки, st снят до начала чтения"""
+        blob = zlib.compress(marshal.dumps(entries), 1)
+        with self.lock:
+            try:
+                with self.conn:
+                    self.conn.execute("INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?, ?, ?)",
+                                      (path, st.st_dev, st.st_ino, st.st_mtime_ns, time.time(), blob))
+                self.stores += 1
+                if self.stores % DISK_CACHE_PRUNE_EVERY == 0:
+                    self.prune()
+            except (self.db_error, UnicodeError):
+                pass
+
+    def prune(self):
+        """Удаляет давно не использованные папки сверх пределов"""
+        rows = self.conn.execute("SELECT path, length(entries) FROM listings ORDER BY used DESC").fetchall()
+        total = 0
+        stale = []
+        for number, (path, size) in enumerate(rows):
+            total += size
+            if number >= self.max_dirs or total > self.max_bytes:
+                stale.append((path,))
+        if stale:
+            with self.conn:
+                self.conn.executemany("DELETE FROM listings WHERE path = ?", stale)
+
+    def stats(self):
+        """Счетчики для окна статистики"""
+        with self.lock:
+            try:
+                folders = self.conn.execute("SELECT COUNT(*) FROM listings").fetchone()[0]
+            except self.db_error:
+                folders = 0
+        size = 0
+        for path in (self.path, self.path + "-wal"):
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        return {"folders": folders, "bytes": size, "hits": self.hits, "misses": self.misses}
+
+
+class ThumbnailCache:
+    """Миниатюры на диске: PNG по ключу путь + mtime + размер, с пределом общего размера
+
+    Изменившийся файл получает новый ключ, старая миниатюра просто не
+    используется и со временем вытесняется. Время изменения файла миниатюры
+    служит отметкой последнего использования.
+    """
+    def __init__(self, folder, max_bytes=THUMB_CACHE_MAX_BYTES):
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.total = None # байт в папке, считается при первой записи
+        self.lock = threading.Lock()
+
+    @classmethod
+    def open(cls):
+        """Кэш в папке кэша пользователя, None - если ее не создать"""
+        try:
+            return cls(os.path.join(user_cache_dir(), "thumbnails"))
+        except OSError:
+            return None
+
+    def file_for(self, key):
+        import hashlib
+        digest = hashlib.sha1(repr(key).encode("utf-8", "surrogateescape")).hexdigest()
+        return os.path.join(self.folder, digest + ".png")
+
+    def load(self, key):
+        """PNG миниатюры или None"""
+        path = self.file_for(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path) # отметка использования для вытеснения
+        except OSError:
+            return None
+        return data
+
+    def store(self, key, data):
+        def write(path):
+            with open(path, "wb") as f:
+                f.write(data)
+        self.store_file(key, write)
+
+    def store_file(self, key, write):
+        """Записывает миниатюру функцией write(путь) и следит за пределом размера"""
+        path = self.file_for(key)
+        temp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            write(temp)
+            size = os.path.getsize(temp)
+            os.replace(temp, path)
+        except Exception:
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
+            return
+        with self.lock:
+            if self.total is None:
+                self.total = self.folder_size()
+            else:
+                self.total += size
+            if self.total > self.max_bytes:
+                self.prune()
+
+    def folder_size(self):
+        total = 0
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                try:
+                    total += entry.stat().st_size
+                except OSError:
+                    pass
+        return total
+
+    def prune(self):
+        """Удаляет давно не использованные миниатюры, пока кэш не станет на четверть меньше предела"""
+        files = []
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, entry.path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.max_bytes * 3 // 4:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self.total = total
+
+
+def read_text_head(path, max_bytes=PREVIEW_TEXT_BYTES, max_lines=PREVIEW_TEXT_LINES):
+    """Начало файла для просмотра: читается не больше max_bytes, сколько бы файл ни весил"""
+    with open(path, "rb") as f:
+        head = f.read(max_bytes)
+    if b"\0" in head[:GREP_SNIFF_BYTES]:
+        return {"kind": "binary"}
+    lines = head.split(b"\n", max_lines)
+    truncated = len(lines) > max_lines or len(head) == max_bytes
+    text = b"\n".join(lines[:max_lines]).decode("utf-8", errors="replace")
+    return {"kind": "text", "text": text, "truncated": truncated}
+
+
+def make_thumbnail(path, size=PREVIEW_THUMB_SIZE):
+    """PNG миниатюры через PIL, None - если картинку не прочитать"""
+    try:
+        with Image.open(path) as image:
+            image.draft("RGB", (size, size)) # JPEG сразу декодируется уменьшенным
+            image.thumbnail((size, size))
+            if image.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+                image = image.convert("RGBA")
+            buffer = io.BytesIO()
+            image.save(buffer, "PNG")
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+    return buffer.getvalue()
+
+
+class PreviewEngine:
+    """Просмотр файла в фоновом потоке: начало текста или миниатюра картинки
+
+    Поток берет только последний запрос: пока он занят, запросы от быстро
+    бегущего по списку фокуса заменяют друг друга и не выполняются, а
+    результат запроса, устаревшего во время работы, не отправляется.
+    Миниатюры хранятся в ThumbnailCache. Без PIL поток отдает исходные
+    байты PNG/GIF/PPM, уменьшает их окно (Tk работает только в главном
+    потоке) и сохраняет результат в кэш через store_thumbnail.
+    """
+    def __init__(self, on_result, cache=None):
+        self.on_result = on_result # (поколение, путь, результат), вызывается из рабочего потока
+        self.cache = cache
+        self.generation = 0
+        self.pending = None
+        self.condition = threading.Condition()
+        threading.Thread(target=self.run, daemon=True, name="preview").start()
+
+    def request(self, path):
+        """Ставит просмотр файла вместо еще не начатого, возвращает поколение запроса"""
+        with self.condition:
+            self.generation += 1
+            self.pending = (self.generation, path)
+            self.condition.notify()
+            return self.generation
+
+    def cancel(self):
+        """Фокус ушел с файлов - текущий результат больше не нужен"""
+        with self.condition:
+            self.generation += 1
+            self.pending = None
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None:
+                    self.condition.wait()
+                generation, path = self.pending
+                self.pending = None
+            try:
+                with profiler.span("preview", path=path):
+                    result = self.make_preview(path)
+            except OSError as e:
+                result = {"kind": "error", "message": e.strerror or str(e)}
+            if generation == self.generation: # пока готовили, фокус мог уйти
+                self.on_result(generation, path, result)
+
+    def make_preview(self, path):
+        st = os.stat(path)
+        ext = os.path.splitext(path)[1].lower()
+        if ext in TK_IMAGE_EXTENSIONS or (Image is not None and ext in PIL_IMAGE_EXTENSIONS):
+            result = self.image_preview(path, st, ext)
+            if result is not None:
+                return result
+        return read_text_head(path)
+
+    def image_preview(self, path, st, ext):
+        """Миниатюра из кэша, через PIL или исходные байты для Tk"""
+        key = (path, st.st_mtime_ns, st.st_size)
+        data = self.cache.load(key) if self.cache is not None else None
+        if data is None and Image is not None:
+            data = make_thumbnail(path)
+            if data is not None and self.cache is not None:
+                self.cache.store(key, data)
+        if data is not None:
+            return {"kind": "image", "data": base64.b64encode(data).decode("ascii"), "scaled": True, "key": key}
+        if Image is not None or ext not in TK_IMAGE_EXTENSIONS or st.st_size > PREVIEW_IMAGE_MAX_BYTES:
+            return None
+        with open(path, "rb") as f:
+            data = f.read(PREVIEW_IMAGE_MAX_BYTES)
+        return {"kind": "image", "data": base64.b64encode(data).decode("ascii"), "scaled": False, "key": key}
+
+    def store_thumbnail(self, key, write):
+        """Сохраняет миниатюру, уменьшенную в окне (write(путь) пишет PNG)"""
+        if self.cache is not None:
+            self.cache.store_file(key, write)
+
+
+class ProfileOperation:
+    """Последняя команда пользователя и все, что она запустила (в том числе в фоне)"""
+    def __init__(self, name):
+        self.name = name
+        self.duration = None # время самой команды, без фоновых стадий
+        self.stages = {} # стадия -> [секунд, вызовов]
+        self.counters = {} # записи, системные вызовы и т.п.
+
+
+class ProfileSpan:
+    """Замер одной стадии, пишет в профилировщик при выходе"""
+    __slots__ = ("profiler", "name", "args", "start")
+
+    def __init__(self, profiler, name, args):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, self.start, time.perf_counter(), self.args)
+
+
+class NullSpan:
+    """Замер выключенного профилировщика - ничего не делает"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return None
+
+
+NULL_SPAN = NullSpan()
+
+
+class Profiler:
+    """Время стадий и счетчики для оверлея, трасса в формате Chrome
+
+    Выключенный профилировщик стоит одной проверки флага: span отдает общий
+    пустой контекст, горячие циклы проверяют enabled сами. Включенный копит
+    время стадий и счетчики в последней операции - команде пользователя
+    (открыть, удалить, перейти...) - вместе с фоновой работой, которую она
+    запустила, и пишет события в кольцевой буфер трассы.
+    """
+    def __init__(self, max_events=TRACE_MAX_EVENTS):
+        self.enabled = False
+        self.events = deque(maxlen=max_events)
+        self.threads = {} # id потока -> имя, для подписей в трассе
+        self.operation = None
+        self.lock = threading.Lock()
+        self.local = threading.local() # вложенные команды не начинают новую операцию
+        self.epoch = time.perf_counter()
+
+    def span(self, name, **args):
+        """Контекст замера стадии"""
+        if not self.enabled:
+            return NULL_SPAN
+        return ProfileSpan(self, name, args)
+
+    def record(self, name, start, end, args=None, stage=True):
+        """Событие трассы и время стадии в текущей операции"""
+        thread = threading.current_thread()
+        event = {"name": name, "ph": "X", "ts": (start - self.epoch) * 1e6, "dur": (end - start) * 1e6,
+                 "pid": os.getpid(), "tid": thread.ident}
+        if args:
+            event["args"] = args
+        self.events.append(event)
+        self.threads[thread.ident] = thread.name
+        if stage:
+            self.add(name, end - start)
+
+    def add(self, name, seconds, calls=1):
+        """Время стадии без события трассы (суммы из горячих циклов)"""
+        with self.lock:
+            if self.operation is not None:
+                totals = self.operation.stages.setdefault(name, [0.0, 0])
+                totals[0] += seconds
+                totals[1] += calls
+
+    def count(self, **counters):
+        """Прибавляет счетчики к текущей операции и отмечает их в трассе"""
+        if not self.enabled:
+            return
+        with self.lock:
+            if self.operation is None:
+                return
+            values = self.operation.counters
+            for name, value in counters.items():
+                values[name] = values.get(name, 0) + value
+            snapshot = dict(values)
+        self.events.append({"name": self.operation.name, "ph": "C", "ts": (time.perf_counter() - self.epoch) * 1e6,
+                            "pid": os.getpid(), "args": snapshot})
+
+    def begin(self, name):
+        """Новая операция, если это не вложенный вызов другой команды"""
+        depth = getattr(self.local, "depth", 0)
+        self.local.depth = depth + 1
+        if depth == 0:
+            with self.lock:
+                self.operation = ProfileOperation(name)
+        return depth == 0
+
+    def end(self, name, start, top):
+        """Конец команды: вложенная идет в стадии, верхняя задает время операции"""
+        self.local.depth -= 1
+        end = time.perf_counter()
+        self.record(name, start, end, stage=not top)
+        operation = self.operation
+        if top and operation is not None:
+            operation.duration = end - start
+
+    def summary(self, limit=6):
+        """Строка с разбивкой последней операции для строки состояния"""
+        operation = self.operation
+        if operation is None:
+            return "Профилирование: нет операций"
+        with self.lock:
+            stages = sorted(operation.stages.items(), key=lambda item: -item[1][0])[:limit]
+            counters = dict(operation.counters)
+        parts = [f"{operation.name} {operation.duration * 1000:.1f} мс" if operation.duration is not None
+                 else f"{operation.name} ..."]
+        for name, (seconds, calls) in stages:
+            parts.append(f"{name} {seconds * 1000:.1f} мс" + (f" ×{calls}" if calls > 1 else ""))
+        if counters:
+            parts.append(", ".join(f"{name} {value}" for name, value in counters.items()))
+        return " | ".join(parts)
+
+    def export(self, path):
+        """Записывает трассу (chrome://tracing, Perfetto)"""
+        pid = os.getpid()
+        events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                  for tid, name in list(self.threads.items())]
+        events.extend(list(self.events))
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+        return len(events)
+
+    def clear(self):
+        self.events.clear()
+        self.operation = None
+
+
+profiler = Profiler()
+
+
+def profiled(name):
+    """Декоратор команды: вызов становится операцией профилировщика"""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return func(*args, **kwargs)
+            top = profiler.begin(name)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profiler.end(name, start, top)
+        return wrapper
+    return decorate
+
+
+def scan_directory(path, cancel_event, chunk_size=SCAN_CHUNK_SIZE, lazy=False):
+    """Читает папку порциями, выполняется в фоновом потоке
+
+    lazy - без stat: тип берется из d_type, размер и дата остаются None,
+    их потом догружает StatFetcher только для тех строк, которые видны.
+    """
+    chunk = []
+    timed = profiler.enabled # время stat меряется только при включенном профилировщике
+    started = time.perf_counter()
+    stat_time = 0.0
+    errors = 0
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if cancel_event.is_set(): # пользователь ушел из папки - дальше не читаем
+                return
+            try:
+                is_dir = entry.is_dir()
+                if lazy:
+                    chunk.append((entry.name, is_dir, None, None))
+                    if len(chunk) >= chunk_size:
+                        yield chunk
+                        chunk = []
+                    continue
+                if timed:
+                    stat_start = time.perf_counter()
+                    st = entry.stat()
+                    stat_time += time.perf_counter() - stat_start
+                else:
+                    st = entry.stat()
+            except OSError:
+                errors += 1
+                continue
+            chunk.append((entry.name, is_dir, st.st_size, st.st_mtime))
+            if len(chunk) >= chunk_size:
+                if timed:
+                    report_scan_chunk(path, started, stat_time, len(chunk), errors)
+                yield chunk
+                chunk = []
+                started, stat_time, errors = time.perf_counter(), 0.0, 0
+    if timed:
+        report_scan_chunk(path, started, stat_time, len(chunk), errors)
+        profiler.count(folders=1)
+    if chunk:
+        yield chunk
+
+
+def report_scan_chunk(path, started, stat_time, entries, errors):
+    """Порция сканирования в профилировщик: scandir и stat отдельно, счетчики системных вызовов"""
+    now = time.perf_counter()
+    profiler.record("scan_chunk", started, now, {"path": path, "entries": entries, "errors": errors}, stage=False)
+    profiler.add("scandir", now - started - stat_time)
+    profiler.add("stat", stat_time, entries + errors)
+    profiler.count(entries=entries, stat_calls=entries + errors)
+
+
+def is_lazy_filesystem(fstype):
+    """Показывать ли папки диска с этой файловой системой без stat"""
+    return os.name != 'nt' and fstype in LAZY_STAT_FILESYSTEMS # в Windows scandir и так отдает размер и дату
+
+
+class StatFetcher:
+    """Догружает размер и дату записей, прочитанных без stat
+
+    Имена приходят пачками одной папки; пачки обслуживаются от последней
+    к первой - последними запрашиваются строки, которые видны сейчас.
+    cancel() выбрасывает все, что еще не начато (пользователь ушел из папки).
+    """
+    def __init__(self, on_stats, workers=STAT_WORKERS):
+        self.on_stats = on_stats # (ключ, [(имя, размер, дата)]), вызывается из рабочего потока
+        from concurrent.futures import ThreadPoolExecutor
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix="stat")
+        self.lock = threading.Lock()
+        self.batches = [] # стек (поколение, ключ, путь, имена)
+        self.generation = 0
+
+    def request(self, key, path, names):
+        batches = [names[i:i + STAT_BATCH] for i in range(0, len(names), STAT_BATCH)]
+        with self.lock:
+            # Первая пачка - наверх стека
+            self.batches.extend((self.generation, key, path, batch) for batch in reversed(batches))
+        for _ in batches:
+            self.pool.submit(self.run_batch)
+
+    def cancel(self):
+        with self.lock:
+            self.generation += 1
+            self.batches.clear()
+
+    def run_batch(self):
+        with self.lock:
+            if not self.batches:
+                return
+            generation, key, path, names = self.batches.pop()
+        started = time.perf_counter()
+        stats = []
+        for name in names:
+            if generation != self.generation:
+                return
+            full_path = os.path.join(path, name)
+            try:
+                st = os.stat(full_path)
+            except OSError:
+                try:
+                    st = os.lstat(full_path) # битая ссылка - показываем саму ссылку
+                except OSError:
+                    stats.append((name, None, None))
+                    continue
+            stats.append((name, st.st_size, st.st_mtime))
+        if profiler.enabled:
+            profiler.add("stat", time.perf_counter() - started, len(names))
+            profiler.count(stat_calls=len(names))
+        if generation == self.generation:
+            self.on_stats(key, stats)
+
+
+class Prefetcher:
+    """Фоновое чтение папок, в которые пользователь, скорее всего, перейдет
+
+    План - папки по убыванию вероятности перехода - целиком заменяется при
+    каждом переходе, начатое чтение для старого плана прерывается. Потоки
+    читают только в тишине: пока пользователь нажимает клавиши (touch) или
+    читается открытая папка (busy), они ждут. Слишком большие папки не
+    дочитываются. Ключ папки передается обратно как есть (окно дает узел),
+    папки с признаком lazy читаются без stat.
+    """
+    def __init__(self, on_listing, busy=lambda: False, workers=PREFETCH_WORKERS, max_entries=PREFETCH_MAX_ENTRIES):
+        self.on_listing = on_listing # (ключ, путь, глубина, записи), вызывается из рабочего потока
+        self.busy = busy
+        self.max_entries = max_entries
+        self.targets = deque() # (ключ, путь, глубина, lazy)
+        self.quiet_at = 0.0 # раньше этого момента не читаем
+        self.cancel_event = threading.Event() # свой у каждого плана
+        self.condition = threading.Condition()
+        self.reads = 0
+        self.too_big = 0
+        for number in range(workers):
+            threading.Thread(target=self.run, daemon=True, name=f"prefetch-{number}").start()
+
+    def plan(self, targets):
+        """Новый план [(ключ, путь, глубина, lazy)] вместо прежнего"""
+        with self.condition:
+            self.cancel_event.set()
+            self.cancel_event = threading.Event()
+            self.targets = deque(targets)
+            self.condition.notify_all()
+
+    def extend(self, targets):
+        """Дописывает папки в конец текущего плана (следующий уровень глубины)"""
+        with self.condition:
+            self.targets.extend(targets)
+            self.condition.notify_all()
+
+    def boost(self, target):
+        """Папка под курсором - в начало плана"""
+        with self.condition:
+            self.targets.appendleft(target)
+            self.condition.notify_all()
+
+    def touch(self):
+        """Пользователь что-то делает - откладываем чтение"""
+        self.quiet_at = time.monotonic() + PREFETCH_IDLE_SEC
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.targets:
+                    self.condition.wait()
+            delay = self.quiet_at - time.monotonic()
+            if delay > 0 or self.busy():
+                time.sleep(max(delay, PREFETCH_IDLE_SEC / 3))
+                continue
+            with self.condition:
+                if not self.targets:
+                    continue
+                key, path, depth, lazy = self.targets.popleft()
+                cancel_event = self.cancel_event
+            entries = []
+            try:
+                for chunk in scan_directory(path, cancel_event, lazy=lazy):
+                    entries.extend(chunk)
+                    if len(entries) > self.max_entries:
+                        break
+            except OSError:
+                continue
+            if len(entries) > self.max_entries:
+                self.too_big += 1
+                continue
+            if not cancel_event.is_set():
+                self.reads += 1
+                self.on_listing(key, path, depth, entries)
+
+
+class ScanTask:
+    """Фоновое сканирование одной папки"""
+    def __init__(self, node, lazy=False, archive=None):
+        self.node = node
+        self.path = node.path # путь запоминаем здесь, поток не трогает сам узел
+        self.lazy = lazy # читать без stat
+        self.archive = archive # (путь архива, путь внутри) - папка читается из оглавления архива
+        self.cancel_event = threading.Event()
+        self.count = 0 # сколько записей уже получено
+        self.pending_events = [] # события наблюдателя, пришедшие во время чтения
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
@@ -0,0 +1,52 @@
+"""Проверки окна, которым не нужен дисплей: методы вызываются на заглушке вместо окна"""
+import types
+
+import pytest
+
+pytest.importorskip("tkinter")
+import app
+from core import ArchiveNode, FileNode, FolderNode
+
+
+class Window:
+    """Заглушка окна с теми атрибутами, которые читает проверяемый метод"""
+    def __init__(self, current_node, selected):
+        self.current_node = current_node
+        self.selected = selected
+        self.renamed = []
+        self.read_only_archive = types.MethodType(app.AdvancedFileManager.read_only_archive, self)
+
+    def get_selected_nodes(self):
+        return self.selected
+
+    def rename_by_pattern(self, nodes):
+        self.renamed.append(nodes)
+
+    def get_input(self, title, prompt, initial):
+        self.renamed.append([initial])
+        return None
+
+
+@pytest.fixture
+def errors(monkeypatch):
+    shown = []
+    monkeypatch.setattr(app.messagebox, "showerror", lambda title, text: shown.append(text))
+    return shown
+
+
+def test_rename_blocked_inside_archive_for_any_selection(errors):
+    archive = ArchiveNode("x.zip", FolderNode("/tmp", None))
+    inner = FolderNode("docs", archive)
+    for selected in ([FileNode("a", inner)], [FileNode("a", inner), FileNode("b", inner)]):
+        window = Window(inner, selected)
+        app.AdvancedFileManager.rename_item(window)
+        assert window.renamed == []
+    assert len(errors) == 2
+
+
+def test_rename_outside_archive_goes_by_pattern_for_many(errors):
+    folder = FolderNode("/tmp", None)
+    window = Window(folder, [FileNode("a", folder), FileNode("b", folder)])
+    app.AdvancedFileManager.rename_item(window)
+    assert [[node.name for node in nodes] for nodes in window.renamed] == [["a", "b"]]
+    assert errors == []
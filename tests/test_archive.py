@@ -0,0 +1,103 @@
+"""Архивы как папки: оглавление, извлечение, опасные пути и испорченные даты"""
+import io
+import os
+import tarfile
+import time
+import zipfile
+
+import pytest
+
+from core import ArchiveCache, ArchiveIndex
+
+
+def make_zip(path):
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("docs/readme.txt", "привет")
+        archive.writestr("docs/img/a.png", b"png")
+        archive.writestr("top.txt", "top")
+        archive.writestr("empty/", "")
+        archive.writestr("../evil.txt", "evil")
+    return str(path)
+
+
+def make_tar(path):
+    with tarfile.open(path, "w:gz") as archive:
+        for name, data in (("src/main.py", b"print()"), ("src/lib/util.py", b"x = 1"), ("../../evil", b"!")):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = 1_700_000_000
+            archive.addfile(info, io.BytesIO(data))
+    return str(path)
+
+
+def names(entries):
+    return sorted((name, is_dir) for name, is_dir, *_ in entries)
+
+
+def test_zip_listing(tmp_path):
+    index = ArchiveIndex(make_zip(tmp_path / "x.zip"))
+    assert names(index.listing()) == [("docs", True), ("empty", True), ("top.txt", False)]
+    assert names(index.listing("docs")) == [("img", True), ("readme.txt", False)]
+    assert index.listing("empty") == []
+    with pytest.raises(FileNotFoundError):
+        index.listing("missing")
+
+
+def test_tar_listing_skips_parent_paths(tmp_path):
+    index = ArchiveIndex(make_tar(tmp_path / "x.tar.gz"))
+    assert names(index.listing()) == [("src", True)]
+    assert names(index.listing("src")) == [("lib", True), ("main.py", False)]
+    assert {name: mtime for name, _, _, mtime in index.listing("src")}["main.py"] == 1_700_000_000
+
+
+@pytest.mark.parametrize("make, name", [(make_zip, "x.zip"), (make_tar, "x.tar.gz")])
+def test_extract_keeps_relative_structure(tmp_path, make, name):
+    index = ArchiveIndex(make(tmp_path / name))
+    inner = "docs" if index.is_zip else "src"
+    out = tmp_path / "out"
+    progress = []
+    assert index.extract([inner], str(out), on_progress=lambda done, total: progress.append((done, total))) == []
+    extracted = sorted(os.path.relpath(os.path.join(folder, name), out)
+                       for folder, _, files in os.walk(out) for name in files)
+    if index.is_zip:
+        assert extracted == [os.path.join("docs", "img", "a.png"), os.path.join("docs", "readme.txt")]
+        assert (out / "docs" / "readme.txt").read_text() == "привет"
+    else:
+        assert extracted == [os.path.join("src", "lib", "util.py"), os.path.join("src", "main.py")]
+    assert progress[-1] == (2, 2)
+    assert not (tmp_path / "evil.txt").exists() and not (tmp_path.parent / "evil").exists()
+
+
+def test_extract_does_not_overwrite(tmp_path):
+    index = ArchiveIndex(make_zip(tmp_path / "x.zip"))
+    out = tmp_path / "out"
+    out.mkdir()
+    (out / "top.txt").write_text("mine")
+    errors = index.extract(["top.txt"], str(out))
+    assert [path for path, _ in errors] == [str(out / "top.txt")]
+    assert (out / "top.txt").read_text() == "mine"
+
+
+def test_bad_member_date_lists_without_date(tmp_path, monkeypatch):
+    path = make_zip(tmp_path / "x.zip")
+
+    def broken_mktime(value):
+        raise OverflowError("mktime argument out of range")
+
+    monkeypatch.setattr(time, "mktime", broken_mktime)
+    index = ArchiveIndex(path)
+    assert [mtime for name, _, _, mtime in index.listing() if name == "top.txt"] == [None]
+
+
+def test_cache_rereads_changed_archive_and_reports_broken(tmp_path):
+    cache = ArchiveCache()
+    path = make_zip(tmp_path / "x.zip")
+    first = cache.get(path)
+    assert cache.get(path) is first
+    with zipfile.ZipFile(path, "a") as archive:
+        archive.writestr("added.txt", "new content")
+    assert cache.get(path) is not first
+    broken = tmp_path / "broken.zip"
+    broken.write_bytes(b"not a zip at all")
+    with pytest.raises(OSError):
+        cache.get(str(broken))
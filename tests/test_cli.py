@@ -0,0 +1,69 @@
+"""Командная строка: вывод в JSON тех же данных, что показывает окно"""
+import os
+
+import pytest
+
+import core
+from cli import build_parser
+
+
+def run(*argv):
+    args = build_parser().parse_args([*argv, "--json"])
+    return args.func(args)
+
+
+@pytest.fixture
+def tree(tmp_path):
+    for name in ("b", "a", "z"):
+        (tmp_path / name).mkdir()
+    (tmp_path / "a" / "x.bin").write_bytes(b"x" * 100)
+    (tmp_path / "a" / "deep").mkdir()
+    (tmp_path / "a" / "deep" / "y.bin").write_bytes(b"y" * 20)
+    (tmp_path / "file10.txt").write_text("1234")
+    (tmp_path / "file2.txt").write_text("12")
+    return tmp_path
+
+
+def test_ls_sorts_naturally_with_folders_first(tree):
+    assert [item["name"] for item in run("ls", str(tree))] == ["a", "b", "z", "file2.txt", "file10.txt"]
+    assert [item["name"] for item in run("ls", str(tree), "--sort", "size")] == ["a", "b", "z", "file2.txt", "file10.txt"]
+
+
+def test_ls_reverse_keeps_folders_first(tree):
+    assert [item["name"] for item in run("ls", str(tree), "-r")] == ["z", "b", "a", "file10.txt", "file2.txt"]
+
+
+def test_du_sums_subtree_and_counts_duplicate_roots_once(tree):
+    result = run("du", str(tree / "a"), str(tree / "a"), str(tree / "b"), str(tree / "file10.txt"))
+    assert [item["size"] for item in result] == [120, 120, 0, 4]
+    assert run("du", str(tree))[0]["size"] == 126
+
+
+def test_find_by_mask_and_type(tree):
+    assert sorted(os.path.basename(path) for path in run("find", str(tree), "*.bin")) == ["x.bin", "y.bin"]
+    assert sorted(os.path.basename(path) for path in run("find", str(tree), "e", "--type", "d")) == ["deep"]
+
+
+def test_tree_depth(tree):
+    info = run("tree", str(tree), "--depth", "1")
+    assert [child["name"] for child in info["children"]] == ["a", "b", "z", "file2.txt", "file10.txt"]
+    assert "children" not in info["children"][0]
+
+
+def test_du_reports_engine_failure_instead_of_hanging(tree, monkeypatch):
+    def broken_visit(self, path):
+        raise RuntimeError("worker died")
+
+    monkeypatch.setattr(core.FolderSizeEngine, "visit", broken_visit)
+    with pytest.raises(OSError, match="worker died"):
+        run("du", str(tree / "a"))
+
+
+def test_dups_reports_engine_failure_instead_of_hanging(tree, monkeypatch):
+    def broken_walk(root, cancel_event):
+        raise RuntimeError("walk failed")
+        yield
+
+    monkeypatch.setattr(core, "walk_file_stats", broken_walk)
+    with pytest.raises(OSError, match="walk failed"):
+        run("dups", str(tree))
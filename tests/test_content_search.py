@@ -0,0 +1,48 @@
+"""Поиск по содержимому: регистр, строки совпадений, двоичные файлы"""
+import re
+import threading
+
+from core import ContentSearcher, caseless_pattern, grep_batch
+
+
+def grep(paths, text):
+    matches, files, binary = grep_batch([str(path) for path in paths], caseless_pattern(text), re.IGNORECASE)
+    return matches, binary
+
+
+def test_cyrillic_query_ignores_case(tmp_path):
+    path = tmp_path / "a.txt"
+    path.write_text("первая строка\nтут ПРИВЕТ мир\nпривет еще раз\n", encoding="utf-8")
+    matches, _ = grep([path], "Привет")
+    assert [(line, snippet) for _, line, snippet in matches] == [(2, "тут ПРИВЕТ мир"), (3, "привет еще раз")]
+
+
+def test_ascii_query_ignores_case_and_escapes(tmp_path):
+    path = tmp_path / "b.txt"
+    path.write_text("Hello World\na+b\naxb\n", encoding="utf-8")
+    assert [line for _, line, _ in grep([path], "HELLO")[0]] == [1]
+    assert [line for _, line, _ in grep([path], "a+b")[0]] == [2] # спецсимволы ищутся буквально
+
+
+def test_binary_files_skipped(tmp_path):
+    path = tmp_path / "c.bin"
+    path.write_bytes(b"\0\0" + "привет".encode("utf-8"))
+    matches, binary = grep([path], "привет")
+    assert matches == [] and binary == 1
+
+
+def test_searcher_streams_matches(tmp_path):
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "d.txt").write_text("Ёжик В ТУМАНЕ\n", encoding="utf-8")
+    (tmp_path / "e.txt").write_text("ничего\n", encoding="utf-8")
+    found = []
+    done = threading.Event()
+    searcher = ContentSearcher(workers=1)
+    try:
+        job = searcher.start(str(tmp_path), "ёжик в тумане", lambda job, matches: found.extend(matches), lambda job: done.set())
+        assert done.wait(60)
+    finally:
+        if searcher.pool is not None:
+            searcher.pool.shutdown()
+    assert [(line, snippet) for _, line, snippet in found] == [(1, "Ёжик В ТУМАНЕ")]
+    assert job.files == 2
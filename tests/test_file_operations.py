@@ -0,0 +1,122 @@
+"""Файловые операции: конфликты имен и групповое переименование"""
+import threading
+
+import pytest
+
+from core import FileOpJob, FileOperationEngine, pattern_names, unique_path
+
+
+def run(job, choice=None):
+    """Выполняет задачу до конца; на каждый конфликт отвечает choice"""
+    conflicts = []
+    done = threading.Event()
+
+    def on_conflict(job, target, reply):
+        conflicts.append(target)
+        reply(choice)
+
+    FileOperationEngine().submit(job, lambda job: None, lambda job, changes: None, on_conflict,
+                                 lambda job: done.set())
+    assert done.wait(30)
+    return conflicts
+
+
+@pytest.fixture
+def tree(tmp_path):
+    (tmp_path / "src").mkdir()
+    (tmp_path / "dst").mkdir()
+    (tmp_path / "src" / "a.txt").write_text("новый")
+    (tmp_path / "dst" / "a.txt").write_text("старый")
+    return tmp_path
+
+
+@pytest.mark.parametrize("choice, names, content", [
+    ("skip", ["a.txt"], "старый"),
+    ("overwrite", ["a.txt"], "новый"),
+    ("rename", ["a (2).txt", "a.txt"], "старый"),
+])
+def test_copy_conflict_policies(tree, choice, names, content):
+    job = FileOpJob("copy", [str(tree / "src" / "a.txt")], str(tree / "dst"))
+    conflicts = run(job, choice)
+    assert conflicts == [str(tree / "dst" / "a.txt")]
+    assert sorted(p.name for p in (tree / "dst").iterdir()) == names
+    assert (tree / "dst" / "a.txt").read_text() == content
+    assert (tree / "src" / "a.txt").exists()
+    assert job.errors == []
+
+
+def test_cancel_on_conflict_stops_job(tree):
+    (tree / "src" / "b.txt").write_text("b")
+    job = FileOpJob("copy", [str(tree / "src" / "a.txt"), str(tree / "src" / "b.txt")], str(tree / "dst"))
+    run(job, "cancel")
+    assert job.cancelled
+    assert not (tree / "dst" / "b.txt").exists()
+
+
+def test_move_merges_folders_with_policy_for_all(tree):
+    (tree / "src" / "sub").mkdir()
+    (tree / "src" / "sub" / "x.txt").write_text("x")
+    (tree / "dst" / "sub").mkdir()
+    (tree / "dst" / "sub" / "x.txt").write_text("old x")
+    (tree / "dst" / "sub" / "y.txt").write_text("y")
+    job = FileOpJob("move", [str(tree / "src" / "sub")], str(tree / "dst"))
+    job.conflict_policy = "overwrite" # ответ "для всех" выбран заранее
+    assert run(job) == []
+    assert sorted(p.name for p in (tree / "dst" / "sub").iterdir()) == ["x.txt", "y.txt"]
+    assert (tree / "dst" / "sub" / "x.txt").read_text() == "x"
+    assert not (tree / "src" / "sub").exists()
+
+
+def test_copy_into_same_folder_keeps_both(tree):
+    job = FileOpJob("copy", [str(tree / "dst" / "a.txt")], str(tree / "dst"))
+    assert run(job) == [] # та же запись - без вопроса, рядом с оригиналом
+    assert sorted(p.name for p in (tree / "dst").iterdir()) == ["a (2).txt", "a.txt"]
+
+
+def test_unique_path(tmp_path):
+    (tmp_path / "a.txt").touch()
+    (tmp_path / "a (2).txt").touch()
+    (tmp_path / ".bashrc").touch()
+    assert unique_path(str(tmp_path / "a.txt")) == str(tmp_path / "a (3).txt")
+    assert unique_path(str(tmp_path / ".bashrc")) == str(tmp_path / ".bashrc (2)")
+
+
+def test_pattern_names():
+    names = ["IMG_001.jpg", "IMG_002.jpg", "notes.txt"]
+    assert pattern_names(names, r"IMG_(\d+)", r"photo-\1") == ["photo-001.jpg", "photo-002.jpg", "notes.txt"]
+    assert pattern_names(names, r"^.*?(\.\w+)$", r"{n:03}\1", start=7) == ["007.jpg", "008.jpg", "009.txt"]
+
+
+def test_rename_chain_goes_through_temporary_names(tmp_path):
+    for name in ("a", "b", "c"):
+        (tmp_path / name).write_text(name)
+    sources = [str(tmp_path / name) for name in ("a", "b", "c")]
+    job = FileOpJob("rename", sources, names=pattern_names(["a", "b", "c"], r"^(.)$", r"\1.old"))
+    run(job)
+    assert job.errors == []
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["a.old", "b.old", "c.old"]
+
+    (tmp_path / "x").write_text("x")
+    (tmp_path / "y").write_text("y")
+    job = FileOpJob("rename", [str(tmp_path / "x"), str(tmp_path / "y")], names=["y", "z"]) # x -> y, y -> z
+    run(job)
+    assert job.errors == []
+    assert (tmp_path / "y").read_text() == "x" and (tmp_path / "z").read_text() == "y"
+
+
+def test_rename_onto_existing_entry_is_an_error(tmp_path):
+    (tmp_path / "a").write_text("a")
+    (tmp_path / "b").write_text("b")
+    job = FileOpJob("rename", [str(tmp_path / "a")], names=["b"])
+    run(job)
+    assert [path for path, _ in job.errors] == [str(tmp_path / "a")]
+    assert (tmp_path / "b").read_text() == "b"
+
+
+@pytest.mark.parametrize("preset", [None, "replace"])
+def test_unknown_conflict_choice_keeps_target(tree, preset):
+    job = FileOpJob("copy", [str(tree / "src" / "a.txt")], str(tree / "dst"))
+    job.conflict_policy = preset # опечатка в ответе "для всех" или в ответе на вопрос
+    run(job, "replace")
+    assert [path for path, _ in job.errors] == [str(tree / "src" / "a.txt")]
+    assert (tree / "dst" / "a.txt").read_text() == "старый"
@@ -0,0 +1,98 @@
+"""Индекс имен: изменения из очереди, поиск, перенос и удаление поддеревьев"""
+import time
+
+from core import FilenameIndex
+
+
+def settled(index, check, timeout=10):
+    """Ждет, пока фоновый поток применит изменения и check() станет истинным"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with index.lock:
+            if index.queue.empty() and check():
+                return True
+        time.sleep(0.01)
+    return False
+
+
+def found(index, query):
+    return sorted(index.search(query))
+
+
+def test_replace_add_remove_rename():
+    index = FilenameIndex()
+    index.replace_dir("/r", [("Отчет.txt", False), ("docs", True), ("readme.md", False)])
+    assert settled(index, lambda: index.count == 3)
+    assert found(index, "отчет") == [("/r", "Отчет.txt", False)]
+    assert found(index, "*.md") == [("/r", "readme.md", False)]
+
+    index.add("/r", "readme.md", False) # повторное добавление не дублирует запись
+    index.add("/r", "notes.md", False)
+    assert settled(index, lambda: index.count == 4)
+    assert found(index, "*.md") == [("/r", "notes.md", False), ("/r", "readme.md", False)]
+
+    index.rename("/r", "notes.md", "todo.txt")
+    index.remove("/r", "readme.md")
+    assert settled(index, lambda: index.count == 3)
+    assert found(index, "*.md") == []
+    assert found(index, "todo") == [("/r", "todo.txt", False)]
+
+    index.replace_dir("/r", [("docs", True), ("new.md", False)])
+    assert settled(index, lambda: index.count == 2)
+    assert found(index, "*.*") == [("/r", "new.md", False)]
+
+
+def test_removed_ids_reused_without_stale_matches():
+    index = FilenameIndex()
+    index.replace_dir("/big", [(f"file{i:05d}.txt", False) for i in range(5000)])
+    for i in range(0, 5000, 2):
+        index.remove("/big", f"file{i:05d}.txt")
+    assert settled(index, lambda: index.count == 2500)
+    index.replace_dir("/other", [(f"other{i}.log", False) for i in range(2500)])
+    assert settled(index, lambda: index.count == 5000)
+    assert len(index.free) == 0 # номера удаленных записей заняты новыми
+    assert found(index, "file00002") == []
+    assert found(index, "file00003") == [("/big", "file00003.txt", False)]
+    assert len(index.search("other", limit=10_000)) == 2500
+
+
+def test_move_tree_renames_nested_folders():
+    index = FilenameIndex()
+    index.replace_dir("/r/a", [("b", True), ("top.txt", False)])
+    index.replace_dir("/r/a/b", [("deep.txt", False), ("c", True)])
+    index.replace_dir("/r/a/b/c", [("deeper.txt", False)])
+    index.replace_dir("/r/ab", [("sibling.txt", False)]) # общий префикс пути, но не вложенная папка
+    assert settled(index, lambda: index.count == 6)
+
+    index.move_tree("/r/a/b", "/r/z")
+    assert settled(index, lambda: "/r/z/c" in index.dir_ids)
+    assert found(index, "deep") == [("/r/z", "deep.txt", False), ("/r/z/c", "deeper.txt", False)]
+    assert found(index, "sibling") == [("/r/ab", "sibling.txt", False)]
+    assert "/r/a/b" not in index.dir_ids
+    assert sorted(index.dir_paths[i] for i in index.subtree_dirs("/r")) == ["/r", "/r/a", "/r/ab", "/r/z", "/r/z/c"]
+
+
+def test_remove_tree_forgets_subtree_only():
+    index = FilenameIndex()
+    index.replace_dir("/r/a", [("b", True), ("keep.txt", False)])
+    index.replace_dir("/r/a/b", [("gone.txt", False)])
+    index.replace_dir("/r/a/b/c", [("gone2.txt", False)])
+    index.replace_dir("/r/ab", [("keep2.txt", False)])
+    assert settled(index, lambda: index.count == 5)
+
+    index.remove_tree("/r/a/b")
+    assert settled(index, lambda: index.count == 3)
+    assert found(index, "gone") == []
+    assert found(index, "keep") == [("/r/a", "keep.txt", False), ("/r/ab", "keep2.txt", False)]
+    assert index.subtree_dirs("/r/a/b") == []
+    assert sorted(index.dir_paths[i] for i in index.subtree_dirs("/r/a")) == ["/r/a"]
+
+
+def test_move_tree_over_indexed_target():
+    index = FilenameIndex()
+    index.replace_dir("/r/old", [("fresh.txt", False)])
+    index.replace_dir("/r/new", [("stale.txt", False)])
+    assert settled(index, lambda: index.count == 2)
+    index.move_tree("/r/old", "/r/new")
+    assert settled(index, lambda: index.count == 1)
+    assert found(index, "*.txt") == [("/r/new", "fresh.txt", False)]
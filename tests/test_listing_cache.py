@@ -0,0 +1,66 @@
+"""Кэш списков папок: оценка памяти узлов и вытеснение холодных папок"""
+import gc
+import tracemalloc
+
+import pytest
+
+from core import FileNode, FolderNode, ListingCache, entry_bytes, view_sort_key
+
+
+def measured_bytes(template, count=5000):
+    """Сколько на самом деле занимает узел с именем и ключом сортировки (как node_memory в bench.py)"""
+    parent = FolderNode("p", None)
+    parent.children = []
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    nodes = [FileNode(template.format(i), parent, size=1000 + i, mtime=1.7e9 + i) for i in range(count)]
+    parent.add_children(nodes)
+    for node in nodes:
+        view_sort_key(node)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used / count, sum(entry_bytes(node) for node in nodes) / count
+
+
+@pytest.mark.parametrize("template", ["file_{:05d}.txt", "Очень длинное имя документа про отчет за квартал {:05d}.docx"])
+def test_entry_bytes_close_to_measured(template):
+    used, estimate = measured_bytes(template)
+    assert 0.75 * used < estimate < 1.25 * used
+
+
+def folder(name, parent, count):
+    node = FolderNode(name, parent)
+    node.children = [FileNode(f"{name}{i}", node) for i in range(count)]
+    return node
+
+
+def test_evicts_coldest_unpinned_with_subtree():
+    root = FolderNode("r", None)
+    cold, warm, pinned = folder("cold", root, 10), folder("warm", root, 10), folder("pin", root, 10)
+    child = folder("child", cold, 10)
+    cache = ListingCache(max_entries=25)
+    for node in (cold, child, pinned, warm):
+        cache.add(node)
+    assert cache.over_limit()
+    cache.lookup(cold) # cold стала недавней, но ее подпапка child - нет
+    cache.evict({pinned})
+    assert child.children is None and child not in cache
+    assert cold in cache and pinned in cache
+    assert not cache.over_limit()
+    assert cache.entries == sum(len(node.children) for node in cache.nodes)
+
+
+def test_rename_charged_by_entry_bytes_difference():
+    parent = folder("p", FolderNode("r", None), 3)
+    cache = ListingCache()
+    cache.add(parent)
+    child = parent.children[0]
+    old_bytes = entry_bytes(child)
+    parent.rename_child(child, "Переименованный документ.txt")
+    cache.resize(parent, 0, entry_bytes(child) - old_bytes) # как при переименовании в окне
+    renamed = cache.bytes
+    cache.add(parent) # пересчет с нуля
+    assert cache.bytes == renamed
+    cache.discard(parent)
+    assert cache.bytes == 0 and cache.entries == 0
@@ -0,0 +1,104 @@
+"""Узлы и переходы: естественная сортировка, поиск узла по пути, история"""
+import os
+
+from core import (
+    ComputerNode, DriveNode, FileNode, FolderNode, NavigationHistory, ViewSnapshot, natural_key,
+    resolve_path, view_sort_key,
+)
+
+
+def test_natural_key_orders_numbers_and_ignores_case():
+    names = ["file10.txt", "File2.txt", "file1.txt", "file02.txt", "Файл3", "файл20"]
+    assert sorted(names, key=natural_key) == ["file1.txt", "File2.txt", "file02.txt", "file10.txt", "Файл3", "файл20"]
+    assert natural_key("a") != natural_key("A") # разные имена - разные ключи
+
+
+def test_view_sort_key_puts_folders_first():
+    parent = FolderNode("p", None)
+    nodes = [FileNode("b.txt", parent, size=5, mtime=2), FolderNode("z", parent, mtime=1),
+             FileNode("a.py", parent, size=50, mtime=1), FolderNode("a", parent, mtime=3)]
+    by = lambda column: [node.name for node in sorted(nodes, key=lambda node: view_sort_key(node, column))]
+    assert by("name") == ["a", "z", "a.py", "b.txt"]
+    assert by("size") == ["a", "z", "b.txt", "a.py"]
+    assert by("modified") == ["z", "a", "a.py", "b.txt"]
+    assert by("type") == ["a", "z", "a.py", "b.txt"]
+
+
+def make_root():
+    root = ComputerNode("Этот компьютер")
+    root.children = [DriveNode(os.sep, os.sep, root), DriveNode(os.path.join(os.sep, "mnt", "data"), "data", root)]
+    return root
+
+
+def test_resolve_path_picks_longest_drive_and_creates_placeholders():
+    root = make_root()
+    placeholders = {}
+    path = os.path.join(os.sep, "mnt", "data", "photos", "2024")
+    node = resolve_path(root, path, placeholders)
+    assert node.path == path
+    assert node.parent.parent is root.children[1]
+    assert set(placeholders) == {os.path.dirname(path), path}
+    assert resolve_path(root, path, placeholders) is node # тот же узел, пока папка не прочитана
+    assert resolve_path(root, os.path.join(os.sep, "mnt", "data")) is root.children[1]
+    assert resolve_path(root, os.path.join(os.sep, "usr", "lib"), create=False) is None
+
+
+def test_resolve_path_uses_existing_children():
+    root = make_root()
+    usr = FolderNode("usr", root.children[0])
+    root.children[0].add_children([usr, FileNode("file", root.children[0])])
+    usr.children = []
+    assert resolve_path(root, os.path.join(os.sep, "usr"), create=False) is usr
+    assert resolve_path(root, os.path.join(os.sep, "usr", "lib"), create=False) is None # usr прочитана, lib нет
+    assert resolve_path(root, os.path.join(os.sep, "file"), create=False) is None # файл - не папка
+
+
+def snapshot(path, **kwargs):
+    return ViewSnapshot(path, **kwargs)
+
+
+def test_history_back_forward_and_push_truncates():
+    history = NavigationHistory()
+    for path in ("/a", "/b", "/c"):
+        history.push(snapshot(path))
+    history.save(snapshot("/c", top=40, focus="x"))
+    assert history.back().path == "/b"
+    assert history.back().path == "/a"
+    assert not history.can_back
+    assert history.forward().path == "/b"
+    restored = history.forward()
+    assert (restored.path, restored.top, restored.focus) == ("/c", 40, "x")
+    history.back()
+    history.push(snapshot("/d")) # записи "вперед" отбрасываются
+    assert [entry.path for entry in history.entries] == ["/a", "/b", "/d"]
+    history.push(snapshot("/d", top=5)) # та же папка не дублируется
+    assert [entry.path for entry in history.entries] == ["/a", "/b", "/d"] and history.entries[-1].top == 5
+
+
+def test_history_compaction_keeps_nearest_repeat_then_drops_oldest():
+    history = NavigationHistory(limit=4)
+    for path in ("/a", "/b", "/a", "/c", "/a"):
+        history.push(snapshot(path))
+    # повторные /a схлопнулись в ближайшее к текущей позиции
+    assert [entry.path for entry in history.entries] == ["/b", "/c", "/a"]
+    assert history.entries[history.index].path == "/a"
+    for path in ("/d", "/e", "/f"):
+        history.push(snapshot(path))
+    assert [entry.path for entry in history.entries] == ["/a", "/d", "/e", "/f"]
+    assert history.index == 3 and len(history.entries) == history.limit
+
+
+def test_history_compaction_keeps_current_when_in_the_middle():
+    history = NavigationHistory(limit=3)
+    for path in ("/a", "/b", "/c"):
+        history.push(snapshot(path))
+    history.back()
+    history.entries.extend([snapshot("/x"), snapshot("/y")]) # записи "вперед"
+    history.compact()
+    assert len(history.entries) == 3
+    assert history.entries[history.index].path == "/b"
+
+
+def test_snapshot_limits_selection():
+    many = [f"f{i}" for i in range(100_000)]
+    assert len(ViewSnapshot("/a", selected=many).selected) < len(many)